@@ -14,52 +14,68 @@ Optional Arguments: <parameter2 = clipLandtype = Land type (feature layer)>
                     <parameter7 = clipOldGrowth = Old Growth (table)>
                     <parameter8 = clipHarvest = Past harvests in FACTS (feature layer)>
                     <parameter9 = clipCHM = Canopy height model (raster layer)>
-Description:        <Clips layers needed to identify harvest locations to a project area.>
+                    <parameter10 = workers = Number of layers to clip at once; 0 uses every CPU (long)>
+                    <parameter11 = runCache = Run cache folder; blank disables the cache (folder)>
+                    <parameter12 = runLog = JSON lines file the stage timings are appended to (file)>
+                    <parameter13 = profileStage = Stage to profile: ClipLayers or ClipCHM (string)>
+Description:        <Clips layers needed to identify harvest locations to a project area.
+                     Each source is narrowed to the features meeting the project area envelope before the exact clip,
+                     and with several workers the layers are clipped concurrently (clipping.py). The CHM is clipped by
+                     reading only the window over the project area (chmraster.clip_raster); pass the clipped CHM to the
+                     TreeTopPoints tool with a blank clipping feature so it is not clipped again.
+                     With a cache folder, the clipped outputs are restored from the cache when the project area, the
+                     sources and the output names are unchanged since a previous run (runcache.py).
+                     Every stage is timed and measured in the messages and the run log (instrument.py).>
 """
 
 import arcpy
 import os.path
+import chmraster
+import clipping
+import instrument
+import runcache
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.overwriteOutput = True
 
-def ScriptTool(projectArea, outPath, clipLandtype, clipRiperian, clipMgmtArea, clipSpecialUse, clipVegPoly, clipOldGrowth, clipHarvest, clipCHM):
+def ScriptTool(projectArea, outPath, clipLandtype, clipRiperian, clipMgmtArea, clipSpecialUse, clipVegPoly, clipOldGrowth, clipHarvest, clipCHM, workers="", runCache="", runLog="", profileStage=""):
     """ScriptTool function docstring"""
 
     arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(26911) #NAD_1983_UTM_Zone_11N
+    log = instrument.RunLog("ClipData", runLog, profileStage)
 
    
-    # Clip features
-    fcs = ["clipLandtype", "clipRiperian", "clipMgmtArea", "clipSpecialUse", "clipHarvest"]
-    for fc in fcs:
-        if arcpy.Exists(eval(fc)):
-            name = fc
-            feature = eval(fc)
+    # Clip features (and stands) to the project area, several at a time
+    names = ["clipLandtype", "clipRiperian", "clipMgmtArea", "clipSpecialUse", "clipHarvest", "clipVegPoly"]
+    sources = [clipLandtype, clipRiperian, clipMgmtArea, clipSpecialUse, clipHarvest, clipVegPoly]
+    layers = []
+    joins = {}
+    for name, feature in zip(names, sources):
+        if arcpy.Exists(feature):
             if outPath[-4:] == ".gdb":
                 out = os.path.join(outPath, name)
             else:
                 out = os.path.join(outPath, name) + ".shp"
-            arcpy.AddMessage("Clipping " + name + "...")
-            arcpy.analysis.Clip(in_features = feature, clip_features = projectArea, out_feature_class = out)
-
-            arcpy.AddMessage("Complete")
+            layers.append((feature, out))
 
-    # Add old growth to stands
-    fcs = ["clipVegPoly"]
-    for fc in fcs:
-        if arcpy.Exists(eval(fc)):
-            name = fc
-            feature = eval(fc)
-            if outPath[-4:] == ".gdb":
-                out = os.path.join(outPath, name)
-            else:
-                out = os.path.join(outPath, name) + ".shp"
-            arcpy.AddMessage("Clipping " + name + "...")
-            with arcpy.EnvManager(outputCoordinateSystem = arcpy.SpatialReference(26911)):
-                arcpy.analysis.Clip(in_features = feature, clip_features = projectArea, out_feature_class = out)
-            if arcpy.Exists(clipOldGrowth):
+            # Add old growth to stands while they are written
+            if name == "clipVegPoly" and arcpy.Exists(clipOldGrowth):
                 joinFields = ["OLD_GROWTH_STATUS", "OLD_GROWTH_STATUS_METHOD", "OLD_GROWTH_STATUS_YEAR"] 
-                arcpy.management.JoinField(in_data = out, in_field = "SETTING_ID", join_table = clipOldGrowth, join_field = "FSVEG_SETTING_ID", fields = joinFields)
+                joins[out] = (clipOldGrowth, "SETTING_ID", "FSVEG_SETTING_ID", joinFields)
+    outCHM = os.path.join(outPath, "clipCHM") + ("" if outPath[-4:] == ".gdb" else ".tif")
+    outputs = [out for source, out in layers] + ([outCHM] if clipCHM else [])
+
+    # Reuse the outputs of an earlier run with the same inputs
+    cache = runcache.open_cache(runCache)
+    if cache:
+        key = cache.key("ClipData", [projectArea, clipOldGrowth, clipCHM] + [source for source, out in layers], outputs)
+        if cache.restore(key, outputs):
+            arcpy.AddMessage("Restored clipped data from the cache")
+            return
+
+    with log.stage("ClipLayers", [source for source, out in layers]) as stage:
+        for out in clipping.clip_layers(layers, projectArea, workers, joins):
             arcpy.AddMessage("Complete")
+        stage.outputs(*[out for source, out in layers])
 
     # Extract rasters
     if clipCHM:
@@ -71,11 +87,14 @@ def ScriptTool(projectArea, outPath, clipLandtype, clipRiperian, clipMgmtArea, c
             if outPath[-4:] != ".gdb":
                 out = out + ".tif"
             arcpy.AddMessage("Clipping " + name + "...")
-            outExtractByMask = arcpy.sa.ExtractByMask(in_raster = raster, in_mask_data = projectArea)
-            arcpy.management.CopyRaster(outExtractByMask, out)
-            #outExtractByMask.save(out)
+            with log.stage("ClipCHM", [raster]) as stage:
+                chmraster.clip_raster(raster, projectArea, out)
+                stage.outputs(out)
             arcpy.AddMessage("Complete")
 
+    if cache:
+        cache.store(key, outputs)
+
 if __name__ == '__main__':
     # ScriptTool parameters
     parameter0 = projectArea = arcpy.GetParameterAsText(0)
@@ -88,8 +107,12 @@ if __name__ == '__main__':
     parameter7 = clipOldGrowth = arcpy.GetParameterAsText(7)
     parameter8 = clipHarvest = arcpy.GetParameterAsText(8)
     parameter9 = clipCHM = arcpy.GetParameterAsText(9)
+    parameter10 = workers = arcpy.GetParameterAsText(10) if arcpy.GetArgumentCount() > 10 else ""
+    parameter11 = runCache = arcpy.GetParameterAsText(11) if arcpy.GetArgumentCount() > 11 else ""
+    parameter12 = runLog = arcpy.GetParameterAsText(12) if arcpy.GetArgumentCount() > 12 else ""
+    parameter13 = profileStage = arcpy.GetParameterAsText(13) if arcpy.GetArgumentCount() > 13 else ""
     
-    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9)
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13)
 
 
 
@@ -5,32 +5,213 @@ Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
 Author:             <Anthony Martinez>
 Usage:              <Input canopy height raster and project area (and adjust option parameters) to output point layer with location and heights of tree tops.>
 Required Arguments: <parameter0 = Canopy height model (raster layer)>
-                    <parameter1 = Clipping feature (feature layer)>
+                    <parameter1 = Clipping feature; blank when the CHM was already clipped by the ClipData tool (feature layer)>
                     <parameter4 = Minimum tree height in feet(double)>
                     <parameter5 = Output workspace (workspace)>
 Optional Arguments: <parameter2 = Canopy height model smoothing switch (boolean)>
                     <parameter3 = Convert canopy heights from m to ft (boolean)>
+                    <parameter6 = Detector engine, "NumPy" (default) or "ArcGIS" (string)>
+                    <parameter7 = Tile size in cells for the NumPy engine; blank reads the whole CHM into memory (long)>
+                    <parameter8 = Number of worker processes for tiled detection; 0 uses every CPU (long)>
+                    <parameter9 = Fused preprocessing switch for the NumPy engine (boolean)>
+                    <parameter10 = Crown width coefficients "c0 c1 c2 ..." for a height-adaptive window in the NumPy engine (string)>
+                    <parameter11 = Crown segmentation switch (boolean)>
+                    <parameter12 = Maximum crown radius in map units, default 10 (double)>
+                    <parameter13 = Run cache folder; blank disables the cache (folder)>
+                    <parameter14 = JSON lines file the stage timings are appended to (file)>
+                    <parameter15 = Stage to profile: ClipCHM, DetectTreeTops or SegmentCrowns (string)>
 Description:        <Detects and computes the location and height of individual trees within the LiDAR-derived Canopy Height Model (CHM).
                      The algorithm implemented in this function is local maximum with a fixed window size.
                      Adapted from FindTreeCHM tool from "rLiDAR" R package:
                          Carlos Alberto Silva, Nicholas L. Crookston, Andrew T. Hudak, Lee A. Vierling, Carine Klauberg, Adrian Cardil and Caio Hamamura (2021).
                          rLiDAR: LiDAR Data Processing and Visualization.
-                         R package version 0.1.5. https://CRAN.R-project.org/package=rLiDAR>
+                         R package version 0.1.5. https://CRAN.R-project.org/package=rLiDAR
+                     The CHM is clipped by reading only the window over the clipping features (chmraster.clip_raster).
+                     The NumPy engine (treetops.py) gives the same tree tops as the ArcGIS engine without writing
+                     intermediate rasters. The ArcGIS engine is kept for comparison.
+                     With a tile size, the NumPy engine streams the CHM in tiles with a halo as wide as the smoothing and
+                     local maximum windows, so memory use depends on the tile size rather than the project size.
+                     Tiles can be detected on several worker processes; TreeIds follow the row-major scan order of the
+                     whole CHM, so they are the same for any tile size or number of workers.
+                     Fused preprocessing smooths, converts and applies the minimum height in one pass over row blocks into
+                     a single float32 buffer. The tree tops are unchanged, but cells below the minimum tree height are
+                     NoData in the saved CHM_ft raster.
+                     By default the local maximum window is a fixed 5 x 5 cells. Given crown width coefficients, each cell
+                     is instead searched with a window as wide as the crown predicted for its height,
+                     crown width (map units) = c0 + c1 * height + c2 * height^2 + ..., between 3 and 21 cells.
+                     Crown segmentation floods the inverted CHM from the tree tops (marker controlled watershed) over cells
+                     above the minimum tree height, saves a CrownSeg raster of TreeIds and adds CrownArea (map units
+                     squared) and CrownHt fields to the tree tops.
+                     With a cache folder, the outputs are restored from the cache when the CHM, the clipping features and
+                     the detection parameters are unchanged since a previous run (runcache.py).
+                     Every stage is timed and measured in the messages and the run log (instrument.py).>
 """
 import arcpy
+import numpy
 import os.path
+import chmraster
+import instrument
+import parallel
+import runcache
+import treetops
 
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.overwriteOutput = True
 
 
-def ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5):
+def ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6="", parameter7="", parameter8="", parameter9="", parameter10="", parameter11="", parameter12="", parameter13="", parameter14="", parameter15=""):
     """ScriptTool function docstring"""
+    log = instrument.RunLog("TreeTopPoints", parameter14, parameter15)
+
+    # Reuse the outputs of an earlier run with the same inputs; the tile size and workers do not change them
+    cache = runcache.open_cache(parameter13)
+    if cache:
+        outputs = OutputPaths(parameter5, parameter11)
+        clipPath = arcpy.Describe(parameter1).catalogPath if parameter1 else ""
+        key = cache.key("TreeTopPoints", [parameter0, clipPath], [parameter2, parameter3, parameter4, parameter6, parameter9, parameter10, parameter11, parameter12, outputs])
+        if cache.restore(key, outputs):
+            arcpy.AddMessage("Restored tree tops from the cache")
+            return
+
     # Load Canopy height model
-    arcpy.AddMessage("(0/6) Clipping canopy height model")
-    CHM_Ext = arcpy.sa.ExtractByMask(in_raster = parameter0, in_mask_data = parameter1)
-    arcpy.AddMessage("(1/6) Clipped canopy height model")
-    
+    if parameter1:
+        arcpy.AddMessage("(0/6) Clipping canopy height model")
+        with log.stage("ClipCHM", [parameter0]) as stage:
+            CHM_Ext = chmraster.clip_raster(parameter0, parameter1, arcpy.CreateScratchName("CHM_Ext", ".tif", "RasterDataset", arcpy.env.scratchFolder))
+            stage.outputs(CHM_Ext)
+        arcpy.AddMessage("(1/6) Clipped canopy height model")
+    else:
+        # Already clipped, e.g. by the ClipData tool
+        CHM_Ext = arcpy.Raster(parameter0)
+
+    # Save tree points, canopy segmentation, and canopy height model to desired output location
+    outRaster, outTreeTop = OutputPaths(parameter5, "")
+
+    with log.stage("DetectTreeTops", [CHM_Ext]) as stage:
+        if parameter6.lower() == 'arcgis':
+            trees = ArcGISDetector(CHM_Ext, parameter2, parameter3, parameter4, outRaster, outTreeTop)
+        else:
+            trees = NumPyDetector(CHM_Ext, parameter2, parameter3, parameter4, outRaster, outTreeTop, parameter7, parameter8, parameter9, parameter10)
+        stage.outputs(outRaster, outTreeTop)
+    arcpy.AddMessage("(6/6) Saved files to workspace")
+
+    # Segment crowns around the tree tops
+    if parameter11.lower() == 'true':
+        outSeg = OutputPaths(parameter5, parameter11)[2]
+        maxRadius = float(parameter12) if parameter12 else 10.0
+        with log.stage("SegmentCrowns", [outRaster]) as stage:
+            SegmentCrowns(trees, outRaster, outTreeTop, outSeg, float(parameter4), maxRadius, parameter7, parameter8)
+            stage.outputs(outSeg)
+        arcpy.AddMessage("Segmented tree crowns")
+
+    if cache:
+        cache.store(key, outputs)
+
+
+def OutputPaths(outPath, segment):
+    """Paths of the CHM_ft raster, the tree tops and, when segmenting crowns, the CrownSeg raster"""
+    if outPath[-4:] == ".gdb":
+        names = ["CHM_ft", "TreeTop", "CrownSeg"]
+    else:
+        names = ["CHM_ft.tif", "TreeTop.shp", "CrownSeg.tif"]
+    if segment.lower() != 'true':
+        names = names[:2]
+    return [os.path.join(outPath, arcpy.ValidateTableName(name, outPath)) for name in names]
+
+
+def SegmentCrowns(trees, outRaster, outTreeTop, outSeg, minHeight, maxRadius, tileSize="", workers=""):
+    """Watershed crown segmentation of the saved CHM_ft raster, seeded by the tree tops"""
+    CHM_Ft = arcpy.Raster(outRaster)
+    geotransform = chmraster.raster_geotransform(CHM_Ft)
+    radiusCells = int(numpy.ceil(maxRadius / CHM_Ft.meanCellWidth))
+    workers = parallel.worker_count(workers)
+    if tileSize or workers > 1:
+        labels = chmraster.RasterBlockWriter(CHM_Ft, "32_BIT_SIGNED", 0)
+        crowns = treetops.segment_crowns_tiled(chmraster.RasterBlockReader(CHM_Ft), trees, geotransform, minHeight, radiusCells,
+                                               tile_size = int(tileSize or 2048), out = labels, workers = workers)
+        labels.save(outSeg)
+    else:
+        crowns = treetops.segment_crowns(chmraster.raster_to_array(CHM_Ft), trees, geotransform, minHeight, radiusCells)
+        chmraster.array_to_raster(crowns.labels, CHM_Ft, outSeg, 0)
+
+    # Join crown metrics to the tree tops by TreeId
+    crownArray = numpy.zeros(trees.tree_id.size, dtype = [("TreeId", "i4"), ("CrownArea", "f8"), ("CrownHt", "f8")])
+    crownArray["TreeId"] = trees.tree_id
+    crownArray["CrownArea"] = crowns.area
+    crownArray["CrownHt"] = crowns.height
+    arcpy.da.ExtendTable(outTreeTop, "TreeId", crownArray, "TreeId", append_only = False)
+
+
+def TreeTopsToFeatures(trees, spatialReference, outTreeTop):
+    """Write a treetops.TreeTops tuple to a point feature class with TreeId and Height fields"""
+    treeArray = numpy.zeros(trees.tree_id.size, dtype = [("POINT_X", "f8"), ("POINT_Y", "f8"), ("TreeId", "i4"), ("Height", "f8")])
+    treeArray["POINT_X"] = trees.x
+    treeArray["POINT_Y"] = trees.y
+    treeArray["TreeId"] = trees.tree_id
+    treeArray["Height"] = trees.height
+    if arcpy.Exists(outTreeTop):
+        arcpy.management.Delete(outTreeTop)
+    arcpy.da.NumPyArrayToFeatureClass(treeArray, outTreeTop, ("POINT_X", "POINT_Y"), spatialReference)
+    arcpy.management.AlterField(in_table = outTreeTop, field = "Height", new_field_alias = "Height (ft)")
+
+
+def FeaturesToTreeTops(treeTop):
+    """Read a tree top feature class into a treetops.TreeTops tuple"""
+    treeArray = arcpy.da.FeatureClassToNumPyArray(treeTop, ["SHAPE@X", "SHAPE@Y", "Height", "TreeId"])
+    return treetops.TreeTops(treeArray["SHAPE@X"], treeArray["SHAPE@Y"], treeArray["Height"].astype(numpy.float32), treeArray["TreeId"].astype(numpy.int32))
+
+
+def NumPyDetector(CHM_Ext, parameter2, parameter3, parameter4, outRaster, outTreeTop, tileSize="", workers="", fused="", crownWidth=""):
+    """Detect tree tops with the NumPy engine in treetops.py"""
+    smooth = parameter2.lower() == 'true'
+    toFeet = parameter3.lower() == 'true'
+    fused = fused.lower() == 'true'
+    if crownWidth.strip():
+        window = treetops.VariableWindow(treetops.CrownWidth(*crownWidth.split()), CHM_Ext.meanCellWidth)
+        arcpy.AddMessage("Using a height-adaptive local maximum window")
+    else:
+        window = 5
+    geotransform = chmraster.raster_geotransform(CHM_Ext)
+    workers = parallel.worker_count(workers)
+    if workers > 1 and not tileSize:
+        tileSize = "2048"
+
+    if tileSize:
+        # Stream the CHM through the detector one tile at a time
+        arcpy.AddMessage("(2/6) Processing canopy height model in " + tileSize + " cell tiles on " + str(workers) + " worker(s)")
+        if workers > 1 and CHM_Ext.isTemporary:
+            # Workers open the clipped CHM themselves, so it must be saved rather than temporary
+            extPath = os.path.join(arcpy.env.scratchFolder, "CHM_Ext.tif")
+            CHM_Ext.save(extPath)
+            CHM_Ext = arcpy.Raster(extPath)
+        source = chmraster.RasterBlockReader(CHM_Ext)
+        CHM_Ft = chmraster.RasterBlockWriter(CHM_Ext)
+        trees = treetops.detect_tree_tops_tiled(source, geotransform, float(parameter4), smooth, toFeet, window = window, tile_size = int(tileSize), out = CHM_Ft,
+                                                workers = workers, fused = fused)
+        arcpy.AddMessage("(5/6) Identified " + str(trees.tree_id.size) + " tree tops")
+        CHM_Ft.save(outRaster)
+    else:
+        chm = chmraster.raster_to_array(CHM_Ext)
+        if fused:
+            # Smooth, convert and mask in place in the buffer read from the raster
+            CHM_Ft = treetops.prepare_chm_fused(chm, float(parameter4), smooth, toFeet, out = chm)
+            minHeight = None
+            arcpy.AddMessage("(4/6) Smoothed, converted and set minimum tree height in one pass")
+        else:
+            CHM_Ft = treetops.prepare_chm(chm, smooth, toFeet)
+            minHeight = float(parameter4)
+            arcpy.AddMessage("(3/6) Smoothed and converted canopy height model")
+
+        trees = treetops.find_tree_tops(CHM_Ft, geotransform, minHeight, window)
+        arcpy.AddMessage("(5/6) Identified " + str(trees.tree_id.size) + " tree tops")
+        chmraster.array_to_raster(CHM_Ft, CHM_Ext, outRaster)
+
+    TreeTopsToFeatures(trees, CHM_Ext.spatialReference, outTreeTop)
+    return trees
+
+
+def ArcGISDetector(CHM_Ext, parameter2, parameter3, parameter4, outRaster, outTreeTop):
+    """Detect tree tops with the original chain of arcpy.sa tools"""
     # Smooth CHM if desired
     if parameter2.lower() == 'true':
         CHM_Sm = arcpy.sa.FocalStatistics(in_raster=CHM_Ext, neighborhood= "Rectangle 3 3 CELL", statistics_type= "Mean", ignore_nodata="DATA", percentile_value=90)
@@ -67,24 +248,11 @@ def ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, param
     # Rename tree top columns
     treeTop = arcpy.management.AlterField(in_table = treeTop, field = "grid_code", new_field_name = "Height", new_field_alias = "Height (ft)")[0]
     treeTop = arcpy.management.AlterField(in_table = treeTop, field = "pointid", new_field_name = "TreeId", new_field_alias = "TreeId")[0]
-    
-    # Reclass tree points to ID number
-    treeTopReclass = arcpy.sa.ReclassByTable(in_raster = treeLocHt, in_remap_table = treeTop, from_value_field = "Height", to_value_field = "Height", output_value_field = "TreeId", missing_values = "DATA")
-    
-    # Save tree points, canopy segmentation, and canopy height model to desired output location
-    if parameter5[-4:] == ".gdb":
-        rasterName = arcpy.ValidateTableName("CHM_ft", parameter5)
-        treeTopName = arcpy.ValidateTableName("TreeTop", parameter5)
-    else:
-        rasterName = arcpy.ValidateTableName("CHM_ft.tif", parameter5)
-        treeTopName = arcpy.ValidateTableName("TreeTop.shp", parameter5)
-
-    outRaster = os.path.join(parameter5, rasterName)
-    outTreeTop = os.path.join(parameter5, treeTopName)
 
     arcpy.management.CopyRaster(CHM_Ft, outRaster)
     arcpy.management.CopyFeatures(treeTop, outTreeTop)
-    arcpy.AddMessage("(6/6) Saved files to workspace")
+    return FeaturesToTreeTops(outTreeTop)
+
 
 if __name__ == '__main__':
     # ScriptTool parameters
@@ -94,7 +262,17 @@ if __name__ == '__main__':
     parameter3 = arcpy.GetParameterAsText(3)
     parameter4 = arcpy.GetParameterAsText(4)
     parameter5 = arcpy.GetParameterAsText(5)
+    parameter6 = arcpy.GetParameterAsText(6) if arcpy.GetArgumentCount() > 6 else ""
+    parameter7 = arcpy.GetParameterAsText(7) if arcpy.GetArgumentCount() > 7 else ""
+    parameter8 = arcpy.GetParameterAsText(8) if arcpy.GetArgumentCount() > 8 else ""
+    parameter9 = arcpy.GetParameterAsText(9) if arcpy.GetArgumentCount() > 9 else ""
+    parameter10 = arcpy.GetParameterAsText(10) if arcpy.GetArgumentCount() > 10 else ""
+    parameter11 = arcpy.GetParameterAsText(11) if arcpy.GetArgumentCount() > 11 else ""
+    parameter12 = arcpy.GetParameterAsText(12) if arcpy.GetArgumentCount() > 12 else ""
+    parameter13 = arcpy.GetParameterAsText(13) if arcpy.GetArgumentCount() > 13 else ""
+    parameter14 = arcpy.GetParameterAsText(14) if arcpy.GetArgumentCount() > 14 else ""
+    parameter15 = arcpy.GetParameterAsText(15) if arcpy.GetArgumentCount() > 15 else ""
     
-    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5)
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14, parameter15)
 
 
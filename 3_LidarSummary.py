@@ -10,16 +10,82 @@ Required Arguments: <parameter0 = treeTop = TreTop height points (feature layer)
                     <parameter4 = ctMax = Output location (workspace)>
                     <parameter5 = regenMin = Output location (workspace)>
                     <parameter6 = regenMax = Output location (workspace)>
-Description:        <Compute tree height summary statistics (minimum, maximum, mean, mediad) for each stand>
+Optional Arguments: <parameter7 = percentiles = Extra height percentiles to report, e.g. "25 75 95" (string)>
+                    <parameter8 = heightClasses = Extra height classes to count, e.g. "Pole 10 30; Large 100" (string)>
+                    <parameter9 = summaryMode = "Vector" (default) or "Raster" stand assignment (string)>
+                    <parameter10 = chm = CHM_ft raster from the TreeTopPoints tool, required for Raster mode (raster layer)>
+                    <parameter11 = runCache = Run cache folder; blank disables the cache (folder)>
+                    <parameter12 = runLog = JSON lines file the stage timings are appended to (file)>
+                    <parameter13 = profileStage = Stage to profile: ReadTreeTops or SummarizeStands (string)>
+Description:        <Compute tree height summary statistics (minimum, maximum, mean, mediad) for each stand.
+                     Tree tops are assigned to stands once, with a grid index over the stand bounding boxes and exact
+                     point in polygon tests on the candidates (spatialindex.py). Statistics for all stands come from one
+                     sort of the trees by (stand, height) (standsummary.py); stands without trees get null statistics.
+                     Regen, CT and any extra height classes ("name min [max]", inclusive, separated by ";") are counted
+                     in a single pass over the assigned trees, giving <name>_Count and <name>_TPA fields.
+                     Raster mode burns the stands once onto the CHM grid and reads each tree top's stand from the cell it
+                     was detected in. The zone grid is cached next to the outputs (LidarSummaryZones_<hash>.npy), so
+                     reruns with new height thresholds only repeat the counting and statistics.
+                     The sorted tree heights of every stand are saved as LidarSummaryHeights.npz next to the outputs;
+                     standsummary.HeightIndex.load(path).tpa(min, max) gives TPA for any height range without a rerun.
+                     With a run cache folder, both are restored from the cache when the tree tops, stands and parameters
+                     are unchanged since a previous run (runcache.py).
+                     Every stage is timed and measured in the messages and the run log (instrument.py).>
 """
 
 import arcpy
+import numpy
 import os.path
+import chmraster
+import featureio
+import instrument
+import runcache
+import spatialindex
+import standsummary
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.overwriteOutput = True
 
-def ScriptTool(treeTop, clipVegPoly, outPath, ctMin, ctMax, regenMin, regenMax):
+def ScriptTool(treeTop, clipVegPoly, outPath, ctMin, ctMax, regenMin, regenMax, percentiles="", heightClasses="", summaryMode="", chm="", runCache="", runLog="", profileStage=""):
     """ScriptTool function docstring"""
+    log = instrument.RunLog("LidarSummary", runLog, profileStage)
+
+    # Reuse the outputs of an earlier run with the same inputs
+    cacheFolder = os.path.dirname(outPath) if outPath[-4:] == ".gdb" else outPath
+    outSummary = os.path.join(outPath, "LidarSummary")
+    outputs = [outSummary, os.path.join(cacheFolder, standsummary.HEIGHT_INDEX)]
+    cache = runcache.open_cache(runCache)
+    if cache:
+        raster = summaryMode.lower() == 'raster'
+        key = cache.key("LidarSummary", [treeTop, clipVegPoly, chm if raster else ""], [ctMin, ctMax, regenMin, regenMax, percentiles, heightClasses, raster, outputs])
+        if cache.restore(key, outputs):
+            arcpy.AddMessage("Restored the lidar summary from the cache")
+            return
+
+    # Raster mode burns the stands onto the CHM grid, so everything is read in the CHM spatial reference
+    chmGrid = None
+    spatialReference = arcpy.Describe(treeTop).spatialReference
+    if summaryMode.lower() == 'raster':
+        CHM_Ft = arcpy.Raster(chm)
+        chmGrid = ((CHM_Ft.height, CHM_Ft.width), chmraster.raster_geotransform(CHM_Ft))
+        spatialReference = CHM_Ft.spatialReference
+    with log.stage("ReadTreeTops", [treeTop]) as stage:
+        trees = featureio.read_points(treeTop, ["Height"], spatialReference = spatialReference)
+        stage.outputs(trees)
+    with log.stage("SummarizeStands", [trees, clipVegPoly]) as stage:
+        SummarizeStands(trees, clipVegPoly, outSummary, outputs[1], cacheFolder, ctMin, ctMax, regenMin, regenMax, percentiles, heightClasses, chmGrid,
+                        spatialReference)
+        stage.outputs(outSummary)
+
+    if cache:
+        cache.store(key, outputs)
+
+def SummarizeStands(trees, clipVegPoly, outSummary, outHeights, zoneFolder, ctMin, ctMax, regenMin, regenMax, percentiles="", heightClasses="", chmGrid=None, spatialReference=None):
+    """Write the stand summary of tree tops given as a structured array with SHAPE@X, SHAPE@Y and Height fields.
+
+    chmGrid is the (shape, geotransform) of the CHM for Raster mode; the
+    sorted heights are saved to outHeights unless it is blank. The stands are
+    read in spatialReference, the spatial reference of the tree coordinates.
+    """
     arcpy.AddMessage("Getting all set up...")
 
     # Remove unnecessary fields from VegPoly
@@ -29,108 +95,71 @@ def ScriptTool(treeTop, clipVegPoly, outPath, ctMin, ctMax, regenMin, regenMax):
     fields_to_delete.remove("SETTING_ID")
     arcpy.DeleteField_management(stands, fields_to_delete)
 
+    # Define CT, regen and any extra height classes
+    heightClasses = [("Regen", float(regenMin), float(regenMax) if regenMax != "" else None),
+                     ("CT", float(ctMin), float(ctMax) if ctMax != "" else None)] + standsummary.parse_height_classes(heightClasses)
+    percentiles = percentiles.split()
+
     # Add summary fields to VegPoly
     arcpy.AddGeometryAttributes_management(stands, Geometry_Properties = "AREA", Area_Unit = "ACRES")
     arcpy.management.AlterField(stands, "POLY_AREA", new_field_name = "Acres")
-    arcpy.management.AddField(stands, "Regen_Count", "SHORT")
-    arcpy.management.AddField(stands, "Regen_TPA", "DOUBLE")
-    arcpy.management.AddField(stands, "CT_Count", "SHORT")
-    arcpy.management.AddField(stands, "CT_TPA", "DOUBLE")
-
-    # Define queries for CT and regen height thresholds
-    ctQuery = " Height >= " + str(ctMin)
-    if 'ctMax' in locals():
-        ctQuery = ctQuery + " AND Height <= " + str(ctMax)
-    regenQuery = " Height >= " + str(regenMin)
-    if regenMax <> "":
-        regenQuery = regenQuery + " AND Height <= " + str(regenMax)
-
-    # Make temporary layers from the feature class
-    arcpy.MakeFeatureLayer_management(treeTop, "regen")
-    arcpy.MakeFeatureLayer_management(treeTop, "ct")
-
-    # Select trees of within height thresholds
-    arcpy.SelectLayerByAttribute_management("regen", "NEW_SELECTION", regenQuery)
-    arcpy.SelectLayerByAttribute_management("ct", "NEW_SELECTION", ctQuery)
-
-
-    # Define variables for couting function
-    expression = "recalc(!FREQUENCY!)"
-    codeblock = """def recalc(freq):
-        if freq > -1:
-            return freq
-        else:
-            return 0"""
-
-    # Count regen height trees within each stand
-    arcpy.AddMessage("Counting regen harvest sized trees...")
-    arcpy.SpatialJoin_analysis("regen", stands, "in_memory/PointsInPolys")
-    arcpy.Statistics_analysis ("in_memory/PointsInPolys", "in_memory/SS_PointsInPolys", [["SETTING_ID", "Count"]], "SETTING_ID")
-    arcpy.JoinField_management(stands, "SETTING_ID", "in_memory/SS_PointsInPolys", "SETTING_ID", "FREQUENCY")
-    arcpy.CalculateField_management(stands, "Regen_Count", expression, "PYTHON", codeblock)
-    arcpy.DeleteField_management(stands, "FREQUENCY")
-
-    # Count commercial thin height trees within each stand
-    arcpy.AddMessage("Counting commercial thin sized trees...")
-    arcpy.SpatialJoin_analysis("ct", stands, "in_memory/PointsInPolys")
-    arcpy.Statistics_analysis ("in_memory/PointsInPolys", "in_memory/SS_PointsInPolys", [["SETTING_ID", "Count"]], "SETTING_ID")
-    arcpy.JoinField_management(stands, "SETTING_ID", "in_memory/SS_PointsInPolys", "SETTING_ID", "FREQUENCY")
-    arcpy.CalculateField_management(stands, "CT_Count", expression, "PYTHON", codeblock)
-    arcpy.DeleteField_management(stands, "FREQUENCY")
-
-    # Calculate TPA
-    arcpy.AddMessage("Calculating Trees per Acre")
-    arcpy.management.CalculateField(in_table = stands, field = "Regen_TPA", expression = "round(!Regen_Count! / !Acres!, 2)", expression_type = "PYTHON") # should be changed to PYTHON3 if using ArcGIS Pro
-    arcpy.management.CalculateField(in_table = stands, field = "CT_TPA", expression = "round(!CT_Count! / !Acres!, 2)", expression_type = "PYTHON")
+    for name, low, high in heightClasses:
+        arcpy.management.AddField(stands, name + "_Count", "LONG")
+        arcpy.management.AddField(stands, name + "_TPA", "DOUBLE")
 
     # Summarize tree heights by stand (Mean/Min/Max Ht)
-    # This code comes from Ian Broad (2015), www.ianbroad.com
-    mem_polygon = arcpy.CopyFeatures_management(stands, "in_memory/treeTopSummary")
-
-    arcpy.AddField_management(mem_polygon, "MinHeight", "DOUBLE")
-    arcpy.AddField_management(mem_polygon, "MaxHeight", "DOUBLE")
-    arcpy.AddField_management(mem_polygon, "MeanHeight", "DOUBLE")
-    arcpy.AddField_management(mem_polygon, "MedianHeight", "DOUBLE")
-
-    result = arcpy.GetCount_management(stands)
-    features = int(result.getOutput(0))
-
-    def median(lst):
-        n = len(lst)
-        s = sorted(lst)
-        return (s[n//2-1]/2.0+s[n//2]/2.0, s[n//2])[n % 2] if n else None
-
+    arcpy.AddField_management(stands, "MinHeight", "DOUBLE")
+    arcpy.AddField_management(stands, "MaxHeight", "DOUBLE")
+    arcpy.AddField_management(stands, "MeanHeight", "DOUBLE")
+    arcpy.AddField_management(stands, "MedianHeight", "DOUBLE")
+    for q in percentiles:
+        arcpy.AddField_management(stands, "P" + q.replace(".", "_") + "Height", "DOUBLE")
+
+    # Assign every tree top to a stand in a single pass
+    arcpy.AddMessage("Assigning tree tops to stands...")
+    trees = trees[~numpy.isnan(trees["Height"])]
+    polygons, standValues = featureio.read_polygons(stands, ["OID@", "SETTING_ID", "Acres"], spatialReference = spatialReference)
+    if chmGrid is not None:
+        # Look tree tops up in stand zones burned onto the CHM grid
+        shape, geotransform = chmGrid
+        zones = standsummary.cached_zones(zoneFolder, polygons, shape, geotransform)
+        treeStand = standsummary.zone_of_points(zones, trees["SHAPE@X"], trees["SHAPE@Y"], geotransform)
+    else:
+        treeStand = spatialindex.assign_points(trees["SHAPE@X"], trees["SHAPE@Y"], polygons)
+
+    # Count trees of every height class in every stand
+    arcpy.AddMessage("Counting trees by height class...")
+    counts = standsummary.class_counts(treeStand, trees["Height"], len(polygons), heightClasses)
+    acres = numpy.array(standValues["Acres"], dtype = numpy.float64)
+
+    # Save sorted heights by stand for threshold queries without a rerun
+    if outHeights:
+        standsummary.HeightIndex.build(treeStand, trees["Height"], [str(v) for v in standValues["SETTING_ID"]], acres).save(outHeights)
+
+    # Summarize heights for all stands at once
     arcpy.AddMessage("Calclating height statistics for each stand...")
-    arcpy.SetProgressor("step", "Calculating Point Statistics...", 0, features, 1)
-
-    with arcpy.da.UpdateCursor(mem_polygon, ("SHAPE@", "MinHeight", "MaxHeight", "MeanHeight", "MedianHeight")) as polygon_update:
+    stats = standsummary.group_stats(treeStand, trees["Height"], len(polygons), percentiles)
+    statFields = ["min", "max", "mean", "median"] + ["p" + q for q in percentiles]
+    standIndex = dict((oid, i) for i, oid in enumerate(standValues["OID@"]))
+
+    outFields = ["OID@"]
+    for name, low, high in heightClasses:
+        outFields += [name + "_Count", name + "_TPA"]
+    outFields += ["MinHeight", "MaxHeight", "MeanHeight", "MedianHeight"] + ["P" + q.replace(".", "_") + "Height" for q in percentiles]
+    with arcpy.da.UpdateCursor(stands, outFields) as polygon_update:
         for poly_row in polygon_update:
-            try:
-                point_values = []
-                mem_point = arcpy.MakeFeatureLayer_management(treeTop, "mem_points")
-                arcpy.SelectLayerByLocation_management(mem_point, "COMPLETELY_WITHIN", poly_row[0])
-
-                with arcpy.da.SearchCursor(mem_point, ("Height")) as point_search:
-                    for point_row in point_search:
-                        if point_row[0] is not None and point_row[0] != "":
-                            point_values.append(float(point_row[0]))
-
-                poly_row[1] = float(round(min(point_values), 2))
-                poly_row[2] = float(round(max(point_values), 2))
-                poly_row[3] = float(round(sum(point_values)/float(len(point_values)), 2))
-                poly_row[4] = float(round(median(point_values), 2))
-
-                polygon_update.updateRow(poly_row)
-
-                arcpy.SetProgressorPosition()
-
-            except Exception as e:
-                arcpy.AddMessage(str(e.message))
+            i = standIndex[poly_row[0]]
+            values = []
+            for count in counts[i]:
+                values += [int(count), float(round(count / acres[i], 2)) if acres[i] > 0 else None]
+            # Stands without trees keep null statistics
+            values += [None if numpy.isnan(stats[name][i]) else float(round(stats[name][i], 2)) for name in statFields]
+            poly_row[1:] = values
+            polygon_update.updateRow(poly_row)
 
     # Write output file
     arcpy.AddMessage("Writing output file..")
-    outSummary = os.path.join(outPath, "LidarSummary")
-    arcpy.CopyFeatures_management(mem_polygon, outSummary)
+    arcpy.CopyFeatures_management(stands, outSummary)
 
 
 if __name__ == '__main__':
@@ -142,7 +171,14 @@ if __name__ == '__main__':
     parameter4 = ctMax = arcpy.GetParameterAsText(4)
     parameter5 = regenMin = arcpy.GetParameterAsText(5)
     parameter6 = regenMax = arcpy.GetParameterAsText(6)
+    parameter7 = percentiles = arcpy.GetParameterAsText(7) if arcpy.GetArgumentCount() > 7 else ""
+    parameter8 = heightClasses = arcpy.GetParameterAsText(8) if arcpy.GetArgumentCount() > 8 else ""
+    parameter9 = summaryMode = arcpy.GetParameterAsText(9) if arcpy.GetArgumentCount() > 9 else ""
+    parameter10 = chm = arcpy.GetParameterAsText(10) if arcpy.GetArgumentCount() > 10 else ""
+    parameter11 = runCache = arcpy.GetParameterAsText(11) if arcpy.GetArgumentCount() > 11 else ""
+    parameter12 = runLog = arcpy.GetParameterAsText(12) if arcpy.GetArgumentCount() > 12 else ""
+    parameter13 = profileStage = arcpy.GetParameterAsText(13) if arcpy.GetArgumentCount() > 13 else ""
 
     
-    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6)
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13)
 
@@ -19,317 +19,247 @@ Optional Arguments: <parameter3 = recruitment = Land type (boolean)>
                     <parameter12 = ctTPA = The minimum TPA of CT sized trees in CT units (short)>
                     <parameter13 = sliverSize = Minimum unit size (feature layer)>
                     <parameter14 = standSplit = Split units by FSVeg Spatial stands (boolean)>
-Description:        <Uses clipped datasets to identify potential timber harvest units>
+                    <parameter15 = engine = Unit engine, "Erase" (default), "Overlay" or "Raster" (string)>
+                    <parameter16 = cellSize = Raster engine cell size in map units, default 2 (double)>
+                    <parameter17 = validate = Also build the units with the Erase engine and report area differences (boolean)>
+                    <parameter18 = sliverEngine = Sliver removal and aggregation, "ArcGIS" (default) or "NumPy"; NumPy drops groups of
+                                                  small parts rather than single parts and does not fill the gaps between grouped parts (string)>
+                    <parameter19 = workers = Worker processes for the NumPy stand split; 0 uses every CPU (long)>
+                    <parameter20 = runCache = Run cache folder; blank disables the cache (folder)>
+                    <parameter21 = incrementalRun = Rebuild units only around exclusions changed since the last run (boolean)>
+                    <parameter22 = runLog = JSON lines file the stage timings are appended to (file)>
+                    <parameter23 = profileStage = Stage to profile, e.g. Exclusions, Overlay, BurnGrid, RegenMerge, RegenCandidates,
+                                   RegenSlivers or the Ct stages of the same names (string)>
+Description:        <Uses clipped datasets to identify potential timber harvest units.
+                     The exclusion layers are listed as rules in ExclusionRules (source, conditions, label and the unit
+                     types they exclude) and written by exclusions.py with one cursor pass per source.
+                     A blank harvestAge excludes regen harvests within the last 80 years.
+                     The Erase engine erases the merged exclusions from the project area once per unit type. The Overlay
+                     engine splits the project area by all exclusion layers in one Union and picks the faces of each
+                     unit type by a bit mask of the layers covering them (units.py); only the regen units are overlaid
+                     again for the CT units.
+                     The Raster engine burns the project area and every exclusion layer into one bit of a uint16 grid,
+                     finds candidate units as connected groups of free cells, drops slivers by cell count and turns only
+                     the remaining units into polygons (rasterunits.py). Cell size trades accuracy for speed: unit edges
+                     follow cell edges and can move by up to half a cell, so 1 m cells stay close to the vector engines
+                     while 5 m cells burn 25 times fewer cells. With validate, the Erase engine is also run and the
+                     acres of both are reported.
+                     The NumPy sliver engine groups candidate units within 5 m of each other with a union-find and drops
+                     groups of sliverSize acres or less, from coordinate arrays and without intermediate layers (units.py).
+                     Unlike AggregatePolygons it tests the sliver size per group, so a small part within 5 m of a larger
+                     unit is kept, and it does not fill the gaps between grouped parts; a unit is the multipart polygon
+                     of its parts, so its acres can be lower than with the ArcGIS engine.
+                     With standSplit it pairs each unit with only the stands it touches and intersects the pairs on
+                     `workers` processes instead of dissolving every unit and running Identity.
+                     With a run cache folder, the exclusion layers and the vector regen candidates are restored from the
+                     cache when their sources and rules are unchanged (runcache.py), so a rerun with a new sliverSize
+                     only repeats the sliver step and the CT units.
+                     With incrementalRun and the Erase engine, the merged exclusions and units are kept in
+                     UnitIdentificationState.gdb next to the outputs. The next run with the same sliverSize, standSplit,
+                     engines, project area and stands rebuilds units only in a box around the exclusions that changed and
+                     splices them into the previous units (incremental.py).
+                     Every stage is timed and measured in the messages and the run log (instrument.py).>
 """
 
 import arcpy
 import os.path
-from arcpy import env
 from datetime import date
+import exclusions
+import incremental
+import instrument
+import runcache
+import units
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.overwriteOutput = True
 
-def ScriptTool(projectArea, outPath, clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, harvestAge, clipMgmtArea, clipLidarSummary, regenTPA, ctTPA, sliverSize, standSplit):
+def ScriptTool(projectArea, outPath, clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, harvestAge, clipMgmtArea, clipLidarSummary, regenTPA, ctTPA, sliverSize, standSplit, engine="", cellSize="", validate="", sliverEngine="", workers="", runCache="", incrementalRun="", runLog="", profileStage=""):
     """ScriptTool function docstring"""
-    
-    # Riperian buffers
-    if arcpy.Exists(clipRiperian):
-        arcpy.AddMessage("Working on the riperian buffers...")
-        # Write the selected features to a new featureclass
-        riperian = os.path.join(outPath, "exclRiperianBuffer")
-        arcpy.CopyFeatures_management(clipRiperian, riperian)
-
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(riperian) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(riperian, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = riperian, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = riperian, field = "Exclusion", expression = "\"Riperian buffer\"") 
-        arcpy.AddMessage("Complete")
-        
-    # Landtype
-    if arcpy.Exists(clipLandtype):
-        arcpy.AddMessage("Working on the land type...")
-        # Make a layer from the feature class
-        arcpy.MakeFeatureLayer_management(clipLandtype, "landtype") 
-
-        # Select mass wasting sites   
-        arcpy.SelectLayerByAttribute_management("landtype", "NEW_SELECTION", " DESCRIPTION = 'Mass Wasting Sites' ")
-
-        # Write the selected features to a new featureclass
-        massWasting = os.path.join(outPath, "exclMassWasting")
-        arcpy.CopyFeatures_management("landtype", massWasting)
-        
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(massWasting) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(massWasting, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = massWasting, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = massWasting, field = "Exclusion", expression = "\"Mass wasting site\"") 
-        arcpy.AddMessage("Complete")
-        
-    # Special use area
-    if arcpy.Exists(clipSpecialUse):
-        arcpy.AddMessage("Working on the special use areas...")
-        # Write the features to a new featureclass
-        specialUse = os.path.join(outPath, "exclSpecialUseArea")
-        arcpy.CopyFeatures_management(clipSpecialUse, specialUse)
-
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(specialUse) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(specialUse, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = specialUse, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = specialUse, field = "Exclusion", expression = "\"Special use area\"") 
-        arcpy.AddMessage("Complete")
-        
-    # Harvested areas
-    if arcpy.Exists(clipHarvest):
-        arcpy.AddMessage("Working on the harvest areas...")
-        # Make a layer from the feature class
-        arcpy.MakeFeatureLayer_management(clipHarvest, "harvest") 
-
-        # Select Regen harvests within x years
-        harvestAge = 80
-        year = date.today().year - harvestAge
-        harvestSelect = " ACTIVITY_CODE LIKE '41%' AND FY_COMPLETED >= '" + str(year) + "' "
-        arcpy.SelectLayerByAttribute_management("harvest", "NEW_SELECTION", harvestSelect)
-        
-        # Write the selected features to a new featureclass
-        harvest = os.path.join(outPath, "exclHarvest")
-        arcpy.CopyFeatures_management("harvest", harvest)
-        
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(harvest) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(harvest, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = harvest, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        harvestQuery = "\"Regen harvest within " + str(harvestAge) + " yrs\""
-        arcpy.management.CalculateField(in_table = harvest, field = "Exclusion", expression = "\"Regen harvest within 80 yrs\"")
-        arcpy.AddMessage("Complete")
-        
-    # Management Areas
-    if arcpy.Exists(clipMgmtArea):
-        arcpy.AddMessage("Working on the management areas...")
-        # Make a layer from the feature class
-        arcpy.MakeFeatureLayer_management(clipMgmtArea, "mgmt") 
-
-        # Select unsuitable management areas
-        arcpy.SelectLayerByAttribute_management("mgmt", "NEW_SELECTION", " MGTAREA IN ('US', 'B2', 'B1') ")
-        
-        # Write the selected features to a new featureclass
-        mgmt = os.path.join(outPath, "exclMgmtArea")
-        arcpy.CopyFeatures_management("mgmt", mgmt)
-        
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(mgmt) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(mgmt, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = mgmt, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = mgmt, field = "Exclusion", expression = "\"Unsuitable management area\"")
-        arcpy.AddMessage("Complete")
-        
-    # Old growth
-    if arcpy.Exists(clipVegPoly):
-        #Check of Old Growth Status field exists
-        lstFields = [f.name for f in arcpy.ListFields(clipVegPoly)]
-        if "OLD_GROWTH_STATUS" in lstFields:
-            arcpy.AddMessage("Working on the old growth...")
-            # Make a layer from the feature class
-            arcpy.MakeFeatureLayer_management(clipVegPoly, "oldgrowth")
-        
-            # Select retained old growth
-            recruitment = "True"
-            if recruitment.lower() == 'true':
-                arcpy.SelectLayerByAttribute_management("oldgrowth", "NEW_SELECTION", " OLD_GROWTH_STATUS in ('Old Growth', 'Step Down', 'Recruitment') ")
-            else:
-                arcpy.SelectLayerByAttribute_management("oldgrowth", "NEW_SELECTION", " OLD_GROWTH_STATUS in ('Old Growth', 'Step Down') ")
-
-            # Write the selected features to a new featureclass
-            oldGrowth = os.path.join(outPath, "exclOldGrowth")
-            arcpy.CopyFeatures_management("oldgrowth", oldGrowth)
-
-            # Remove non-required fields
-            fields_to_delete = [field.name for field in arcpy.ListFields(oldGrowth) if not field.required]
-            for field in fields_to_delete:
-                arcpy.DeleteField_management(oldGrowth, field)
-
-            # Add and populate Exclusion field
-            arcpy.management.AddField(in_table = oldGrowth, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-            arcpy.management.CalculateField(in_table = oldGrowth, field = "Exclusion", expression = "\"Old growth\"")
-            arcpy.AddMessage("Complete")
-            
-    # Lidar Summary
-    if arcpy.Exists(clipLidarSummary):
-        arcpy.AddMessage("Working on the lidar summary...")
-        #Regen harvest
-        # Make a layer from the feature class
-        arcpy.MakeFeatureLayer_management(clipLidarSummary, "Regen") 
-
-        # Select areas with too few regen sized trees
-        regenQuery = "Regen_TPA < " + str(regenTPA) 
-        arcpy.SelectLayerByAttribute_management("Regen", "NEW_SELECTION", regenQuery)
-        
-        # Write the selected features to a new featureclass
-        regen = os.path.join(outPath, "exclRegenTPA")
-        arcpy.CopyFeatures_management("Regen", regen)
-        
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(regen) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(regen, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = regen, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = regen, field = "Exclusion", expression = "\"Too few regen-sized trees\"")
+    log = instrument.RunLog("UnitIdentification", runLog, profileStage)
+
+    # Write one exclusion layer per rule, or restore them from the run cache
+    rules = ExclusionRules(clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, harvestAge, clipMgmtArea, clipLidarSummary, regenTPA, ctTPA)
+    cache = runcache.open_cache(runCache)
+    restored = None
+    if cache:
+        ruleOutputs = [os.path.join(outPath, rule.name) for rule in rules]
+        exclusionKey = cache.key("Exclusions", [rule.source for rule in rules], [[rule.name, rule.label, rule.units, rule.conditions] for rule in rules])
+        restored = cache.restore(exclusionKey, ruleOutputs)
+    with log.stage("Exclusions", [rule.source for rule in rules]) as stage:
+        if restored is not None:
+            written = dict((rule.name, path) for rule, path in zip(rules, ruleOutputs) if path in restored)
+            arcpy.AddMessage("Restored exclusion layers from the cache")
+        else:
+            written = exclusions.write_exclusions(rules, outPath)
+            if cache:
+                cache.store(exclusionKey, list(written.values()))
+        stage.outputs(*written.values())
+    arcpy.AddMessage("Complete")
 
-        # Commercial thin
-        # Make a layer from the feature class
-        arcpy.MakeFeatureLayer_management(clipLidarSummary, "Ct") 
+    # Rebuild only around changed exclusions when the last run was kept with the same settings
+    engine = engine.lower()
+    incrementalRun = incrementalRun.lower() == 'true' and engine not in ('overlay', 'raster')
+    stateNames = ["PreliminaryRegenExclusions", "PreliminaryRegenUnits", "PreliminaryCtExclusions", "PreliminaryCtUnits"]
+    update = False
+    if incrementalRun:
+        state = incremental.UnitState(outPath, "UnitIdentification", [str(sliverSize), standSplit.lower(), sliverEngine.lower(), engine,
+                                                                      runcache.raw_fingerprint(projectArea), runcache.raw_fingerprint(clipVegPoly)])
+        update = state.valid(stateNames)
+
+    # Overlay or burn every exclusion layer once for the overlay and raster engines
+    layers = [written[rule.name] for rule in rules if rule.name in written]
+    bits = dict((path, i) for i, path in enumerate(layers))
+    if engine == 'overlay':
+        with log.stage("Overlay", [projectArea] + layers) as stage:
+            faces = units.planar_overlay(projectArea, layers, r'in_memory\Faces')
+            stage.outputs(faces)
+    elif engine == 'raster':
+        with log.stage("BurnGrid", [projectArea] + layers) as stage:
+            grid = units.flag_grid(projectArea, layers, cellSize if cellSize != "" else 2)
+            stage.outputs(grid.flags)
 
-        # Select areas with too few regen sized trees
-        ctQuery = "CT_TPA < " + str(ctTPA) 
-        arcpy.SelectLayerByAttribute_management("Ct", "NEW_SELECTION", ctQuery)
-        
-        # Write the selected features to a new featureclass
-        ct = os.path.join(outPath, "exclCtTPA")
-        arcpy.CopyFeatures_management("Ct", ct)
-        
-        # Remove non-required fields
-        fields_to_delete = [field.name for field in arcpy.ListFields(ct) if not field.required]
-        for field in fields_to_delete:
-            arcpy.DeleteField_management(ct, field)
-
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = ct, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = ct, field = "Exclusion", expression = "\"Too few comm thin-sized trees\"")
-        arcpy.AddMessage("Complete")
-            
     # REGEN: Merge exclusion layers
-    ## Use the ListFeatureClasses function to return a list
+    ## Exclusion layers that apply to regen units
     arcpy.AddMessage("Building regeneration harvest units...")
-    env.workspace = outPath
-    exclList_regen = arcpy.ListFeatureClasses(wild_card = "excl*")
-    if "exclCtTPA" in exclList_regen:
-        exclList_regen.remove("exclCtTPA")
+    exclList_regen = exclusions.exclusions_for(rules, written, "Regen")
+    regenMask = sum(1 << bits[path] for path in exclList_regen)
     outExclusions = os.path.join(outPath, "PreliminaryRegenExclusions")
 
-    arcpy.management.Merge(inputs = exclList_regen, output = outExclusions)
-
-    ## Erase exclusions from the project area
-    outErase = r'in_memory\Erase'
-    arcpy.analysis.Erase(in_features = projectArea, erase_features = outExclusions, out_feature_class = outErase)
-
-    ## Remove all < 2 acre slivers
-    ## (This method ensures that slivers adjacent to larger units are preserved)
-
-    ## Split into singlepart polygons
-    arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
-
-    ## Remove all < 2 acre slivers
-    sliverQuery = " POLY_AREA > " + str(sliverSize)
-    arcpy.AddGeometryAttributes_management(Input_Features = r'in_memory\Split', Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.MakeFeatureLayer_management(r'in_memory\Split', "units")
-    arcpy.SelectLayerByAttribute_management("units", "NEW_SELECTION", sliverQuery)
-    outIdentity = r'in_memory\Identity'
+    with log.stage("RegenMerge", exclList_regen) as stage:
+        arcpy.management.Merge(inputs = exclList_regen, output = outExclusions)
+        stage.outputs(outExclusions)
 
-    ## Combine/split polygons by adjacency or by stand
-    if standSplit.lower() == 'true':
-        ### Combine all into one multipart polygon
-        arcpy.management.Dissolve(in_features = "units", out_feature_class = r'in_memory\Acre')
-
-        ### Split by FSVeg stands
-        arcpy.analysis.Identity(in_features = r'in_memory\Acre', identity_features = clipVegPoly, out_feature_class = outIdentity)
+    if update:
+        with log.stage("RegenUpdate", [outExclusions]) as stage:
+            outIdentity = incremental.update_units(projectArea, outExclusions, state.path(stateNames[0]), state.path(stateNames[1]), sliverSize, standSplit,
+                                                   clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
     else:
-        ### Combine adjecent units
-        arcpy.cartography.AggregatePolygons("units", outIdentity, "5 Meters")
-
-    ## Delete unnecessary fields
-    fields_to_delete = [field.name for field in arcpy.ListFields(outIdentity) if not field.required]
-    if standSplit.lower() == 'true':
-        fields_to_delete.remove("SETTING_ID")
-    if fields_to_delete:
-        arcpy.DeleteField_management(outIdentity, fields_to_delete)
-
-    ## Add Acres field
-    arcpy.AddGeometryAttributes_management(Input_Features = outIdentity, Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.management.AlterField(in_table = outIdentity, field = "POLY_AREA", new_field_name = "Acres")
+        ## Raster candidates already depend on the sliver size, so only vector candidates are cached
+        with log.stage("RegenCandidates", [projectArea] + exclList_regen) as stage:
+            candidateKey = None
+            if cache and engine != 'raster':
+                candidateKey = cache.key("RegenCandidates", [projectArea] + exclList_regen, [engine])
+            if candidateKey and cache.restore(candidateKey, [r'in_memory\Split']):
+                arcpy.AddMessage("Restored regeneration harvest candidates from the cache")
+            else:
+                if engine == 'overlay':
+                    units.overlay_candidates(faces, regenMask, r'in_memory\Split')
+                elif engine == 'raster':
+                    units.grid_candidates(grid, regenMask, sliverSize, r'in_memory\Split')
+                else:
+                    EraseCandidates(projectArea, outExclusions, r'in_memory\Split')
+                if candidateKey:
+                    cache.store(candidateKey, [r'in_memory\Split'])
+            stage.outputs(r'in_memory\Split')
+
+        ## Remove slivers and combine/split polygons by adjacency or by stand
+        with log.stage("RegenSlivers", [r'in_memory\Split']) as stage:
+            outIdentity = units.finish_units(r'in_memory\Split', sliverSize, standSplit, clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
 
     outUnits_regen = os.path.join(outPath, "PreliminaryRegenUnits")
-    arcpy.CopyFeatures_management(outIdentity, outUnits_regen)
+    with log.stage("RegenWrite", [outIdentity]) as stage:
+        arcpy.CopyFeatures_management(outIdentity, outUnits_regen)
+        stage.outputs(outUnits_regen)
+    if engine == 'raster' and validate.lower() == 'true':
+        with log.stage("RegenValidate", [outExclusions]) as stage:
+            ValidateRasterUnits(grid, projectArea, outExclusions, sliverSize, standSplit, clipVegPoly, sliverEngine, workers, outUnits_regen, "Regen")
     arcpy.AddMessage("Complete")
 
     # Commercial thin: Merge exclusion layers
-    arcpy.AddMessage("Building regeneration harvest units...")
-    if arcpy.Exists(outUnits_regen):
-        ## Add and populate Exclusion field
-        arcpy.management.AddField(in_table = outIdentity, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = outIdentity, field = "Exclusion", expression = "\"Regen harvest unit\"")
+    arcpy.AddMessage("Building commercial thin units...")
+    with log.stage("CtMerge", [outIdentity]) as stage:
+        if arcpy.Exists(outUnits_regen):
+            ## Add and populate Exclusion field
+            arcpy.management.AddField(in_table = outIdentity, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
+            arcpy.management.CalculateField(in_table = outIdentity, field = "Exclusion", expression = "\"Regen harvest unit\"")
         
-        ## Use the ListFeatureClasses function to return a list
-        env.workspace = outPath
-        exclList_ct = arcpy.ListFeatureClasses(wild_card = "excl*")
-        if "exclRegenTPA" in exclList_ct:
-            exclList_ct.remove("exclRegenTPA")
-        if "exclHarvest" in exclList_ct:
-            exclList_ct.remove("exclHarvest")
-        exclList_ct.append(outIdentity)
-        outExclusions = os.path.join(outPath, "PreliminaryCtExclusions")
+            ## Exclusion layers that apply to CT units, and the regen units
+            exclList_ct = exclusions.exclusions_for(rules, written, "CT")
+            ctMask = sum(1 << bits[path] for path in exclList_ct) | 1 << len(layers)
+            exclList_ct.append(outIdentity)
+            outExclusions = os.path.join(outPath, "PreliminaryCtExclusions")
+
+        arcpy.management.Merge(inputs = exclList_ct, output = outExclusions)
+        arcpy.DeleteField_management(outExclusions, ["SETTING_ID", "Acres"])
+        stage.outputs(outExclusions)
+
+    ## The regen units are one more layer on the existing overlay or grid
+    if update:
+        ### Changed regen units show up as changed CT exclusions
+        with log.stage("CtUpdate", [outExclusions]) as stage:
+            outIdentity = incremental.update_units(projectArea, outExclusions, state.path(stateNames[2]), state.path(stateNames[3]), sliverSize, standSplit,
+                                                   clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
+    else:
+        with log.stage("CtCandidates", [projectArea, outExclusions]) as stage:
+            if engine == 'overlay':
+                faces = units.add_overlay_layer(faces, outIdentity, len(layers), r'in_memory\FacesCt')
+                units.overlay_candidates(faces, ctMask, r'in_memory\Split')
+            elif engine == 'raster':
+                units.add_grid_layer(grid, outIdentity, len(layers))
+                units.grid_candidates(grid, ctMask, sliverSize, r'in_memory\Split')
+            else:
+                EraseCandidates(projectArea, outExclusions, r'in_memory\Split')
+            stage.outputs(r'in_memory\Split')
+
+        ## Remove slivers and combine/split polygons by adjacency or by stand
+        with log.stage("CtSlivers", [r'in_memory\Split']) as stage:
+            outIdentity = units.finish_units(r'in_memory\Split', sliverSize, standSplit, clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
 
-    arcpy.management.Merge(inputs = exclList_ct, output = outExclusions)
-    arcpy.DeleteField_management(outExclusions, ["SETTING_ID", "Acres"])
-                                 
+    outUnits_ct = os.path.join(outPath, "PreliminaryCtUnits")
+    with log.stage("CtWrite", [outIdentity]) as stage:
+        arcpy.CopyFeatures_management(outIdentity, outUnits_ct)
+        stage.outputs(outUnits_ct)
+    if engine == 'raster' and validate.lower() == 'true':
+        with log.stage("CtValidate", [outExclusions]) as stage:
+            ValidateRasterUnits(grid, projectArea, outExclusions, sliverSize, standSplit, clipVegPoly, sliverEngine, workers, outUnits_ct, "CT")
+    arcpy.AddMessage("Complete")
+
+    # Keep this run's exclusions and units for the next incremental run
+    if incrementalRun:
+        state.save([os.path.join(outPath, name) for name in stateNames])
+
+def EraseCandidates(projectArea, outExclusions, outSplit):
+    """Singlepart candidate units: the project area with the merged exclusions erased"""
     ## Erase exclusions from the project area
     outErase = r'in_memory\Erase'
     arcpy.analysis.Erase(in_features = projectArea, erase_features = outExclusions, out_feature_class = outErase)
 
-    ## Remove all < 2 acre slivers
-    ## (This method ensures that slivers adjacent to larger units are preserved)
-
     ## Split into singlepart polygons
-    arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
-
-    ## Remove all < 2 acre slivers
-    arcpy.AddGeometryAttributes_management(Input_Features = r'in_memory\Split', Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.MakeFeatureLayer_management(r'in_memory\Split', "units")
-    arcpy.SelectLayerByAttribute_management("units", "NEW_SELECTION", sliverQuery)
-    outIdentity = r'in_memory\Identity'
-
-    ## Combine/split polygons by adjacency or by stand
-    if standSplit.lower() == 'true':
-        ### Combine all into one multipart polygon
-        arcpy.management.Dissolve(in_features = "units", out_feature_class = r'in_memory\Acre')
-
-        ### Split by FSVeg stands
-        arcpy.analysis.Identity(in_features = r'in_memory\Acre', identity_features = clipVegPoly, out_feature_class = outIdentity)
-    else:
-        ### Combine adjecent units
-        arcpy.cartography.AggregatePolygons("units", outIdentity, "5 Meters")
-
-    ## Delete unnecessary fields
-    fields_to_delete = [field.name for field in arcpy.ListFields(outIdentity) if not field.required]
-    if standSplit.lower() == 'true':
-        fields_to_delete.remove("SETTING_ID")
-    if fields_to_delete:
-        arcpy.DeleteField_management(outIdentity, fields_to_delete)
-
-    # Add Acres field
-    arcpy.AddGeometryAttributes_management(Input_Features = outIdentity, Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.management.AlterField(in_table = outIdentity, field = "POLY_AREA", new_field_name = "Acres")
-
-    outUnits_ct = os.path.join(outPath, "PreliminaryCtUnits")
-    arcpy.CopyFeatures_management(outIdentity, outUnits_ct)
-    arcpy.AddMessage("Complete")
+    arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = outSplit)
+    return outSplit
+
+def ValidateRasterUnits(grid, projectArea, outExclusions, sliverSize, standSplit, clipVegPoly, sliverEngine, workers, rasterUnits, unitType):
+    """Build the same units with the Erase engine and report the area differences"""
+    EraseCandidates(projectArea, outExclusions, r'in_memory\ValidationSplit')
+    vectorUnits = units.finish_units(r'in_memory\ValidationSplit', sliverSize, standSplit, clipVegPoly, r'in_memory\Validation', sliverEngine, workers)
+    return units.raster_validation(grid, rasterUnits, vectorUnits, unitType)
+
+def ExclusionRules(clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, harvestAge, clipMgmtArea, clipLidarSummary, regenTPA, ctTPA):
+    """Exclusion layers as data: output name, source, conditions, Exclusion label and unit types"""
+    Rule = exclusions.ExclusionRule
+    both = ("Regen", "CT")
+    harvestAge = int(harvestAge) if str(harvestAge).strip() != "" else 80
+    year = date.today().year - harvestAge
+    oldGrowthStatus = ["Old Growth", "Step Down"]
+    if recruitment.lower() == 'true':
+        oldGrowthStatus.append("Recruitment")
+
+    rules = [Rule("exclRiperianBuffer", clipRiperian, "Riperian buffer", both, []),
+             Rule("exclMassWasting", clipLandtype, "Mass wasting site", both, [("DESCRIPTION", "=", "Mass Wasting Sites")]),
+             Rule("exclSpecialUseArea", clipSpecialUse, "Special use area", both, []),
+             Rule("exclHarvest", clipHarvest, "Regen harvest within " + str(harvestAge) + " yrs", ("Regen",),
+                  [("ACTIVITY_CODE", "LIKE", "41%"), ("FY_COMPLETED", ">=", str(year))]),
+             Rule("exclMgmtArea", clipMgmtArea, "Unsuitable management area", both, [("MGTAREA", "IN", ("US", "B2", "B1"))])]
+    # Old growth only where FSVeg carries an old growth status
+    if arcpy.Exists(clipVegPoly) and "OLD_GROWTH_STATUS" in [f.name for f in arcpy.ListFields(clipVegPoly)]:
+        rules.append(Rule("exclOldGrowth", clipVegPoly, "Old growth", both, [("OLD_GROWTH_STATUS", "IN", oldGrowthStatus)]))
+    if arcpy.Exists(clipLidarSummary):
+        rules += [Rule("exclRegenTPA", clipLidarSummary, "Too few regen-sized trees", ("Regen",), [("Regen_TPA", "<", float(regenTPA))]),
+                  Rule("exclCtTPA", clipLidarSummary, "Too few comm thin-sized trees", ("CT",), [("CT_TPA", "<", float(ctTPA))])]
+    return rules
 
 if __name__ == '__main__':
     # ScriptTool parameters
@@ -348,5 +278,14 @@ if __name__ == '__main__':
     parameter12 = ctTPA = arcpy.GetParameterAsText(12)
     parameter13 = sliverSize = arcpy.GetParameterAsText(13)
     parameter14 = standSplit = arcpy.GetParameterAsText(14)
-
-    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14)
+    parameter15 = engine = arcpy.GetParameterAsText(15) if arcpy.GetArgumentCount() > 15 else ""
+    parameter16 = cellSize = arcpy.GetParameterAsText(16) if arcpy.GetArgumentCount() > 16 else ""
+    parameter17 = validate = arcpy.GetParameterAsText(17) if arcpy.GetArgumentCount() > 17 else ""
+    parameter18 = sliverEngine = arcpy.GetParameterAsText(18) if arcpy.GetArgumentCount() > 18 else ""
+    parameter19 = workers = arcpy.GetParameterAsText(19) if arcpy.GetArgumentCount() > 19 else ""
+    parameter20 = runCache = arcpy.GetParameterAsText(20) if arcpy.GetArgumentCount() > 20 else ""
+    parameter21 = incrementalRun = arcpy.GetParameterAsText(21) if arcpy.GetArgumentCount() > 21 else ""
+    parameter22 = runLog = arcpy.GetParameterAsText(22) if arcpy.GetArgumentCount() > 22 else ""
+    parameter23 = profileStage = arcpy.GetParameterAsText(23) if arcpy.GetArgumentCount() > 23 else ""
+
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14, parameter15, parameter16, parameter17, parameter18, parameter19, parameter20, parameter21, parameter22, parameter23)
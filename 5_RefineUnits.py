@@ -12,124 +12,152 @@ Required Arguments: <parameter0 = projectArea = Project area (feature layer)>
                     <parameter5 = sliverSize = Minimum unit size (feature layer)>
                     <parameter5 = standSplit = Minimum unit size (feature layer)>
                     <parameter6 = standSplit = Split units by FSVeg Spatial stands (boolean)>
-Description:        <Uses clipped datasets to identify potential timber harvest units>
+Optional Arguments: <parameter7 = engine = Unit engine, "Erase" (default) or "Overlay" (string)>
+                    <parameter8 = sliverEngine = Sliver removal and aggregation, "ArcGIS" (default) or "NumPy"; NumPy drops groups of
+                                                 small parts rather than single parts and does not fill the gaps between grouped parts (string)>
+                    <parameter9 = workers = Worker processes for the NumPy stand split; 0 uses every CPU (long)>
+                    <parameter10 = incrementalRun = Rebuild units only around exclusions changed since the last run (boolean)>
+                    <parameter11 = runLog = JSON lines file the stage timings are appended to (file)>
+                    <parameter12 = profileStage = Stage to profile, e.g. RegenMerge, RegenCandidates, RegenSlivers or the Ct stages
+                                   of the same names (string)>
+                    <parameter13 = runCache = Run cache folder; blank disables the cache (folder)>
+Description:        <Uses clipped datasets to identify potential timber harvest units.
+                     The Overlay engine splits the project area by the regen and CT exclusions in one Union and picks the
+                     faces of each unit type by a bit mask of the layers covering them (units.py); only the refined regen
+                     units are overlaid again for the CT units.
+                     The NumPy sliver engine groups candidate units within 5 m of each other with a union-find and drops
+                     small groups in process (units.py); with standSplit it splits units by only the stands they touch on
+                     `workers` processes. Unlike AggregatePolygons it tests the sliver size per group, so a small part
+                     within 5 m of a larger unit is kept, and it does not fill the gaps between grouped parts.
+                     With incrementalRun and the Erase engine, the refined exclusions and units are kept in
+                     RefineUnitsState.gdb next to the outputs, and the next run with the same settings, project area and
+                     stands rebuilds units only around the exclusions edited since (incremental.py).
+                     With runCache, the Erase candidates of the regen units are restored from the cache when the project
+                     area and preliminary regen exclusions are unchanged (runcache.py), so a rerun with a new sliverSize
+                     only repeats the sliver step and the CT units.
+                     Every stage is timed and measured in the messages and the run log (instrument.py).>
 """
 
 import arcpy
 import os.path
-from arcpy import env
+import incremental
+import instrument
+import runcache
+import units
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.overwriteOutput = True
 
-def ScriptTool(projectArea, outPath, clipVegPoly, PreliminaryRegenExclusions, PreliminaryCtExclusions, sliverSize, standSplit):
+def ScriptTool(projectArea, outPath, clipVegPoly, PreliminaryRegenExclusions, PreliminaryCtExclusions, sliverSize, standSplit, engine="", sliverEngine="", workers="", incrementalRun="", runLog="", profileStage="", runCache=""):
     """ScriptTool function docstring"""
+    log = instrument.RunLog("RefineUnits", runLog, profileStage)
+    cache = runcache.open_cache(runCache)
+
+    # Rebuild only around changed exclusions when the last run was kept with the same settings
+    incrementalRun = incrementalRun.lower() == 'true' and engine.lower() != 'overlay'
+    stateNames = ["RefinedRegenExclusions", "RefinedRegenUnits", "RefinedCtExclusions", "RefinedCtUnits"]
+    update = False
+    if incrementalRun:
+        state = incremental.UnitState(outPath, "RefineUnits", [str(sliverSize), standSplit.lower(), sliverEngine.lower(), engine.lower(),
+                                                               runcache.raw_fingerprint(projectArea), runcache.raw_fingerprint(clipVegPoly)])
+        update = state.valid(stateNames)
 
     # Load files
     outReExcl = os.path.join(outPath, "RefinedRegenExclusions")
-    arcpy.CopyFeatures_management(PreliminaryRegenExclusions, outReExcl)
+    with log.stage("RegenMerge", [PreliminaryRegenExclusions]) as stage:
+        arcpy.CopyFeatures_management(PreliminaryRegenExclusions, outReExcl)
     
-    # REGEN: Merge exclusion layers
-    # Erase exclusions from the project area
-    outErase = r'in_memory\Erase'
-    arcpy.analysis.Erase(in_features = projectArea, erase_features = PreliminaryRegenExclusions, out_feature_class = outErase)
-
-    # Remove all < 2 acre slivers
-    ## (This method ensures that slivers adjacent to larger units are preserved)
-
-    ## Split into singlepart polygons
-    arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
-
-    ## Remove all < 2 acre slivers (or as specified)
-    sliverQuery = " POLY_AREA > " + str(sliverSize) + " "
-    arcpy.AddGeometryAttributes_management(Input_Features = r'in_memory\Split', Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.MakeFeatureLayer_management(r'in_memory\Split', "units")
-    arcpy.SelectLayerByAttribute_management("units", "NEW_SELECTION", sliverQuery)
-    outIdentity = r'in_memory\Identity'
-
-    ## Combine/split polygons by adjacency or by stand
-    if standSplit.lower() == 'true':
-        ### Combine all into one multipart polygon
-        arcpy.management.Dissolve(in_features = "units", out_feature_class = r'in_memory\Acre')
-
-        ### Split by FSVeg stands
-        arcpy.analysis.Identity(in_features = r'in_memory\Acre', identity_features = clipVegPoly, out_feature_class = outIdentity)
+        # REGEN: Merge exclusion layers
+        # Commercial thin exclusions other than the preliminary regen units
+        ctExcl =  r'in_memory\ctExcl'
+        arcpy.MakeFeatureLayer_management(PreliminaryCtExclusions, ctExcl)
+        arcpy.SelectLayerByAttribute_management(ctExcl, "NEW_SELECTION", " Exclusion <> 'Regen harvest unit' ")
+        stage.outputs(outReExcl)
+
+    if update:
+        with log.stage("RegenUpdate", [outReExcl]) as stage:
+            outIdentity = incremental.update_units(projectArea, outReExcl, state.path(stateNames[0]), state.path(stateNames[1]), sliverSize, standSplit,
+                                                   clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
     else:
-        ### Combine adjecent units
-        arcpy.cartography.AggregatePolygons("units", outIdentity, "5 Meters")
-
-    ## Delete unnecessary fields
-    fields_to_delete = [field.name for field in arcpy.ListFields(outIdentity) if not field.required]
-    if standSplit.lower() == 'true':
-        fields_to_delete.remove("SETTING_ID")
-    if fields_to_delete:
-        arcpy.DeleteField_management(outIdentity, fields_to_delete)
-
-    # Add Acres field
-    arcpy.AddGeometryAttributes_management(Input_Features = outIdentity, Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.management.AlterField(in_table = outIdentity, field = "POLY_AREA", new_field_name = "Acres")
+        # The overlay faces are reused for the CT units, so only Erase candidates are cached
+        with log.stage("RegenCandidates", [projectArea, PreliminaryRegenExclusions]) as stage:
+            candidateKey = None
+            if cache and engine.lower() != 'overlay':
+                candidateKey = cache.key("RefinedRegenCandidates", [projectArea, PreliminaryRegenExclusions], [engine.lower()])
+            if candidateKey and cache.restore(candidateKey, [r'in_memory\Split']):
+                arcpy.AddMessage("Restored regeneration harvest candidates from the cache")
+            elif engine.lower() == 'overlay':
+                # Split the project area by the regen (bit 0) and CT (bit 1) exclusions once
+                faces = units.planar_overlay(projectArea, [PreliminaryRegenExclusions, ctExcl], r'in_memory\Faces')
+                units.overlay_candidates(faces, 1, r'in_memory\Split')
+            else:
+                # Erase exclusions from the project area
+                outErase = r'in_memory\Erase'
+                arcpy.analysis.Erase(in_features = projectArea, erase_features = PreliminaryRegenExclusions, out_feature_class = outErase)
+
+                ## Split into singlepart polygons
+                arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
+                if candidateKey:
+                    cache.store(candidateKey, [r'in_memory\Split'])
+            stage.outputs(r'in_memory\Split')
+
+        # Remove all < 2 acre slivers (or as specified) and combine/split polygons by adjacency or by stand
+        with log.stage("RegenSlivers", [r'in_memory\Split']) as stage:
+            outIdentity = units.finish_units(r'in_memory\Split', sliverSize, standSplit, clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
 
     outUnits_regen = os.path.join(outPath, "RefinedRegenUnits")
-    arcpy.CopyFeatures_management(outIdentity, outUnits_regen)
+    with log.stage("RegenWrite", [outIdentity]) as stage:
+        arcpy.CopyFeatures_management(outIdentity, outUnits_regen)
+        stage.outputs(outUnits_regen)
 
     # Commercial thin: Merge exclusion layers
-    ctExcl =  r'in_memory\ctExcl'
-    arcpy.MakeFeatureLayer_management(PreliminaryCtExclusions, ctExcl)
-    arcpy.SelectLayerByAttribute_management(ctExcl, "NEW_SELECTION", " Exclusion <> 'Regen harvest unit' ")
-
-        
-    if arcpy.Exists(outUnits_regen):
-        # Add and populate Exclusion field
-        arcpy.management.AddField(in_table = outUnits_regen, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
-        arcpy.management.CalculateField(in_table = outUnits_regen, field = "Exclusion", expression = "\"Regen harvest unit\"")
+    with log.stage("CtMerge", [outUnits_regen]) as stage:
+        if arcpy.Exists(outUnits_regen):
+            # Add and populate Exclusion field
+            arcpy.management.AddField(in_table = outUnits_regen, field_name = "Exclusion", field_type = "TEXT", field_length = 30)
+            arcpy.management.CalculateField(in_table = outUnits_regen, field = "Exclusion", expression = "\"Regen harvest unit\"")
         
-        ## Use the ListFeatureClasses function to return a list
-        
-        env.workspace = outPath
-        exclList_ct = [ctExcl, outUnits_regen]
-        outExclusions = os.path.join(outPath, "RefinedCtExclusions")
-
-    arcpy.management.Merge(inputs = exclList_ct, output = outExclusions)
-
-    # Erase exclusions from the project area
-    outErase = r'in_memory\Erase'
-    arcpy.analysis.Erase(in_features = projectArea, erase_features = outExclusions, out_feature_class = outErase)
-
-    # Remove all < 2 acre slivers
-    ## (This method ensures that slivers adjacent to larger units are preserved)
-
-    ## Split into singlepart polygons
-    arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
-
-    ## Remove all < 2 acre slivers (or as spcified)
-    arcpy.AddGeometryAttributes_management(Input_Features = r'in_memory\Split', Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.MakeFeatureLayer_management(r'in_memory\Split', "units")
-    arcpy.SelectLayerByAttribute_management("units", "NEW_SELECTION", sliverQuery)
-    outIdentity = r'in_memory\Identity'
-    
-    ## Combine/split polygons by adjacency or by stand
-    if standSplit.lower() == 'true':
-        ### Combine all into one multipart polygon
-        arcpy.management.Dissolve(in_features = "units", out_feature_class = r'in_memory\Acre')
-
-        ### Split by FSVeg stands
-        arcpy.analysis.Identity(in_features = r'in_memory\Acre', identity_features = clipVegPoly, out_feature_class = outIdentity)
+            exclList_ct = [ctExcl, outUnits_regen]
+            outExclusions = os.path.join(outPath, "RefinedCtExclusions")
+
+        arcpy.management.Merge(inputs = exclList_ct, output = outExclusions)
+        stage.outputs(outExclusions)
+
+    if update:
+        # Changed regen units show up as changed CT exclusions
+        with log.stage("CtUpdate", [outExclusions]) as stage:
+            outIdentity = incremental.update_units(projectArea, outExclusions, state.path(stateNames[2]), state.path(stateNames[3]), sliverSize, standSplit,
+                                                   clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
     else:
-        ### Combine adjecent units
-        arcpy.cartography.AggregatePolygons("units", outIdentity, "5 Meters")
-
-    ## Delete unnecessary fields
-    fields_to_delete = [field.name for field in arcpy.ListFields(outIdentity) if not field.required]
-    if standSplit.lower() == 'true':
-        fields_to_delete.remove("SETTING_ID")
-    if fields_to_delete:
-        arcpy.DeleteField_management(outIdentity, fields_to_delete)
-
-    # Add Acres field
-    arcpy.AddGeometryAttributes_management(Input_Features = outIdentity, Geometry_Properties = "AREA", Area_Unit = "ACRES")
-    arcpy.management.AlterField(in_table = outIdentity, field = "POLY_AREA", new_field_name = "Acres")
+        with log.stage("CtCandidates", [projectArea, outExclusions]) as stage:
+            if engine.lower() == 'overlay':
+                # Reuse the overlay, adding only the refined regen units as bit 2
+                faces = units.add_overlay_layer(faces, outUnits_regen, 2, r'in_memory\FacesCt')
+                units.overlay_candidates(faces, 2 | 4, r'in_memory\Split')
+            else:
+                # Erase exclusions from the project area
+                outErase = r'in_memory\Erase'
+                arcpy.analysis.Erase(in_features = projectArea, erase_features = outExclusions, out_feature_class = outErase)
+
+                ## Split into singlepart polygons
+                arcpy.management.MultipartToSinglepart(in_features = outErase, out_feature_class = r'in_memory\Split')
+            stage.outputs(r'in_memory\Split')
+
+        # Remove all < 2 acre slivers (or as specified) and combine/split polygons by adjacency or by stand
+        with log.stage("CtSlivers", [r'in_memory\Split']) as stage:
+            outIdentity = units.finish_units(r'in_memory\Split', sliverSize, standSplit, clipVegPoly, r'in_memory\Identity', sliverEngine, workers)
+            stage.outputs(outIdentity)
 
     outUnits_ct = os.path.join(outPath, "RefinedCtUnits")
-    arcpy.CopyFeatures_management(outIdentity, outUnits_ct)
+    with log.stage("CtWrite", [outIdentity]) as stage:
+        arcpy.CopyFeatures_management(outIdentity, outUnits_ct)
+        stage.outputs(outUnits_ct)
+
+    # Keep this run's exclusions and units for the next incremental run
+    if incrementalRun:
+        state.save([os.path.join(outPath, name) for name in stateNames])
 
 if __name__ == '__main__':
     # ScriptTool parameters
@@ -140,6 +168,13 @@ if __name__ == '__main__':
     parameter4 = PreliminaryCtExclusions = arcpy.GetParameterAsText(4)
     parameter5 = sliverSize = arcpy.GetParameterAsText(5)
     parameter6 = standSplit = arcpy.GetParameterAsText(6)
+    parameter7 = engine = arcpy.GetParameterAsText(7) if arcpy.GetArgumentCount() > 7 else ""
+    parameter8 = sliverEngine = arcpy.GetParameterAsText(8) if arcpy.GetArgumentCount() > 8 else ""
+    parameter9 = workers = arcpy.GetParameterAsText(9) if arcpy.GetArgumentCount() > 9 else ""
+    parameter10 = incrementalRun = arcpy.GetParameterAsText(10) if arcpy.GetArgumentCount() > 10 else ""
+    parameter11 = runLog = arcpy.GetParameterAsText(11) if arcpy.GetArgumentCount() > 11 else ""
+    parameter12 = profileStage = arcpy.GetParameterAsText(12) if arcpy.GetArgumentCount() > 12 else ""
+    parameter13 = runCache = arcpy.GetParameterAsText(13) if arcpy.GetArgumentCount() > 13 else ""
 
 
-    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6)
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13)
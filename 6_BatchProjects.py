@@ -0,0 +1,93 @@
+"""
+Tool:               <NEPA Unit determination>
+Source Name:        <6_BatchProjects>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Input project polygons and the forest-wide datasets to run the ClipData, TreeTopPoints, LidarSummary and
+                     UnitIdentification tools for every project.>
+Required Arguments: <parameter0 = projects = Project areas (feature layer)>
+                    <parameter1 = nameField = Project name field; polygons with the same name form one project (field)>
+                    <parameter2 = outFolder = Output folder, one <name>\Project.gdb per project (folder)>
+Optional Arguments: <parameter3 = clipLandtype = Land type (feature layer)>
+                    <parameter4 = clipRiperian = Riperian buffer(feature layer)>
+                    <parameter5 = clipMgmtArea = Management Area (feature layer)>
+                    <parameter6 = clipSpecialUse = Special use areas (feature layer)>
+                    <parameter7 = clipVegPoly = FSVeg stands (feature layer)>
+                    <parameter8 = clipOldGrowth = Old Growth (table)>
+                    <parameter9 = clipHarvest = Past harvests in FACTS (feature layer)>
+                    <parameter10 = clipCHM = Canopy height model (raster layer)>
+                    <parameter11 = minHeight = Minimum tree height in feet (double)>
+                    <parameter12 = smooth = Canopy height model smoothing switch (boolean)>
+                    <parameter13 = toFeet = Convert canopy heights from m to ft (boolean)>
+                    <parameter14 = ctMin = Minimum CT tree height (double)>
+                    <parameter15 = ctMax = Maximum CT tree height (double)>
+                    <parameter16 = regenMin = Minimum regen tree height (double)>
+                    <parameter17 = regenMax = Maximum regen tree height (double)>
+                    <parameter18 = recruitment = Exclude recruitment old growth (boolean)>
+                    <parameter19 = harvestAge = Age of harvests to exclude (integer)>
+                    <parameter20 = regenTPA = The minimum TPA of regen sized trees in regen units (short)>
+                    <parameter21 = ctTPA = The minimum TPA of CT sized trees in CT units (short)>
+                    <parameter22 = sliverSize = Minimum unit size (double)>
+                    <parameter23 = standSplit = Split units by FSVeg Spatial stands (boolean)>
+                    <parameter24 = engine = Unit engine, "Erase" (default), "Overlay" or "Raster" (string)>
+                    <parameter25 = sliverEngine = Sliver removal and aggregation, "ArcGIS" (default) or "NumPy"; NumPy drops groups of
+                                                  small parts rather than single parts and does not fill the gaps between grouped parts (string)>
+                    <parameter26 = workers = Number of projects processed at once; 0 uses every CPU (long)>
+Description:        <Runs tools 1 to 4 for many project areas. Each source layer is loaded and indexed once and every
+                     project is clipped from memory (batch.py), so the forest-wide layers are not rescanned per project.
+                     Projects are then processed independently on `workers` processes. Tree tops and the lidar summary
+                     need both the CHM and the stands; without them only the units are identified. Run RefineUnits on
+                     each project's Project.gdb after the preliminary exclusions are reviewed.>
+"""
+
+import arcpy
+import batch
+arcpy.CheckOutExtension("Spatial")
+arcpy.env.overwriteOutput = True
+
+def ScriptTool(projects, nameField, outFolder, clipLandtype, clipRiperian, clipMgmtArea, clipSpecialUse, clipVegPoly, clipOldGrowth, clipHarvest, clipCHM,
+               minHeight, smooth, toFeet, ctMin, ctMax, regenMin, regenMax, recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit,
+               engine="", sliverEngine="", workers=""):
+    """ScriptTool function docstring"""
+
+    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(26911) #NAD_1983_UTM_Zone_11N
+
+    sources = {"clipLandtype": clipLandtype, "clipRiperian": clipRiperian, "clipMgmtArea": clipMgmtArea, "clipSpecialUse": clipSpecialUse,
+               "clipHarvest": clipHarvest, "clipVegPoly": clipVegPoly}
+    treeParameters = (smooth, toFeet, minHeight)
+    summaryParameters = (ctMin, ctMax, regenMin, regenMax)
+    unitParameters = (recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit, engine, sliverEngine)
+    for gdb in batch.run_projects(projects, nameField, outFolder, sources, clipOldGrowth, clipCHM, treeParameters, summaryParameters, unitParameters, workers):
+        arcpy.AddMessage("Complete: " + gdb)
+
+if __name__ == '__main__':
+    # ScriptTool parameters
+    parameter0 = projects = arcpy.GetParameterAsText(0)
+    parameter1 = nameField = arcpy.GetParameterAsText(1)
+    parameter2 = outFolder = arcpy.GetParameterAsText(2)
+    parameter3 = clipLandtype = arcpy.GetParameterAsText(3)
+    parameter4 = clipRiperian = arcpy.GetParameterAsText(4)
+    parameter5 = clipMgmtArea = arcpy.GetParameterAsText(5)
+    parameter6 = clipSpecialUse = arcpy.GetParameterAsText(6)
+    parameter7 = clipVegPoly = arcpy.GetParameterAsText(7)
+    parameter8 = clipOldGrowth = arcpy.GetParameterAsText(8)
+    parameter9 = clipHarvest = arcpy.GetParameterAsText(9)
+    parameter10 = clipCHM = arcpy.GetParameterAsText(10)
+    parameter11 = minHeight = arcpy.GetParameterAsText(11)
+    parameter12 = smooth = arcpy.GetParameterAsText(12)
+    parameter13 = toFeet = arcpy.GetParameterAsText(13)
+    parameter14 = ctMin = arcpy.GetParameterAsText(14)
+    parameter15 = ctMax = arcpy.GetParameterAsText(15)
+    parameter16 = regenMin = arcpy.GetParameterAsText(16)
+    parameter17 = regenMax = arcpy.GetParameterAsText(17)
+    parameter18 = recruitment = arcpy.GetParameterAsText(18)
+    parameter19 = harvestAge = arcpy.GetParameterAsText(19)
+    parameter20 = regenTPA = arcpy.GetParameterAsText(20)
+    parameter21 = ctTPA = arcpy.GetParameterAsText(21)
+    parameter22 = sliverSize = arcpy.GetParameterAsText(22)
+    parameter23 = standSplit = arcpy.GetParameterAsText(23)
+    parameter24 = engine = arcpy.GetParameterAsText(24) if arcpy.GetArgumentCount() > 24 else ""
+    parameter25 = sliverEngine = arcpy.GetParameterAsText(25) if arcpy.GetArgumentCount() > 25 else ""
+    parameter26 = workers = arcpy.GetParameterAsText(26) if arcpy.GetArgumentCount() > 26 else ""
+    
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14, parameter15, parameter16, parameter17, parameter18, parameter19, parameter20, parameter21, parameter22, parameter23, parameter24, parameter25, parameter26)
@@ -0,0 +1,114 @@
+"""
+Tool:               <NEPA Unit determination>
+Source Name:        <7_UnitSweep>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Input the UnitIdentification datasets and lists of parameter values to compare unit outcomes across
+                     every combination.>
+Required Arguments: <parameter0 = projectArea = Project area (feature layer)>
+                    <parameter1 = outPath = Output location (workspace)>
+                    <parameter2 = clipVegPoly = FSVeg stands (feature layer)>
+Optional Arguments: <parameter3 = recruitment = Exclude recruitment old growth (boolean)>
+                    <parameter4 = clipRiperian = Riperian buffer(feature layer)>
+                    <parameter5 = clipLandtype = Land type (feature layer)>
+                    <parameter6 = clipSpecialUse = Special use areas (feature layer)>
+                    <parameter7 = clipHarvest = Past harvests in FACTS (feature layer)>
+                    <parameter8 = clipMgmtArea = Management Area (feature layer)>
+                    <parameter9 = clipLidarSummary = Lidar Summary from TreeTops and LidarSummary tools (feature layer)>
+                    <parameter10 = regenTPAs = Minimum regen TPA values, e.g. "50 75 100"; blank for 0 (string)>
+                    <parameter11 = ctTPAs = Minimum CT TPA values; blank for 0 (string)>
+                    <parameter12 = sliverSizes = Minimum unit sizes in acres; blank for 2 (string)>
+                    <parameter13 = harvestAges = Ages of harvests to exclude; blank for 80 (string)>
+                    <parameter14 = standSplit = Count units split by FSVeg Spatial stands (boolean)>
+                    <parameter15 = cellSize = Grid cell size in map units, default 2 (double)>
+                    <parameter16 = workers = Worker processes for the combinations; 0 uses every CPU (long)>
+Description:        <Writes a UnitSweep table of the units and acres of each unit type for every combination of the listed
+                     regenTPA, ctTPA, sliverSize and harvestAge values. The exclusion layers that do not depend on them
+                     are written and burned onto a grid once, with the harvest years and the lidar summary TPAs kept per
+                     cell, so each combination is a few mask operations and a labelling of the grid (sweep.py) spread
+                     over `workers` processes. Figures follow the Raster engine of the UnitIdentification tool; run that
+                     tool on the chosen combination for the unit polygons.>
+"""
+
+import arcpy
+import importlib
+import os.path
+import shutil
+import tempfile
+from datetime import date
+import exclusions
+import parallel
+import sweep
+import units
+arcpy.CheckOutExtension("Spatial")
+arcpy.env.overwriteOutput = True
+
+# Rules that depend on the swept parameters; sweep.py applies them per combination
+SWEPT_RULES = ["exclHarvest", "exclRegenTPA", "exclCtTPA"]
+
+def ScriptTool(projectArea, outPath, clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, clipMgmtArea, clipLidarSummary,
+               regenTPAs, ctTPAs, sliverSizes, harvestAges, standSplit, cellSize="", workers=""):
+    """ScriptTool function docstring"""
+
+    # Write and burn the exclusion layers shared by every combination once
+    ExclusionRules = importlib.import_module("4_UnitIdentification").ExclusionRules
+    rules = [rule for rule in ExclusionRules(clipVegPoly, recruitment, clipRiperian, clipLandtype, clipSpecialUse, clipHarvest, "", clipMgmtArea, clipLidarSummary, "0", "0")
+             if rule.name not in SWEPT_RULES]
+    written = exclusions.write_exclusions(rules, outPath)
+    layers = [written[rule.name] for rule in rules if rule.name in written]
+    bits = dict((path, i) for i, path in enumerate(layers))
+    cellSize = float(cellSize) if cellSize != "" else 2.0
+    grids, grid = units.sweep_grids(projectArea, layers, clipHarvest, clipLidarSummary, clipVegPoly, cellSize)
+
+    # Parts within 5 m form one unit; the grids grow each side by half of that
+    settings = {"cell_acres": grid.cell_acres, "year": date.today().year, "stand_split": standSplit.lower() == 'true',
+                "radius": int(5.0 / (cellSize * grid.spatial_reference.metersPerUnit)) // 2,
+                "regen_mask": sum(1 << bits[path] for path in exclusions.exclusions_for(rules, written, "Regen")),
+                "ct_mask": sum(1 << bits[path] for path in exclusions.exclusions_for(rules, written, "CT"))}
+    folder = tempfile.mkdtemp(prefix = "sweep_")
+    sweep.save_grids(folder, grids, settings)
+    del grids, grid
+
+    # Evaluate the combinations and write one row per combination and unit type
+    combinations = sweep.combinations(sweep.parse_values(regenTPAs, 0), sweep.parse_values(ctTPAs, 0),
+                                      sweep.parse_values(sliverSizes, 2), sweep.parse_values(harvestAges, 80))
+    arcpy.AddMessage("Evaluating " + str(len(combinations)) + " combinations...")
+    outSweep = os.path.join(outPath, "UnitSweep")
+    if arcpy.Exists(outSweep):
+        arcpy.Delete_management(outSweep)
+    arcpy.CreateTable_management(outPath, "UnitSweep")
+    fields = [("RegenTPA", "DOUBLE"), ("CtTPA", "DOUBLE"), ("SliverSize", "DOUBLE"), ("HarvestAge", "SHORT"),
+              ("UnitType", "TEXT"), ("Units", "LONG"), ("Acres", "DOUBLE")]
+    for name, fieldType in fields:
+        arcpy.management.AddField(in_table = outSweep, field_name = name, field_type = fieldType, field_length = 10 if fieldType == "TEXT" else None)
+    tasks = sweep.sweep_chunks(folder, combinations, 4 * parallel.worker_count(workers))
+    try:
+        with arcpy.da.InsertCursor(outSweep, [name for name, fieldType in fields]) as cursor:
+            for rows in parallel.parallel_imap(sweep._sweep_task, tasks, workers):
+                for row in rows:
+                    cursor.insertRow(row[:3] + (int(row[3]),) + row[4:6] + (round(row[6], 2),))
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    arcpy.AddMessage("Complete")
+
+if __name__ == '__main__':
+    # ScriptTool parameters
+    parameter0 = projectArea = arcpy.GetParameterAsText(0)
+    parameter1 = outPath = arcpy.GetParameterAsText(1)
+    parameter2 = clipVegPoly = arcpy.GetParameterAsText(2)
+    parameter3 = recruitment = arcpy.GetParameterAsText(3)
+    parameter4 = clipRiperian = arcpy.GetParameterAsText(4)
+    parameter5 = clipLandtype = arcpy.GetParameterAsText(5)
+    parameter6 = clipSpecialUse = arcpy.GetParameterAsText(6)
+    parameter7 = clipHarvest = arcpy.GetParameterAsText(7)
+    parameter8 = clipMgmtArea = arcpy.GetParameterAsText(8)
+    parameter9 = clipLidarSummary = arcpy.GetParameterAsText(9)
+    parameter10 = regenTPAs = arcpy.GetParameterAsText(10)
+    parameter11 = ctTPAs = arcpy.GetParameterAsText(11)
+    parameter12 = sliverSizes = arcpy.GetParameterAsText(12)
+    parameter13 = harvestAges = arcpy.GetParameterAsText(13)
+    parameter14 = standSplit = arcpy.GetParameterAsText(14)
+    parameter15 = cellSize = arcpy.GetParameterAsText(15) if arcpy.GetArgumentCount() > 15 else ""
+    parameter16 = workers = arcpy.GetParameterAsText(16) if arcpy.GetArgumentCount() > 16 else ""
+    
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14, parameter15, parameter16)
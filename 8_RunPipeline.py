@@ -0,0 +1,96 @@
+"""
+Tool:               <NEPA Unit determination>
+Source Name:        <8_RunPipeline>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Input a project area and the source datasets to run the ClipData, TreeTopPoints, LidarSummary and
+                     UnitIdentification tools in one process, writing only the products asked for.>
+Required Arguments: <parameter0 = projectArea = Project area (feature layer)>
+                    <parameter1 = outPath = Output workspace (workspace)>
+Optional Arguments: <parameter2 = clipLandtype = Land type (feature layer)>
+                    <parameter3 = clipRiperian = Riperian buffer(feature layer)>
+                    <parameter4 = clipMgmtArea = Management Area (feature layer)>
+                    <parameter5 = clipSpecialUse = Special use areas (feature layer)>
+                    <parameter6 = clipVegPoly = FSVeg stands (feature layer)>
+                    <parameter7 = clipOldGrowth = Old Growth (table)>
+                    <parameter8 = clipHarvest = Past harvests in FACTS (feature layer)>
+                    <parameter9 = clipCHM = Canopy height model (raster layer)>
+                    <parameter10 = minHeight = Minimum tree height in feet (double)>
+                    <parameter11 = smooth = Canopy height model smoothing switch (boolean)>
+                    <parameter12 = toFeet = Convert canopy heights from m to ft (boolean)>
+                    <parameter13 = ctMin = Minimum CT tree height (double)>
+                    <parameter14 = ctMax = Maximum CT tree height (double)>
+                    <parameter15 = regenMin = Minimum regen tree height (double)>
+                    <parameter16 = regenMax = Maximum regen tree height (double)>
+                    <parameter17 = recruitment = Exclude recruitment old growth (boolean)>
+                    <parameter18 = harvestAge = Age of harvests to exclude (integer)>
+                    <parameter19 = regenTPA = The minimum TPA of regen sized trees in regen units (short)>
+                    <parameter20 = ctTPA = The minimum TPA of CT sized trees in CT units (short)>
+                    <parameter21 = sliverSize = Minimum unit size (double)>
+                    <parameter22 = standSplit = Split units by FSVeg Spatial stands (boolean)>
+                    <parameter23 = engine = Unit engine, "Erase" (default), "Overlay" or "Raster" (string)>
+                    <parameter24 = sliverEngine = Sliver removal and aggregation, "ArcGIS" (default) or "NumPy"; NumPy drops groups of
+                                                  small parts rather than single parts and does not fill the gaps between grouped parts (string)>
+                    <parameter25 = products = Outputs to write, e.g. "PreliminaryRegenUnits;TreeTop"; blank writes the
+                                   four Preliminary outputs RefineUnits needs (multivalue string)>
+                    <parameter26 = checkpoints = Also write every intermediate dataset (boolean)>
+Description:        <Runs tools 1 to 4 as stages of one in-process pipeline (pipeline.py). Steps hand their results to each
+                     other in memory instead of writing and re-reading the clipped layers, CHM, tree tops and summary,
+                     and tree top detection runs alongside the clipping. Any intermediate can still be written by naming
+                     it in products (clipVegPoly, CHM_ft, TreeTop, LidarSummary, LidarSummaryHeights, excl*) or all of
+                     them with checkpoints. Run RefineUnits on the output after the preliminary exclusions are reviewed.>
+"""
+
+import arcpy
+import pipeline
+arcpy.CheckOutExtension("Spatial")
+arcpy.env.overwriteOutput = True
+
+def ScriptTool(projectArea, outPath, clipLandtype, clipRiperian, clipMgmtArea, clipSpecialUse, clipVegPoly, clipOldGrowth, clipHarvest, clipCHM,
+               minHeight, smooth, toFeet, ctMin, ctMax, regenMin, regenMax, recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit,
+               engine="", sliverEngine="", products="", checkpoints=""):
+    """ScriptTool function docstring"""
+
+    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(26911) #NAD_1983_UTM_Zone_11N
+
+    sources = {"clipLandtype": clipLandtype, "clipRiperian": clipRiperian, "clipMgmtArea": clipMgmtArea, "clipSpecialUse": clipSpecialUse,
+               "clipHarvest": clipHarvest, "clipVegPoly": clipVegPoly}
+    treeParameters = (smooth, toFeet, minHeight)
+    summaryParameters = (ctMin, ctMax, regenMin, regenMax)
+    unitParameters = (recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit, engine, sliverEngine)
+    products = [name.strip("' ") for name in products.split(";") if name.strip("' ")]
+    for path in pipeline.run_pipeline(projectArea, outPath, sources, clipOldGrowth, clipCHM, treeParameters, summaryParameters, unitParameters,
+                                      products, checkpoints.lower() == 'true'):
+        arcpy.AddMessage("Wrote " + path)
+
+if __name__ == '__main__':
+    # ScriptTool parameters
+    parameter0 = projectArea = arcpy.GetParameterAsText(0)
+    parameter1 = outPath = arcpy.GetParameterAsText(1)
+    parameter2 = clipLandtype = arcpy.GetParameterAsText(2)
+    parameter3 = clipRiperian = arcpy.GetParameterAsText(3)
+    parameter4 = clipMgmtArea = arcpy.GetParameterAsText(4)
+    parameter5 = clipSpecialUse = arcpy.GetParameterAsText(5)
+    parameter6 = clipVegPoly = arcpy.GetParameterAsText(6)
+    parameter7 = clipOldGrowth = arcpy.GetParameterAsText(7)
+    parameter8 = clipHarvest = arcpy.GetParameterAsText(8)
+    parameter9 = clipCHM = arcpy.GetParameterAsText(9)
+    parameter10 = minHeight = arcpy.GetParameterAsText(10)
+    parameter11 = smooth = arcpy.GetParameterAsText(11)
+    parameter12 = toFeet = arcpy.GetParameterAsText(12)
+    parameter13 = ctMin = arcpy.GetParameterAsText(13)
+    parameter14 = ctMax = arcpy.GetParameterAsText(14)
+    parameter15 = regenMin = arcpy.GetParameterAsText(15)
+    parameter16 = regenMax = arcpy.GetParameterAsText(16)
+    parameter17 = recruitment = arcpy.GetParameterAsText(17)
+    parameter18 = harvestAge = arcpy.GetParameterAsText(18)
+    parameter19 = regenTPA = arcpy.GetParameterAsText(19)
+    parameter20 = ctTPA = arcpy.GetParameterAsText(20)
+    parameter21 = sliverSize = arcpy.GetParameterAsText(21)
+    parameter22 = standSplit = arcpy.GetParameterAsText(22)
+    parameter23 = engine = arcpy.GetParameterAsText(23) if arcpy.GetArgumentCount() > 23 else ""
+    parameter24 = sliverEngine = arcpy.GetParameterAsText(24) if arcpy.GetArgumentCount() > 24 else ""
+    parameter25 = products = arcpy.GetParameterAsText(25) if arcpy.GetArgumentCount() > 25 else ""
+    parameter26 = checkpoints = arcpy.GetParameterAsText(26) if arcpy.GetArgumentCount() > 26 else ""
+    
+    ScriptTool(parameter0, parameter1, parameter2, parameter3, parameter4, parameter5, parameter6, parameter7, parameter8, parameter9, parameter10, parameter11, parameter12, parameter13, parameter14, parameter15, parameter16, parameter17, parameter18, parameter19, parameter20, parameter21, parameter22, parameter23, parameter24, parameter25, parameter26)
@@ -0,0 +1,186 @@
+"""
+Tool:               <Multi-project batch>
+Source Name:        <batch>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 6_BatchProjects to run the ClipData, TreeTopPoints, LidarSummary and UnitIdentification
+                     tools on many project areas.>
+Description:        <Every forest-wide source layer is read once into memory with a grid index over its feature extents
+                     (SourceLayer), and the old growth table is read once into a dict. Each project is clipped from that
+                     shared state: the index gives the features near the project and only those are intersected with it,
+                     so no source is rescanned per project. The clipped layers go to <name>/Project.gdb per project, and
+                     the tree tops, lidar summary and units of the projects, which do not depend on each other, are
+                     computed on a worker pool. The CHM is clipped per project by reading only its window.>
+"""
+import collections
+import importlib
+import os.path
+
+import arcpy
+
+import chmraster
+import featureio
+import parallel
+import spatialindex
+
+# Source layers in the order and with the names used by 1_ClipData
+LAYER_NAMES = ["clipLandtype", "clipRiperian", "clipMgmtArea", "clipSpecialUse", "clipHarvest", "clipVegPoly"]
+OLD_GROWTH_FIELDS = ["OLD_GROWTH_STATUS", "OLD_GROWTH_STATUS_METHOD", "OLD_GROWTH_STATUS_YEAR"]
+
+
+class SourceLayer(object):
+    """Every feature of a polygon source layer, held in memory with a grid index over the feature extents"""
+
+    def __init__(self, source, spatialReference):
+        self.source = source
+        self.spatialReference = spatialReference
+        self.fields = [f for f in arcpy.ListFields(source) if f.editable and f.type not in ("OID", "Geometry")]
+        self.shapes = []
+        self.rows = []
+        with arcpy.da.SearchCursor(source, ["SHAPE@"] + [f.name for f in self.fields], spatial_reference = spatialReference) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    self.shapes.append(row[0])
+                    self.rows.append(row[1:])
+        self.index = spatialindex.GridIndex(featureio.extent_bounds(self.shapes))
+
+    def clip(self, area):
+        """(geometry, attribute values) of every feature meeting the polygon `area`, clipped to it"""
+        _, candidates = self.index.query_boxes(featureio.extent_bounds([area]))
+        for i in candidates:
+            if self.shapes[i].disjoint(area):
+                continue
+            piece = self.shapes[i].intersect(area, 4)
+            if piece.area > 0:
+                yield piece, self.rows[i]
+
+    def write(self, area, out, join=None):
+        """Write the features clipped to `area` to `out`; `join` is (key field, lookup dict, joined fields)"""
+        outFolder, outName = os.path.split(out)
+        arcpy.CreateFeatureclass_management(outFolder, outName, "POLYGON", spatial_reference = self.spatialReference)
+        for field in self.fields:
+            arcpy.management.AddField(in_table = out, field_name = field.name, field_type = featureio.FIELD_TYPES.get(field.type, "TEXT"),
+                                      field_length = field.length)
+        names = [f.name for f in self.fields]
+        extra = []
+        if join:
+            keyField, lookup, extra = join
+            keyIndex = names.index(keyField)
+            for name, fieldType, length in lookup.fieldTypes:
+                arcpy.management.AddField(in_table = out, field_name = name, field_type = fieldType, field_length = length)
+        count = 0
+        with arcpy.da.InsertCursor(out, ["SHAPE@"] + names + list(extra)) as cursor:
+            for piece, row in self.clip(area):
+                if join:
+                    row = row + tuple(lookup.get(row[keyIndex], lookup.missing))
+                cursor.insertRow((piece,) + tuple(row))
+                count += 1
+        return count
+
+
+class TableLookup(dict):
+    """Dict of key to the values of `fields` of a table, read once; the first row of each key wins"""
+
+    def __init__(self, table, keyField, fields):
+        dict.__init__(self)
+        tableFields = dict((f.name, f) for f in arcpy.ListFields(table))
+        self.fieldTypes = [(name, featureio.FIELD_TYPES.get(tableFields[name].type, "TEXT"), tableFields[name].length) for name in fields]
+        self.missing = (None,) * len(fields)
+        with arcpy.da.SearchCursor(table, [keyField] + list(fields)) as cursor:
+            for row in cursor:
+                if row[0] not in self:
+                    self[row[0]] = row[1:]
+
+
+def load_sources(sources, spatialReference):
+    """OrderedDict of layer name to SourceLayer for the sources, keyed like LAYER_NAMES, that exist"""
+    loaded = collections.OrderedDict()
+    for name in LAYER_NAMES:
+        source = sources.get(name)
+        if source and arcpy.Exists(source):
+            arcpy.AddMessage("Loading " + name + "...")
+            loaded[name] = SourceLayer(source, spatialReference)
+    return loaded
+
+
+def project_areas(projects, nameField, spatialReference):
+    """List of (name, polygon) of the project polygons, dissolved by name"""
+    areas = collections.OrderedDict()
+    with arcpy.da.SearchCursor(projects, ["SHAPE@", nameField], spatial_reference = spatialReference) as cursor:
+        for shape, name in cursor:
+            if shape is None:
+                continue
+            name = str(name)
+            areas[name] = areas[name].union(shape) if name in areas else shape
+    return list(areas.items())
+
+
+def write_project(name, area, outFolder, layers, oldGrowth=None):
+    """Create <outFolder>/<name>/Project.gdb holding the project area and every layer clipped to it; returns the geodatabase path.
+
+    Each project gets its own folder because LidarSummary keeps its caches
+    next to the geodatabase.
+    """
+    projectFolder = os.path.join(outFolder, arcpy.ValidateTableName(name, outFolder))
+    if not os.path.isdir(projectFolder):
+        os.makedirs(projectFolder)
+    gdb = os.path.join(projectFolder, "Project.gdb")
+    if not arcpy.Exists(gdb):
+        arcpy.CreateFileGDB_management(projectFolder, "Project.gdb")
+    projectArea = os.path.join(gdb, "projectArea")
+    arcpy.CopyFeatures_management([area], projectArea)
+    for layerName, layer in layers.items():
+        join = None
+        if layerName == "clipVegPoly" and oldGrowth is not None:
+            join = ("SETTING_ID", oldGrowth, OLD_GROWTH_FIELDS)
+        layer.write(area, os.path.join(gdb, layerName), join)
+    return gdb
+
+
+def _project_task(task):
+    """Run the TreeTopPoints, LidarSummary and UnitIdentification tools on one clipped project geodatabase"""
+    gdb, chm, treeParameters, summaryParameters, unitParameters = task
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("Spatial")
+    projectArea = os.path.join(gdb, "projectArea")
+    layer = lambda name: os.path.join(gdb, name) if arcpy.Exists(os.path.join(gdb, name)) else ""
+    clipVegPoly = layer("clipVegPoly")
+
+    if chm and clipVegPoly:
+        clipCHM = chmraster.clip_raster(chm, projectArea, os.path.join(gdb, "clipCHM"))
+        smooth, toFeet, minHeight = treeParameters
+        importlib.import_module("2_TreeTopPoints").ScriptTool(clipCHM, "", smooth, toFeet, minHeight, gdb)
+        ctMin, ctMax, regenMin, regenMax = summaryParameters
+        importlib.import_module("3_LidarSummary").ScriptTool(os.path.join(gdb, "TreeTop"), clipVegPoly, gdb, ctMin, ctMax, regenMin, regenMax)
+    if clipVegPoly:
+        recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit, engine, sliverEngine = unitParameters
+        importlib.import_module("4_UnitIdentification").ScriptTool(projectArea, gdb, clipVegPoly, recruitment, layer("clipRiperian"), layer("clipLandtype"),
+                                                                   layer("clipSpecialUse"), layer("clipHarvest"), harvestAge, layer("clipMgmtArea"),
+                                                                   layer("LidarSummary"), regenTPA, ctTPA, sliverSize, standSplit, engine, "", "", sliverEngine)
+    return gdb
+
+
+def run_projects(projects, nameField, outFolder, sources, oldGrowth, chm, treeParameters, summaryParameters, unitParameters, workers=""):
+    """Clip the sources to every project from one in-memory load, then process the projects on up to `workers` processes.
+
+    `sources` maps the LAYER_NAMES to source layers. The parameter tuples
+    are those of _project_task. Yields each project geodatabase once its
+    units are written, in project order.
+    """
+    spatialReference = arcpy.env.outputCoordinateSystem or arcpy.Describe(projects).spatialReference
+    layers = load_sources(sources, spatialReference)
+    lookup = None
+    if "clipVegPoly" in layers and oldGrowth and arcpy.Exists(oldGrowth):
+        arcpy.AddMessage("Loading old growth...")
+        lookup = TableLookup(oldGrowth, "FSVEG_SETTING_ID", OLD_GROWTH_FIELDS)
+
+    tasks = []
+    for name, area in project_areas(projects, nameField, spatialReference):
+        arcpy.AddMessage("Clipping project " + name + "...")
+        gdb = write_project(name, area, outFolder, layers, lookup)
+        tasks.append((gdb, chm, treeParameters, summaryParameters, unitParameters))
+    # The workers only need the small clipped geodatabases
+    del layers, lookup
+    arcpy.AddMessage("Processing " + str(len(tasks)) + " projects on " + str(min(parallel.worker_count(workers), len(tasks))) + " workers...")
+    for gdb in parallel.parallel_imap(_project_task, tasks, workers):
+        yield gdb
@@ -0,0 +1,175 @@
+"""
+Tool:               <Canopy height model raster access>
+Source Name:        <chmraster>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts to move canopy height models between arcpy rasters and NumPy arrays.>
+Description:        <Whole raster and block by block reading and writing of arcpy rasters as float32 arrays with NaN as
+                     NoData. RasterBlockReader and RasterBlockWriter can be sliced like arrays, so the tiled tree top
+                     detector in treetops.py can stream rasters that do not fit in memory.
+                     clip_raster clips a raster to polygons by reading only the window over their envelope, masking it
+                     band by band with the scanline rasterizer in rasterize.py and writing tiled, compressed output,
+                     so the cost follows the project size rather than the size of the source raster.>
+"""
+import os.path
+import shutil
+import tempfile
+
+import arcpy
+import numpy
+
+import featureio
+import rasterize
+import spatialindex
+
+
+def raster_geotransform(raster):
+    """GDAL style geotransform of an arcpy Raster"""
+    return (raster.extent.XMin, raster.meanCellWidth, 0.0, raster.extent.YMax, 0.0, -raster.meanCellHeight)
+
+
+def _nodata_to_nan(array, noDataValue):
+    array = array.astype(numpy.float32)
+    if noDataValue is not None:
+        array[array == numpy.float32(noDataValue)] = numpy.nan
+    return array
+
+
+def raster_to_array(raster):
+    """Read an arcpy Raster into a float32 array with NaN as NoData"""
+    return _nodata_to_nan(arcpy.RasterToNumPyArray(raster), raster.noDataValue)
+
+
+def array_to_raster(array, raster, outRaster, noData=numpy.nan):
+    """Save an array on the grid of an arcpy Raster"""
+    lowerLeft = arcpy.Point(raster.extent.XMin, raster.extent.YMin)
+    outArray = arcpy.NumPyArrayToRaster(array, lowerLeft, raster.meanCellWidth, raster.meanCellHeight, noData)
+    arcpy.management.CopyRaster(outArray, outRaster)
+    arcpy.management.DefineProjection(outRaster, raster.spatialReference)
+
+
+def save_array(array, geotransform, spatialReference, outRaster, noData=numpy.nan):
+    """Save an array on the grid described by a geotransform"""
+    x0, dx, _, y0, _, dy = geotransform
+    lowerLeft = arcpy.Point(x0, y0 + array.shape[0] * dy)
+    arcpy.management.CopyRaster(arcpy.NumPyArrayToRaster(array, lowerLeft, dx, -dy, noData), outRaster)
+    arcpy.management.DefineProjection(outRaster, spatialReference)
+
+
+def _block_corner(raster, r1, c0):
+    """Lower left corner of a block ending at row r1 and starting at column c0"""
+    return arcpy.Point(raster.extent.XMin + c0 * raster.meanCellWidth, raster.extent.YMax - r1 * raster.meanCellHeight)
+
+
+def _block_bounds(key, shape):
+    rowSlice, colSlice = key
+    r0, r1, _ = rowSlice.indices(shape[0])
+    c0, c1, _ = colSlice.indices(shape[1])
+    return r0, r1, c0, c1
+
+
+class RasterBlockReader(object):
+    """Read-only, array-like view of a raster that reads only the sliced block from disk"""
+
+    def __init__(self, raster):
+        self.path = raster.catalogPath if hasattr(raster, "catalogPath") else raster
+        self.raster = arcpy.Raster(self.path)
+        self.shape = (self.raster.height, self.raster.width)
+
+    def __getitem__(self, key):
+        r0, r1, c0, c1 = _block_bounds(key, self.shape)
+        block = arcpy.RasterToNumPyArray(self.raster, _block_corner(self.raster, r1, c0), c1 - c0, r1 - r0)
+        return _nodata_to_nan(block, self.raster.noDataValue)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+class RasterBlockWriter(object):
+    """Write-only, array-like raster on the grid of `raster`, or of a (r0, r1, c0, c1) window of it.
+
+    Each assigned block is saved to a scratch folder; save() mosaics the
+    blocks into a tiled, LZ77 compressed output raster and removes them.
+    Blocks are float32 with NaN as NoData unless another pixel type and
+    NoData value are given.
+    """
+
+    def __init__(self, raster, pixelType="32_BIT_FLOAT", noData=numpy.nan, window=None):
+        self.raster = raster
+        self.pixelType = pixelType
+        self.noData = noData
+        self.window = window if window is not None else (0, raster.height, 0, raster.width)
+        self.shape = (self.window[1] - self.window[0], self.window[3] - self.window[2])
+        self.folder = tempfile.mkdtemp(dir = arcpy.env.scratchFolder)
+        self.blocks = []
+
+    def __setitem__(self, key, block):
+        r0, r1, c0, c1 = _block_bounds(key, self.shape)
+        corner = _block_corner(self.raster, self.window[0] + r1, self.window[2] + c0)
+        blockRaster = arcpy.NumPyArrayToRaster(numpy.asarray(block), corner,
+                                               self.raster.meanCellWidth, self.raster.meanCellHeight, self.noData)
+        blockPath = os.path.join(self.folder, "block" + str(len(self.blocks)) + ".tif")
+        blockRaster.save(blockPath)
+        self.blocks.append(blockPath)
+
+    def save(self, outRaster):
+        outFolder, outName = os.path.split(outRaster)
+        with arcpy.EnvManager(compression = "LZ77", tileSize = "128 128"):
+            arcpy.management.MosaicToNewRaster(input_rasters = ";".join(self.blocks), output_location = outFolder, raster_dataset_name_with_extension = outName,
+                                               coordinate_system_for_the_raster = self.raster.spatialReference, pixel_type = self.pixelType,
+                                               cellsize = self.raster.meanCellWidth, number_of_bands = 1)
+        shutil.rmtree(self.folder, ignore_errors = True)
+
+
+def _clip_window(raster, clipFeatures):
+    """(polygons, geotransform, window) of the clip polygons over a raster; window is (r0, r1, c0, c1)"""
+    polygons = featureio.read_polygons(clipFeatures, spatialReference = raster.spatialReference)[0]
+    bounds = spatialindex.polygon_bounds(polygons)
+    geotransform = raster_geotransform(raster)
+    window = rasterize.pixel_window((numpy.nanmin(bounds[:, 0]), numpy.nanmin(bounds[:, 1]),
+                                     numpy.nanmax(bounds[:, 2]), numpy.nanmax(bounds[:, 3])),
+                                    geotransform, (raster.height, raster.width))
+    if window[0] == window[1] or window[2] == window[3]:
+        raise ValueError("The clip features do not overlap the raster")
+    return polygons, geotransform, window
+
+
+def _masked_block(reader, polygons, geotransform, b0, b1, c0, c1):
+    """Rows b0:b1 and columns c0:c1 of a raster with the cells outside the polygons set to NaN"""
+    block = reader[b0:b1, c0:c1]
+    burned = rasterize.rasterize_polygons(polygons, numpy.zeros(len(polygons), dtype = numpy.int32), block.shape,
+                                          rasterize.window_geotransform(geotransform, b0, c0))
+    block[burned < 0] = numpy.nan
+    return block
+
+
+def clip_raster(raster, clipFeatures, outRaster, bandRows=2048):
+    """Clip a raster to polygons, reading only the window over their envelope.
+
+    The window is read and masked `bandRows` rows at a time; cells whose
+    centres fall outside the polygons become NoData. Returns the clipped
+    arcpy Raster.
+    """
+    raster = raster if isinstance(raster, arcpy.Raster) else arcpy.Raster(raster)
+    polygons, geotransform, (r0, r1, c0, c1) = _clip_window(raster, clipFeatures)
+    reader = RasterBlockReader(raster)
+    writer = RasterBlockWriter(raster, window = (r0, r1, c0, c1))
+    for b0 in range(r0, r1, bandRows):
+        b1 = min(b0 + bandRows, r1)
+        writer[b0 - r0:b1 - r0, :] = _masked_block(reader, polygons, geotransform, b0, b1, c0, c1)
+    writer.save(outRaster)
+    return arcpy.Raster(outRaster)
+
+
+def read_clipped(raster, clipFeatures):
+    """The window of a raster over polygons as a float32 array, NaN outside them, without writing a raster.
+
+    Returns (array, geotransform of the window, spatial reference).
+    """
+    raster = raster if isinstance(raster, arcpy.Raster) else arcpy.Raster(raster)
+    polygons, geotransform, (r0, r1, c0, c1) = _clip_window(raster, clipFeatures)
+    array = _masked_block(RasterBlockReader(raster), polygons, geotransform, r0, r1, c0, c1)
+    return array, rasterize.window_geotransform(geotransform, r0, c0), raster.spatialReference
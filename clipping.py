@@ -0,0 +1,137 @@
+"""
+Tool:               <Layer clipping>
+Source Name:        <clipping>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 1_ClipData to clip several source layers to a project area at once.>
+Description:        <Each source is first narrowed to the features meeting the project area envelope with
+                     SelectLayerByLocation, which uses the source's spatial index, so the exact Clip only sees
+                     features near the project. Layers are clipped on a worker pool; each worker writes to its own
+                     scratch file geodatabase (worker processes cannot share locks on one) and the results are
+                     copied to the output workspace as they finish.
+                     A layer can be joined to a table while it is copied (copy_with_join): only the table rows whose keys
+                     occur in the clipped layer are read into a dict, and the joined fields are filled as each clipped
+                     feature is inserted, instead of a JoinField that scans the table and rewrites the output.>
+"""
+import os.path
+import shutil
+import tempfile
+
+import arcpy
+
+import featureio
+import parallel
+
+
+def envelope(fc):
+    """Polygon of the extent of a feature class, in its spatial reference"""
+    description = arcpy.Describe(fc)
+    extent = description.extent
+    corners = [arcpy.Point(extent.XMin, extent.YMin), arcpy.Point(extent.XMin, extent.YMax),
+               arcpy.Point(extent.XMax, extent.YMax), arcpy.Point(extent.XMax, extent.YMin)]
+    return arcpy.Polygon(arcpy.Array(corners), description.spatialReference)
+
+
+def clip_to_envelope(source, clipFeatures, out, box=None):
+    """Clip `source` to `clipFeatures`, reading only the source features that meet the envelope `box`"""
+    if box is None:
+        box = envelope(clipFeatures)
+    layer = "clip_" + os.path.basename(out).replace(".", "_")
+    arcpy.MakeFeatureLayer_management(source, layer)
+    arcpy.SelectLayerByLocation_management(layer, "INTERSECT", box)
+    arcpy.analysis.Clip(in_features = layer, clip_features = clipFeatures, out_feature_class = out)
+    arcpy.Delete_management(layer)
+    return out
+
+
+def _editable_fields(fc):
+    return [f.name for f in arcpy.ListFields(fc) if f.editable and f.type not in ("OID", "Geometry")]
+
+
+def copy_with_join(clipped, out, table, inField, joinField, fields):
+    """Copy `clipped` to `out`, adding `fields` of the first `table` row whose joinField equals inField.
+
+    Field names are read back from `out`, since a shapefile output cuts
+    them to 10 characters (and renames duplicates).
+    """
+    keys = [row[0] for row in arcpy.da.SearchCursor(clipped, [inField])]
+    lookup = featureio.read_lookup(table, joinField, keys, fields)
+    tableFields = dict((f.name, f) for f in arcpy.ListFields(table))
+    outFolder, outName = os.path.split(out)
+    arcpy.CreateFeatureclass_management(outFolder, outName, "POLYGON", template = clipped,
+                                        spatial_reference = arcpy.Describe(clipped).spatialReference)
+
+    # The template fields keep their order in the output, under possibly shortened names
+    copied, outCopied = _editable_fields(clipped), _editable_fields(out)
+    if len(copied) != len(outCopied):
+        copied = outCopied = [name for name in copied if name in outCopied]
+    joined = []
+    for name in fields:
+        field = tableFields[name]
+        before = set(f.name for f in arcpy.ListFields(out))
+        arcpy.management.AddField(in_table = out, field_name = name, field_type = featureio.FIELD_TYPES.get(field.type, "TEXT"),
+                                  field_length = field.length)
+        joined += [f.name for f in arcpy.ListFields(out) if f.name not in before]
+
+    # Copy every editable field, then look up the joined values by key
+    keyIndex = copied.index(inField) + 1
+    missing = (None,) * len(fields)
+    with arcpy.da.InsertCursor(out, ["SHAPE@"] + outCopied + joined) as insert:
+        with arcpy.da.SearchCursor(clipped, ["SHAPE@"] + copied) as cursor:
+            for row in cursor:
+                insert.insertRow(row + tuple(lookup.get(row[keyIndex], missing)))
+    return out
+
+
+def _clip_task(task):
+    """Clip one layer in a worker process into a new scratch file geodatabase; returns the clipped path"""
+    source, clipFeatures, name, coordinateSystem = task
+    arcpy.env.overwriteOutput = True
+    if coordinateSystem:
+        spatialReference = arcpy.SpatialReference()
+        spatialReference.loadFromString(coordinateSystem)
+        arcpy.env.outputCoordinateSystem = spatialReference
+    folder = tempfile.mkdtemp(prefix = "clip_")
+    arcpy.CreateFileGDB_management(folder, "clip.gdb")
+    return clip_to_envelope(source, clipFeatures, os.path.join(folder, "clip.gdb", name))
+
+
+def _finish(clipped, out, join):
+    """Copy a scratch clip to its output, joining a table when asked, and remove the scratch clip"""
+    if join:
+        copy_with_join(clipped, out, *join)
+    else:
+        arcpy.CopyFeatures_management(clipped, out)
+    arcpy.Delete_management(clipped)
+    return out
+
+
+def clip_layers(layers, clipFeatures, workers="", joins=None):
+    """Clip every (source, out) pair in `layers` to `clipFeatures` on up to `workers` processes.
+
+    `joins` maps an output path to (table, inField, joinField, fields) for
+    copy_with_join. The output coordinate system of this process is used by
+    the workers too. Yields each output path once it is written, in the
+    order of `layers`.
+    """
+    joins = joins or {}
+    if parallel.worker_count(workers) <= 1 or len(layers) <= 1:
+        box = envelope(clipFeatures)
+        for source, out in layers:
+            arcpy.AddMessage("Clipping " + os.path.basename(out) + "...")
+            if out in joins:
+                clipped = clip_to_envelope(source, clipFeatures, r"in_memory\clipJoined", box)
+                yield _finish(clipped, out, joins[out])
+            else:
+                yield clip_to_envelope(source, clipFeatures, out, box)
+        return
+    # Workers cannot see layers in the calling map, so pass the data paths
+    clipFeatures = arcpy.Describe(clipFeatures).catalogPath
+    coordinateSystem = arcpy.env.outputCoordinateSystem.exportToString() if arcpy.env.outputCoordinateSystem else ""
+    tasks = [(arcpy.Describe(source).catalogPath, clipFeatures, arcpy.ValidateTableName(os.path.splitext(os.path.basename(out))[0]), coordinateSystem)
+             for source, out in layers]
+    arcpy.AddMessage("Clipping " + str(len(layers)) + " layers on " + str(min(parallel.worker_count(workers), len(layers))) + " workers...")
+    for (source, out), clipped in zip(layers, parallel.parallel_imap(_clip_task, tasks, workers)):
+        _finish(clipped, out, joins.get(out))
+        shutil.rmtree(os.path.dirname(os.path.dirname(clipped)), ignore_errors = True)
+        yield out
@@ -0,0 +1,104 @@
+"""
+Tool:               <Exclusion layers>
+Source Name:        <exclusions>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 4_UnitIdentification to write the excl* feature classes.>
+Description:        <Exclusion layers are described as data (ExclusionRule): the output name, the source layer, the
+                     attribute conditions a feature must meet, the Exclusion label and the unit types it excludes.
+                     Each source is read once with a single cursor, however many rules use it, and every output
+                     is written with one insert cursor holding only the geometry and the Exclusion label, so the
+                     source's other fields are never copied and deleted one at a time.>
+"""
+import collections
+import fnmatch
+import numbers
+import os.path
+
+import arcpy
+
+# conditions is a list of (field, operator, operand) tuples that must all hold.
+# Operators are "=", "<", "<=", ">", ">=", "IN" (operand is a list) and "LIKE" (SQL % and _ wildcards).
+ExclusionRule = collections.namedtuple("ExclusionRule", ["name", "source", "label", "units", "conditions"])
+
+LABEL_LENGTH = 30
+
+
+def _compare(value, operator, operand):
+    """Evaluate one condition the way the equivalent where clause would; nulls never match"""
+    if value is None:
+        return False
+    if operator == "IN":
+        return value in operand
+    if operator == "LIKE":
+        pattern = str(operand).replace("[", "[[]").replace("%", "*").replace("_", "?")
+        return fnmatch.fnmatchcase(str(value), pattern)
+    # Numeric fields compare numerically even when the operand was given as text
+    if isinstance(value, numbers.Number) and not isinstance(operand, numbers.Number):
+        operand = float(operand)
+    elif not isinstance(value, numbers.Number):
+        operand = str(operand)
+    if operator == "=":
+        return value == operand
+    if operator == "<":
+        return value < operand
+    if operator == "<=":
+        return value <= operand
+    if operator == ">":
+        return value > operand
+    if operator == ">=":
+        return value >= operand
+    raise ValueError("Unknown exclusion condition operator '" + operator + "'")
+
+
+def _create_output(rule, outPath, spatialReference):
+    """Empty polygon feature class with only the Exclusion field"""
+    path = os.path.join(outPath, rule.name)
+    if arcpy.Exists(path):
+        arcpy.Delete_management(path)
+    arcpy.CreateFeatureclass_management(outPath, rule.name, "POLYGON", spatial_reference = spatialReference)
+    arcpy.management.AddField(in_table = path, field_name = "Exclusion", field_type = "TEXT", field_length = LABEL_LENGTH)
+    return path
+
+
+def write_exclusions(rules, outPath):
+    """Write the features selected by every rule to outPath/<rule.name>, labelled with rule.label.
+
+    Rules whose source does not exist are skipped. Rules sharing a source
+    are served by the same cursor pass. Returns a dict of rule name to
+    output path for the rules that were written.
+    """
+    bySource = collections.OrderedDict()
+    for rule in rules:
+        if rule.source and arcpy.Exists(rule.source):
+            bySource.setdefault(rule.source, []).append(rule)
+
+    written = {}
+    for source, sourceRules in bySource.items():
+        arcpy.AddMessage("Writing " + ", ".join(rule.name for rule in sourceRules) + "...")
+        fields = []
+        for rule in sourceRules:
+            fields += [c[0] for c in rule.conditions if c[0] not in fields]
+        position = dict((field, i + 1) for i, field in enumerate(fields))
+        spatialReference = arcpy.Describe(source).spatialReference
+        paths = [_create_output(rule, outPath, spatialReference) for rule in sourceRules]
+        cursors = [arcpy.da.InsertCursor(path, ["SHAPE@", "Exclusion"]) for path in paths]
+        try:
+            with arcpy.da.SearchCursor(source, ["SHAPE@"] + fields) as search:
+                for row in search:
+                    if row[0] is None:
+                        continue
+                    for i, rule in enumerate(sourceRules):
+                        if all(_compare(row[position[field]], operator, operand) for field, operator, operand in rule.conditions):
+                            cursors[i].insertRow((row[0], rule.label))
+        finally:
+            # Deleting the insert cursors releases their locks
+            del cursors
+        for rule, path in zip(sourceRules, paths):
+            written[rule.name] = path
+    return written
+
+
+def exclusions_for(rules, written, unit):
+    """Output paths of the written rules that apply to a unit type, in rule order"""
+    return [written[rule.name] for rule in rules if rule.name in written and unit in rule.units]
@@ -0,0 +1,73 @@
+"""
+Tool:               <Feature class access>
+Source Name:        <featureio>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts to move features between arcpy and NumPy.>
+Description:        <Reads points and polygons with a single cursor pass into the arrays used by spatialindex.py.
+                     Polygons are returned as lists of (n, 2) vertex arrays, one per ring.>
+"""
+import arcpy
+import numpy
+
+# Field types reported by ListFields and the matching AddField types
+FIELD_TYPES = {"String": "TEXT", "SmallInteger": "SHORT", "Integer": "LONG", "Single": "FLOAT", "Double": "DOUBLE", "Date": "DATE"}
+
+
+def geometry_rings(shape):
+    """List of (n, 2) vertex arrays, one per ring of an arcpy polygon"""
+    if shape is None:
+        return []
+    geo = shape.__geo_interface__
+    parts = geo["coordinates"] if geo["type"] == "MultiPolygon" else [geo["coordinates"]]
+    return [numpy.asarray(ring, dtype = numpy.float64)[:, :2] for part in parts for ring in part if len(ring)]
+
+
+def extent_bounds(shapes):
+    """(n, 4) array of xmin, ymin, xmax, ymax of the extents of arcpy geometries"""
+    return numpy.array([[s.extent.XMin, s.extent.YMin, s.extent.XMax, s.extent.YMax] for s in shapes]).reshape(-1, 4)
+
+
+def read_polygons(fc, fields=(), where=None, spatialReference=None):
+    """Polygons of a feature class and the values of `fields`, in cursor order.
+
+    Returns (polygons, values) where values maps each field name to a list.
+    Geometries are projected to `spatialReference` when it is given.
+    """
+    fields = list(fields)
+    polygons = []
+    values = dict((field, []) for field in fields)
+    with arcpy.da.SearchCursor(fc, ["SHAPE@"] + fields, where, spatialReference) as cursor:
+        for row in cursor:
+            polygons.append(geometry_rings(row[0]))
+            for field, value in zip(fields, row[1:]):
+                values[field].append(value)
+    return polygons, values
+
+
+def read_points(fc, fields=(), where=None, spatialReference=None):
+    """Structured array of point coordinates (SHAPE@X, SHAPE@Y) and `fields`; nulls become NaN.
+
+    Coordinates are projected to `spatialReference` when it is given.
+    """
+    return arcpy.da.FeatureClassToNumPyArray(fc, ["SHAPE@X", "SHAPE@Y"] + list(fields), where, spatialReference, null_value = numpy.nan)
+
+
+def read_lookup(table, keyField, keys, fields, chunk=1000):
+    """Dict of key to the tuple of `fields` values for the rows whose keyField is one of `keys`; the first row wins.
+
+    Rows are read with IN where clauses of `chunk` keys at a time, so an
+    attribute index on keyField spares a scan of the whole table.
+    """
+    keys = sorted(set(key for key in keys if key is not None))
+    keyType = [f.type for f in arcpy.ListFields(table) if f.name == keyField][0]
+    quote = (lambda key: "'" + str(key).replace("'", "''") + "'") if keyType == "String" else str
+    delimited = arcpy.AddFieldDelimiters(table, keyField)
+    lookup = {}
+    for i in range(0, len(keys), chunk):
+        where = delimited + " IN (" + ", ".join(quote(key) for key in keys[i:i + chunk]) + ")"
+        with arcpy.da.SearchCursor(table, [keyField] + list(fields), where) as cursor:
+            for row in cursor:
+                if row[0] not in lookup:
+                    lookup[row[0]] = row[1:]
+    return lookup
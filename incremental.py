@@ -0,0 +1,149 @@
+"""
+Tool:               <Incremental units>
+Source Name:        <incremental>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 4_UnitIdentification and 5_RefineUnits to rebuild units only where exclusions changed.>
+Description:        <The merged exclusions and the units of the last run are kept in <tool>State.gdb next to the outputs
+                     (UnitState). On a rerun the merged exclusions are compared with the kept copy feature by feature
+                     (geometry and Exclusion label), and the extents of the added and removed features, grown by the 5 m
+                     aggregation distance and a margin, give the dirty box. The box is grown until no candidate unit in it
+                     comes within that reach of its edge, so every candidate and aggregation group in the box is
+                     complete. Units are rebuilt from the candidates in the box with finish_units and spliced in place
+                     of the previous units meeting the box; units elsewhere are copied unchanged.>
+"""
+import collections
+import json
+import os.path
+
+import arcpy
+
+import units
+
+# Aggregation distance of finish_units and a margin, in meters
+REACH_METERS = 6.0
+
+
+class UnitState(object):
+    """Merged exclusions and units of the last run of a unit tool, kept next to its outputs"""
+
+    def __init__(self, outPath, tool, parameters):
+        folder = os.path.dirname(outPath) if outPath[-4:] == ".gdb" else outPath
+        self.folder = folder
+        self.gdb = os.path.join(folder, tool + "State.gdb")
+        self.parametersPath = os.path.join(folder, tool + "State.json")
+        self.parameters = parameters
+
+    def path(self, name):
+        return os.path.join(self.gdb, name)
+
+    def valid(self, names):
+        """True when the state holds `names` and was saved with the same parameters"""
+        if not os.path.exists(self.parametersPath):
+            return False
+        with open(self.parametersPath) as f:
+            if json.load(f) != self.parameters:
+                return False
+        return all(arcpy.Exists(self.path(name)) for name in names)
+
+    def save(self, datasets):
+        """Keep copies of the output datasets; the parameters are written last, so a partial save is never used"""
+        if os.path.exists(self.parametersPath):
+            os.remove(self.parametersPath)
+        if not arcpy.Exists(self.gdb):
+            arcpy.CreateFileGDB_management(self.folder, os.path.basename(self.gdb))
+        for dataset in datasets:
+            arcpy.CopyFeatures_management(dataset, self.path(os.path.basename(dataset)))
+        with open(self.parametersPath, "w") as f:
+            json.dump(self.parameters, f)
+
+
+def _feature_extents(fc):
+    """Dict of (geometry WKB, Exclusion label) to the extents of the features with them"""
+    fields = ["SHAPE@"] + (["Exclusion"] if "Exclusion" in [f.name for f in arcpy.ListFields(fc)] else [])
+    features = collections.defaultdict(list)
+    with arcpy.da.SearchCursor(fc, fields) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            extent = row[0].extent
+            features[(bytes(row[0].WKB),) + tuple(row[1:])].append([extent.XMin, extent.YMin, extent.XMax, extent.YMax])
+    return features
+
+
+def changed_extents(previous, current):
+    """Extents of the features of `previous` or `current` that the other version does not have"""
+    old, new = _feature_extents(previous), _feature_extents(current)
+    extents = []
+    for key in set(old) | set(new):
+        if len(old.get(key, [])) != len(new.get(key, [])):
+            extents += old.get(key, []) + new.get(key, [])
+    return extents
+
+
+def _box_polygon(box, spatialReference):
+    corners = [arcpy.Point(box[0], box[1]), arcpy.Point(box[0], box[3]), arcpy.Point(box[2], box[3]), arcpy.Point(box[2], box[1])]
+    return arcpy.Polygon(arcpy.Array(corners), spatialReference)
+
+
+def _local_candidates(projectArea, exclusions, region, out):
+    """Singlepart candidate units of the project area inside `region`, erasing only the exclusions meeting it"""
+    arcpy.analysis.Clip(in_features = projectArea, clip_features = region, out_feature_class = r'in_memory\LocalArea')
+    arcpy.MakeFeatureLayer_management(exclusions, "localExclusions")
+    arcpy.SelectLayerByLocation_management("localExclusions", "INTERSECT", region)
+    arcpy.analysis.Erase(in_features = r'in_memory\LocalArea', erase_features = "localExclusions", out_feature_class = r'in_memory\LocalErase')
+    arcpy.Delete_management("localExclusions")
+    arcpy.management.MultipartToSinglepart(in_features = r'in_memory\LocalErase', out_feature_class = out)
+    return out
+
+
+def settle_region(projectArea, exclusions, box, reach, out):
+    """Grow `box` until no candidate unit in it comes within `reach` of its edge; returns the box polygon.
+
+    The candidates inside the final box are left in `out`. The box never
+    grows past the project extent grown by `reach`.
+    """
+    description = arcpy.Describe(projectArea)
+    extent = description.extent
+    limit = [extent.XMin - reach, extent.YMin - reach, extent.XMax + reach, extent.YMax + reach]
+    box = [max(box[0], limit[0]), max(box[1], limit[1]), min(box[2], limit[2]), min(box[3], limit[3])]
+    while True:
+        region = _box_polygon(box, description.spatialReference)
+        _local_candidates(projectArea, exclusions, region, out)
+        edge = region.boundary()
+        grown = list(box)
+        with arcpy.da.SearchCursor(out, ["SHAPE@"]) as cursor:
+            for (shape,) in cursor:
+                if shape is not None and shape.distanceTo(edge) < reach:
+                    e = shape.extent
+                    grown = [min(grown[0], e.XMin - reach), min(grown[1], e.YMin - reach), max(grown[2], e.XMax + reach), max(grown[3], e.YMax + reach)]
+        grown = [max(grown[0], limit[0]), max(grown[1], limit[1]), min(grown[2], limit[2]), min(grown[3], limit[3])]
+        if grown == box:
+            return region
+        box = grown
+
+
+def update_units(projectArea, exclusions, previousExclusions, previousUnits, sliverSize, standSplit, clipVegPoly, outIdentity, sliverEngine="", workers=""):
+    """Units of the Erase engine rebuilt only where `exclusions` differ from `previousExclusions`, spliced into `previousUnits`.
+
+    Returns `outIdentity`, with the same fields as finish_units gives.
+    """
+    spatialReference = arcpy.Describe(projectArea).spatialReference
+    reach = REACH_METERS / spatialReference.metersPerUnit
+    extents = changed_extents(previousExclusions, exclusions)
+    if not extents:
+        arcpy.AddMessage("No exclusions changed; keeping the previous units")
+        arcpy.CopyFeatures_management(previousUnits, outIdentity)
+        return outIdentity
+    box = [min(e[0] for e in extents) - reach, min(e[1] for e in extents) - reach,
+           max(e[2] for e in extents) + reach, max(e[3] for e in extents) + reach]
+    region = settle_region(projectArea, exclusions, box, reach, r'in_memory\LocalSplit')
+    arcpy.AddMessage("Rebuilding units in " + str(round(region.getArea("PLANAR", "ACRES"), 1)) + " acres around " + str(len(extents)) + " changed exclusions...")
+    units.finish_units(r'in_memory\LocalSplit', sliverSize, standSplit, clipVegPoly, r'in_memory\LocalUnits', sliverEngine, workers)
+
+    # Previous units meeting the region are replaced by the rebuilt ones
+    arcpy.MakeFeatureLayer_management(previousUnits, "previousUnits")
+    arcpy.SelectLayerByLocation_management("previousUnits", "INTERSECT", region, invert_spatial_relationship = "INVERT")
+    arcpy.management.Merge(inputs = ["previousUnits", r'in_memory\LocalUnits'], output = outIdentity)
+    arcpy.Delete_management("previousUnits")
+    return outIdentity
@@ -0,0 +1,238 @@
+"""
+Tool:               <Stage instrumentation>
+Source Name:        <instrument>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts to time their named stages.>
+Description:        <RunLog.stage is a context manager wrapped around one stage of a tool. It records the wall time, the CPU
+                     time, the peak resident memory of the process and how much the stage raised it, the bytes the
+                     process read and wrote, and the features or cells going in and out. Each stage is reported in the
+                     tool messages and, when a log path is given, appended as one JSON line to the run log, so logs of
+                     many runs can be compared. CPU time and bytes cover this process; work done in worker processes
+                     shows up only in the wall time. Memory and I/O come from psutil when it is installed, otherwise
+                     from the operating system directly (ctypes on Windows, /proc and resource elsewhere).
+                     One stage can also be profiled: cProfile statistics are saved next to the log and the functions
+                     and lines (tracemalloc) with the most time and memory are listed in the messages.>
+"""
+from __future__ import division
+
+import cProfile
+import ctypes
+import datetime
+import io
+import json
+import os
+import os.path
+import pstats
+import sys
+import time
+
+import arcpy
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PROFILE_LINES = 15
+
+
+class _IoCounters(ctypes.Structure):
+    _fields_ = [("ReadOperationCount", ctypes.c_ulonglong), ("WriteOperationCount", ctypes.c_ulonglong),
+                ("OtherOperationCount", ctypes.c_ulonglong), ("ReadTransferCount", ctypes.c_ulonglong),
+                ("WriteTransferCount", ctypes.c_ulonglong), ("OtherTransferCount", ctypes.c_ulonglong)]
+
+
+class _MemoryCounters(ctypes.Structure):
+    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong), ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t), ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+
+def _windows_process():
+    process = ctypes.windll.kernel32.GetCurrentProcess
+    process.restype = ctypes.c_void_p
+    return ctypes.c_void_p(process())
+
+
+def peak_rss():
+    """Highest resident memory of this process so far in bytes, or None when it cannot be read"""
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        if hasattr(memory, "peak_wset"):
+            return memory.peak_wset
+    if sys.platform == "win32":
+        counters = _MemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(_windows_process(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def io_bytes():
+    """(bytes read, bytes written) by this process so far, or (None, None) when they cannot be read"""
+    if psutil is not None and hasattr(psutil.Process, "io_counters"):
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    if sys.platform == "win32":
+        counters = _IoCounters()
+        if ctypes.windll.kernel32.GetProcessIoCounters(_windows_process(), ctypes.byref(counters)):
+            return counters.ReadTransferCount, counters.WriteTransferCount
+    elif os.path.exists("/proc/self/io"):
+        with open("/proc/self/io") as f:
+            values = dict(line.split(":") for line in f if ":" in line)
+        return int(values["read_bytes"]), int(values["write_bytes"])
+    return None, None
+
+
+def _snapshot():
+    times = os.times()
+    readBytes, writeBytes = io_bytes()
+    return {"wall": time.time(), "cpu": times[0] + times[1] + times[2] + times[3], "peakRss": peak_rss(),
+            "readBytes": readBytes, "writeBytes": writeBytes}
+
+
+def _difference(end, start, name):
+    if end[name] is None or start[name] is None:
+        return None
+    return end[name] - start[name]
+
+
+def count(item):
+    """(features, cells) in a dataset path, an arcpy Raster or a NumPy array (structured arrays count as features)"""
+    if hasattr(item, "dtype"):
+        return (len(item), 0) if item.dtype.names else (0, item.size)
+    if not isinstance(item, arcpy.Raster):
+        if not item or not arcpy.Exists(item):
+            return 0, 0
+        if arcpy.Describe(item).dataType not in ("RasterDataset", "RasterLayer", "RasterBand"):
+            return int(arcpy.GetCount_management(item)[0]), 0
+        item = arcpy.Raster(item)
+    return 0, item.height * item.width
+
+
+def _format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return ("%d %s" if unit == "B" else "%.1f %s") % (n, unit)
+        n /= 1024
+
+
+class StageRecord(dict):
+    """Measurements of one stage; add what goes in and out with inputs() and outputs()"""
+
+    def __init__(self, name):
+        dict.__init__(self, stage = name, featuresIn = 0, featuresOut = 0, cellsIn = 0, cellsOut = 0)
+        self.pending = []
+
+    def inputs(self, *items):
+        """Count datasets or arrays going into the stage"""
+        for item in items:
+            features, cells = count(item)
+            self["featuresIn"] += features
+            self["cellsIn"] += cells
+
+    def outputs(self, *items):
+        """Datasets or arrays coming out of the stage, counted once the stage ends"""
+        self.pending += items
+
+    def message(self):
+        text = "Stage " + self["stage"] + ": " + "%.1f s (CPU %.1f s)" % (self["wall"], self["cpu"])
+        if self["peakRss"] is not None:
+            text += ", peak RSS " + _format_bytes(self["peakRss"]) + " (+" + _format_bytes(self["rssGrowth"]) + ")"
+        for kind in ("features", "cells"):
+            if self[kind + "In"] or self[kind + "Out"]:
+                text += ", " + str(self[kind + "In"]) + " -> " + str(self[kind + "Out"]) + " " + kind
+        if self["readBytes"] is not None:
+            text += ", read " + _format_bytes(self["readBytes"]) + ", wrote " + _format_bytes(self["writeBytes"])
+        return text if self["status"] == "ok" else text + " (" + self["status"] + ")"
+
+
+class _Stage(object):
+    def __init__(self, log, name, inputs):
+        self.log = log
+        self.record = StageRecord(name)
+        self.inputs = inputs
+        self.profiler = None
+
+    def __enter__(self):
+        self.record.inputs(*self.inputs)
+        if self.record["stage"] == self.log.profileStage:
+            if tracemalloc is not None and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = _snapshot()
+        self.record["start"] = datetime.datetime.now().isoformat()
+        return self.record
+
+    def __exit__(self, excType, excValue, traceback):
+        end = _snapshot()
+        if self.profiler is not None:
+            self.profiler.disable()
+        record = self.record
+        for name in ("wall", "cpu", "readBytes", "writeBytes"):
+            record[name] = _difference(end, self.start, name)
+        record["peakRss"] = end["peakRss"]
+        record["rssGrowth"] = _difference(end, self.start, "peakRss")
+        record["status"] = "ok" if excType is None else "failed: " + excType.__name__
+        for item in record.pending:
+            features, cells = count(item)
+            record["featuresOut"] += features
+            record["cellsOut"] += cells
+        del record.pending[:]
+        if self.profiler is not None:
+            self.log.report_profile(record, self.profiler)
+        self.log.write(record)
+        return False
+
+
+class RunLog(object):
+    """Stages of one tool run, reported to the tool messages and appended to a JSON lines log when logPath is set.
+
+    Use as `with log.stage("Name", [inputs]) as stage: ... stage.outputs(out)`.
+    The stage named profileStage is also profiled.
+    """
+
+    def __init__(self, tool, logPath="", profileStage=""):
+        self.tool = tool
+        self.logPath = logPath
+        self.profileStage = profileStage
+        self.run = datetime.datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + str(os.getpid())
+
+    def stage(self, name, inputs=()):
+        return _Stage(self, name, inputs)
+
+    def write(self, record):
+        arcpy.AddMessage(record.message())
+        if self.logPath:
+            line = dict(record, tool = self.tool, run = self.run)
+            with open(self.logPath, "a") as f:
+                f.write(json.dumps(line, sort_keys = True) + "\n")
+
+    def report_profile(self, record, profiler):
+        """Save cProfile statistics of a stage next to the log and list the costliest functions and allocations"""
+        top = []
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            record["tracedPeak"] = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_LINES]
+            tracemalloc.stop()
+        folder = os.path.dirname(self.logPath) if self.logPath else arcpy.env.scratchFolder
+        statsPath = os.path.join(folder, self.tool + "_" + record["stage"] + ".prof")
+        profiler.dump_stats(statsPath)
+        text = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+        pstats.Stats(profiler, stream = text).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        arcpy.AddMessage("Profile of " + record["stage"] + ", saved to " + statsPath + ":\n" + text.getvalue())
+        record["profile"] = statsPath
+        if top:
+            arcpy.AddMessage("Largest Python allocations still held (peak traced " + _format_bytes(record["tracedPeak"]) + "):\n" +
+                             "\n".join(str(line) for line in top))
@@ -0,0 +1,63 @@
+"""
+Tool:               <Worker pools>
+Source Name:        <parallel>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts and engines that spread work over processes.>
+Description:        <Thin wrapper around multiprocessing.Pool. Script tools run inside ArcGISPro.exe or ArcMap.exe,
+                     so worker processes have to be started with the Python interpreter that ships with ArcGIS instead
+                     of sys.executable. Task functions must live in an importable module (not a numbered tool script).>
+"""
+import multiprocessing
+import os.path
+import sys
+
+
+def worker_count(workers):
+    """Parse a worker count parameter: blank means 1, zero or less means one worker per CPU"""
+    if workers is None or str(workers).strip() == "":
+        return 1
+    workers = int(workers)
+    if workers <= 0:
+        return multiprocessing.cpu_count()
+    return workers
+
+
+def _use_python_executable():
+    """Point multiprocessing at python.exe when running inside an ArcGIS application"""
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return
+    for name in ("pythonw.exe", "python.exe"):
+        executable = os.path.join(sys.exec_prefix, name)
+        if os.path.exists(executable):
+            multiprocessing.set_executable(executable)
+            return
+
+
+def parallel_imap(func, items, workers=1):
+    """Apply `func` to every item on up to `workers` processes, yielding results in item order.
+
+    Results are streamed as they complete, so large results need not all be
+    held in memory. With one worker the items are processed in this process,
+    which keeps tracebacks simple and avoids the cost of starting a pool.
+    """
+    items = list(items)
+    workers = min(worker_count(workers), len(items))
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    _use_python_executable()
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(func, items, chunksize = 1):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parallel_map(func, items, workers=1):
+    """List of `func` applied to every item, computed on up to `workers` processes"""
+    return list(parallel_imap(func, items, workers))
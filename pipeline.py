@@ -0,0 +1,177 @@
+"""
+Tool:               <In-process pipeline>
+Source Name:        <pipeline>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 8_RunPipeline to run the ClipData, TreeTopPoints, LidarSummary and UnitIdentification
+                     steps in one process.>
+Description:        <The steps run as stages of a small dependency graph (Pipeline) and hand their results to each other
+                     in memory: clipped layers, the lidar summary and the exclusion layers stay in the in_memory
+                     workspace, and the CHM window and tree tops stay NumPy arrays, so nothing is written to disk and
+                     read back between steps. Only the requested products are written to the output workspace, or
+                     every intermediate with checkpoints. Stages that do not touch arcpy run on a thread: tree top
+                     detection works on the CHM array while the main thread clips the vector layers.>
+"""
+import collections
+import importlib
+import os.path
+import sys
+import threading
+
+import arcpy
+import numpy
+
+import batch
+import chmraster
+import clipping
+import standsummary
+import treetops
+
+Stage = collections.namedtuple("Stage", ["name", "func", "inputs", "background"])
+
+# Products written when none are named: what the RefineUnits tool needs
+UNIT_PRODUCTS = ["PreliminaryRegenExclusions", "PreliminaryRegenUnits", "PreliminaryCtExclusions", "PreliminaryCtUnits"]
+
+
+class Pipeline(object):
+    """Stages run in dependency order; background stages run on threads while the main thread goes on.
+
+    A stage function is called with the results of its input stages. arcpy
+    is not thread safe, so background stages must only use NumPy, whose
+    array loops release the GIL and overlap with geoprocessing in the main
+    thread.
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    def add(self, name, func, inputs=(), background=False):
+        self.stages[name] = Stage(name, func, tuple(inputs), background)
+
+    def run(self):
+        """Dict of stage name to result; the first failing stage's exception is raised once running threads end"""
+        results = {}
+        failures = []
+
+        def call(stage):
+            try:
+                results[stage.name] = stage.func(*[results[name] for name in stage.inputs])
+            except Exception:
+                failures.append(sys.exc_info()[1])
+
+        pending = list(self.stages)
+        threads = []
+        while (pending or threads) and not failures:
+            ready = [self.stages[name] for name in pending if all(i in results for i in self.stages[name].inputs)]
+            for stage in ready:
+                if stage.background:
+                    pending.remove(stage.name)
+                    thread = threading.Thread(target = call, args = (stage,))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+            foreground = [stage for stage in ready if not stage.background]
+            if foreground:
+                pending.remove(foreground[0].name)
+                call(foreground[0])
+            elif threads:
+                threads[0].join(0.1)
+            elif pending:
+                raise ValueError("Stages " + ", ".join(pending) + " wait for inputs no stage gives")
+            threads = [thread for thread in threads if thread.is_alive()]
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+        return results
+
+
+def _memory(name):
+    return os.path.join("in_memory", name)
+
+
+def run_pipeline(projectArea, outPath, sources, oldGrowth, chm, treeParameters, summaryParameters, unitParameters, products=None, checkpoints=False):
+    """Run steps 1 to 4 for a project in this process and write `products` (names of outputs) to outPath.
+
+    `sources` maps the batch.LAYER_NAMES to source layers. treeParameters is
+    (smooth, toFeet, minHeight), summaryParameters (ctMin, ctMax, regenMin,
+    regenMax) and unitParameters (recruitment, harvestAge, regenTPA, ctTPA,
+    sliverSize, standSplit, engine, sliverEngine), as text like the tool
+    parameters. With checkpoints every intermediate is written as well.
+    Returns the paths written.
+    """
+    products = set(products or UNIT_PRODUCTS)
+    keep = lambda name: checkpoints or name in products
+    smooth, toFeet, minHeight = treeParameters
+    layers = [(sources[name], _memory(name)) for name in batch.LAYER_NAMES if sources.get(name) and arcpy.Exists(sources[name])]
+    hasStands = any(out == _memory("clipVegPoly") for source, out in layers)
+    heights = ""
+    if chm and hasStands and keep("LidarSummaryHeights"):
+        heights = os.path.join(os.path.dirname(outPath) if outPath[-4:] == ".gdb" else outPath, standsummary.HEIGHT_INDEX)
+    pipeline = Pipeline()
+
+    # Tree tops: read the CHM window here, then detect on a thread while the layers are clipped
+    if chm and hasStands:
+        pipeline.add("chm", lambda: chmraster.read_clipped(chm, projectArea))
+
+        def detect(window):
+            chmArray, geotransform, spatialReference = window
+            chmFt = treetops.prepare_chm(chmArray, smooth.lower() == 'true', toFeet.lower() == 'true')
+            return chmFt, treetops.find_tree_tops(chmFt, geotransform, float(minHeight)), geotransform, spatialReference
+        pipeline.add("trees", detect, ["chm"], background = True)
+
+    def clip():
+        joins = {}
+        if hasStands and oldGrowth and arcpy.Exists(oldGrowth):
+            joins[_memory("clipVegPoly")] = (oldGrowth, "SETTING_ID", "FSVEG_SETTING_ID", batch.OLD_GROWTH_FIELDS)
+        return list(clipping.clip_layers(layers, projectArea, "", joins))
+    pipeline.add("clip", clip)
+
+    if chm and hasStands:
+        def summarize(trees, clipped):
+            chmFt, tops, geotransform, spatialReference = trees
+            arcpy.AddMessage("Detected " + str(tops.tree_id.size) + " tree tops")
+            treeArray = numpy.zeros(tops.tree_id.size, dtype = [("SHAPE@X", "f8"), ("SHAPE@Y", "f8"), ("Height", "f8")])
+            treeArray["SHAPE@X"], treeArray["SHAPE@Y"], treeArray["Height"] = tops.x, tops.y, tops.height
+            importlib.import_module("3_LidarSummary").SummarizeStands(treeArray, _memory("clipVegPoly"), _memory("LidarSummary"), heights, "",
+                                                                     *summaryParameters, spatialReference = spatialReference)
+            return _memory("LidarSummary")
+        pipeline.add("summary", summarize, ["trees", "clip"])
+
+    def identify(clipped, summary=""):
+        recruitment, harvestAge, regenTPA, ctTPA, sliverSize, standSplit, engine, sliverEngine = unitParameters
+        layer = lambda name: _memory(name) if _memory(name) in clipped else ""
+        unitTool = importlib.import_module("4_UnitIdentification")
+        unitTool.ScriptTool(projectArea, "in_memory", layer("clipVegPoly"), recruitment, layer("clipRiperian"), layer("clipLandtype"),
+                            layer("clipSpecialUse"), layer("clipHarvest"), harvestAge, layer("clipMgmtArea"), summary, regenTPA, ctTPA,
+                            sliverSize, standSplit, engine, "", "", sliverEngine)
+        rules = unitTool.ExclusionRules(layer("clipVegPoly"), recruitment, layer("clipRiperian"), layer("clipLandtype"), layer("clipSpecialUse"),
+                                        layer("clipHarvest"), harvestAge, layer("clipMgmtArea"), summary, regenTPA or "0", ctTPA or "0")
+        return [_memory(rule.name) for rule in rules] + [_memory(name) for name in UNIT_PRODUCTS]
+    if hasStands:
+        pipeline.add("units", identify, ["clip", "summary"] if "summary" in pipeline.stages else ["clip"])
+
+    results = pipeline.run()
+
+    # Write the products
+    written = [heights] if heights else []
+    datasets = list(results.get("clip", [])) + ([results["summary"]] if "summary" in results else []) + list(results.get("units", []))
+    for dataset in datasets:
+        name = os.path.basename(dataset)
+        if keep(name) and arcpy.Exists(dataset):
+            written.append(arcpy.CopyFeatures_management(dataset, os.path.join(outPath, name))[0])
+    if "trees" in results:
+        chmFt, tops, geotransform, spatialReference = results["trees"]
+        gdb = outPath[-4:] == ".gdb"
+        if keep("CHM_ft"):
+            outRaster = os.path.join(outPath, "CHM_ft" if gdb else "CHM_ft.tif")
+            chmraster.save_array(chmFt, geotransform, spatialReference, outRaster)
+            written.append(outRaster)
+        if keep("TreeTop"):
+            outTreeTop = os.path.join(outPath, "TreeTop" if gdb else "TreeTop.shp")
+            importlib.import_module("2_TreeTopPoints").TreeTopsToFeatures(tops, spatialReference, outTreeTop)
+            written.append(outTreeTop)
+    for dataset in datasets:
+        if arcpy.Exists(dataset):
+            arcpy.Delete_management(dataset)
+    return written
@@ -0,0 +1,103 @@
+"""
+Tool:               <Polygon rasterization>
+Source Name:        <rasterize>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Vectorized scanline rasterization of polygons (lists of rings, as in spatialindex.py) onto a grid
+                     described by a GDAL style geotransform. A cell is inside a polygon when its centre is, by the
+                     even-odd rule, matching PolygonToRaster with the CELL_CENTER assignment.>
+"""
+from __future__ import division
+
+import numpy as np
+
+
+def _spans(rings, geotransform, row0, row1):
+    """Column ranges covered by a polygon on rows row0..row1 - 1.
+
+    Each edge is bucketed by the range of row centre lines its y span covers,
+    so only actual crossings are computed; sorting them by row and x pairs
+    them into inside spans. Memory follows the edge and crossing counts.
+    Returns (rows, first columns, last columns).
+    """
+    x0, dx, _, y0, _, dy = geotransform
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    ya, yb = starts[:, 1], ends[:, 1]
+    # Row positions of the edge ends; the candidate range is one row wider and trimmed by the exact test below
+    ta, tb = (ya - y0) / dy - 0.5, (yb - y0) / dy - 0.5
+    lo = np.clip(np.floor(np.minimum(ta, tb)), row0, row1).astype(np.int64)
+    hi = np.clip(np.ceil(np.maximum(ta, tb)) + 1, row0, row1).astype(np.int64)
+    counts = hi - lo
+    edges = np.repeat(np.arange(len(starts)), counts)
+    rows = lo[edges] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    yc = y0 + (rows + 0.5) * dy
+    crosses = (ya[edges] > yc) != (yb[edges] > yc)
+    edges, rows, yc = edges[crosses], rows[crosses], yc[crosses]
+    xa, xb = starts[edges, 0], ends[edges, 0]
+    xs = xa + (yc - ya[edges]) * (xb - xa) / (yb[edges] - ya[edges])
+    # Crossings come in pairs on every row, so after sorting consecutive pairs are inside spans
+    order = np.lexsort((xs, rows))
+    rows, xs = rows[order], xs[order]
+    enter, leave = xs[0::2], xs[1::2]
+    first = np.ceil((enter - x0) / dx - 0.5).astype(np.int64)
+    last = np.floor((leave - x0) / dx - 0.5).astype(np.int64)
+    return rows[0::2], first, last
+
+
+def pixel_window(bounds, geotransform, shape):
+    """Rows r0:r1 and columns c0:c1 of the cells of a grid that overlap bounds (xmin, ymin, xmax, ymax)"""
+    x0, dx, _, y0, _, dy = geotransform
+    xmin, ymin, xmax, ymax = bounds
+    c0 = min(max(int(np.floor((xmin - x0) / dx)), 0), shape[1])
+    c1 = min(max(int(np.ceil((xmax - x0) / dx)), c0), shape[1])
+    r0 = min(max(int(np.floor((ymax - y0) / dy)), 0), shape[0])
+    r1 = min(max(int(np.ceil((ymin - y0) / dy)), r0), shape[0])
+    return r0, r1, c0, c1
+
+
+def window_geotransform(geotransform, row, col):
+    """Geotransform of the window of a grid starting at (row, col)"""
+    x0, dx, rx, y0, ry, dy = geotransform
+    return (x0 + col * dx, dx, rx, y0 + row * dy, ry, dy)
+
+
+def rasterize_polygons(polygons, values, shape, geotransform, fill=-1, out=None):
+    """Burn `values` of `polygons` into a grid of `shape`.
+
+    Cells whose centres fall in no polygon get `fill`. Where polygons overlap
+    the first polygon wins, as with spatialindex.assign_points. `out` may be
+    a preallocated (e.g. memory mapped) integer array to burn into.
+    Only the bounding box window of each polygon is touched.
+    """
+    nrows, ncols = shape
+    x0, dx, _, y0, _, dy = geotransform
+    if out is None:
+        out = np.empty(shape, dtype=np.int32)
+    out[...] = fill
+    for rings, value in reversed(list(zip(polygons, values))):
+        if not rings:
+            continue
+        vertices = np.concatenate(rings)
+        row0 = max(int(np.floor((vertices[:, 1].max() - y0) / dy)), 0)
+        row1 = min(int(np.ceil((vertices[:, 1].min() - y0) / dy)) + 1, nrows)
+        if row0 >= row1:
+            continue
+        rows, first, last = _spans(rings, geotransform, row0, row1)
+        first = np.clip(first, 0, ncols)
+        last = np.clip(last, -1, ncols - 1)
+        keep = first <= last
+        rows, first, last = rows[keep], first[keep], last[keep]
+        if not rows.size:
+            continue
+        # Mark span starts and ends in a difference grid over the polygon window
+        col0, col1 = first.min(), last.max() + 1
+        diff = np.zeros((row1 - row0, col1 - col0 + 1), dtype=np.int8)
+        np.add.at(diff, (rows - row0, first - col0), 1)
+        np.add.at(diff, (rows - row0, last + 1 - col0), -1)
+        # Spans of one polygon never overlap, so the running sum is 0 or 1
+        inside = np.cumsum(diff, axis=1, dtype=np.int8)[:, :-1] > 0
+        window = out[row0:row1, col0:col1]
+        window[inside] = value
+    return out
@@ -0,0 +1,152 @@
+"""
+Tool:               <Raster unit engine>
+Source Name:        <rasterunits>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by units.py. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Candidate harvest units on a grid. Every exclusion layer is burned into one bit of a shared uint16
+                     flag grid, so the candidates of a unit type are a single mask operation. Candidate cells are
+                     grouped into connected units by labelling horizontal runs of cells and joining runs that touch
+                     in the row above with the vectorized union-find from unitgeom.py; unit areas come from one bincount, and units
+                     at or under the sliver size are dropped before anything is turned back into polygons.
+                     aggregate_parts joins units a few cells apart by labelling the unit cells grown with dilate.>
+"""
+from __future__ import division
+
+import numpy as np
+
+from rasterize import rasterize_polygons
+from spatialindex import _expand
+from unitgeom import union_find
+
+ACRE_SQ_METERS = 4046.8564224
+MAX_LAYERS = 16
+
+
+def grid_for(bounds, cell_size):
+    """(shape, geotransform) of a grid of `cell_size` cells snapped to whole cells around xmin, ymin, xmax, ymax"""
+    xmin, ymin, xmax, ymax = bounds
+    x0 = np.floor(xmin / cell_size) * cell_size
+    y0 = np.ceil(ymax / cell_size) * cell_size
+    ncols = max(int(np.ceil((xmax - x0) / cell_size)), 1)
+    nrows = max(int(np.ceil((y0 - ymin) / cell_size)), 1)
+    return (nrows, ncols), (x0, float(cell_size), 0.0, y0, 0.0, -float(cell_size))
+
+
+def burn_mask(polygons, shape, geotransform):
+    """Boolean grid of the cells whose centres fall in any of the polygons"""
+    return rasterize_polygons(polygons, np.zeros(len(polygons), dtype=np.int32), shape, geotransform) >= 0
+
+
+def burn_flags(layers, shape, geotransform, flags=None, first_bit=0):
+    """Burn each layer (a list of polygons) into its own bit of a uint16 flag grid, starting at `first_bit`"""
+    if first_bit + len(layers) > MAX_LAYERS:
+        raise ValueError("The raster engine supports at most " + str(MAX_LAYERS) + " exclusion layers")
+    if flags is None:
+        flags = np.zeros(shape, dtype=np.uint16)
+    for bit, polygons in enumerate(layers, first_bit):
+        flags[burn_mask(polygons, shape, geotransform)] |= np.uint16(1 << bit)
+    return flags
+
+
+def _runs(mask):
+    """Horizontal runs of True cells as (rows, first columns, end columns), in row-major order"""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def label_components(mask, connectivity=4):
+    """Connected components of a boolean grid.
+
+    Returns (labels, count) with labels numbered 1..count in row-major order
+    of their first cell and 0 off the mask. With connectivity 4 cells join
+    only through shared edges, matching how RasterToPolygon forms polygons;
+    with 8 corners join as well.
+    """
+    nrows, ncols = mask.shape
+    rows, starts, ends = _runs(mask)
+    # Runs in the row above that overlap each run; keys order runs by (row, column)
+    width = ncols + 2
+    reach = 1 if connectivity == 8 else 0
+    above = (rows - 1) * width
+    low = np.searchsorted(rows * width + ends, above + starts - reach, side="right")
+    high = np.searchsorted(rows * width + starts, above + ends + reach, side="left")
+    counts = np.maximum(high - low, 0)
+    a = np.repeat(low, counts) + _expand(counts)
+    b = np.repeat(np.arange(rows.size), counts)
+
+    runLabels = union_find(rows.size, a, b)
+    labels = paint_runs(mask.shape, rows, starts, ends, runLabels + 1)
+    return labels, int(runLabels.max()) + 1 if runLabels.size else 0
+
+
+def paint_runs(shape, rows, starts, ends, values):
+    """Integer grid with each run filled with its value and 0 elsewhere"""
+    diff = np.zeros(shape[0] * shape[1] + 1, dtype=np.int64)
+    np.add.at(diff, rows * shape[1] + starts, values)
+    np.add.at(diff, rows * shape[1] + ends, -values)
+    return np.cumsum(diff[:-1]).astype(np.int32).reshape(shape)
+
+
+def drop_small(labels, count, min_cells):
+    """Remove components of `min_cells` cells or fewer, renumbering the rest 1..n; returns (labels, n)"""
+    cells = np.bincount(labels.ravel(), minlength=count + 1)
+    keep = cells > min_cells
+    keep[0] = False
+    renumber = np.zeros(count + 1, dtype=np.int32)
+    renumber[keep] = np.arange(1, keep.sum() + 1)
+    return renumber[labels], int(keep.sum())
+
+
+def dilate(mask, radius):
+    """Boolean grid grown by `radius` cells in every direction (a square window), one axis at a time"""
+    for axis in (0, 1):
+        grown = mask.copy()
+        for shift in range(1, radius + 1):
+            lead = [slice(None), slice(None)]
+            lag = [slice(None), slice(None)]
+            lead[axis], lag[axis] = slice(shift, None), slice(None, -shift)
+            grown[tuple(lead)] |= mask[tuple(lag)]
+            grown[tuple(lag)] |= mask[tuple(lead)]
+        mask = grown
+    return mask
+
+
+def aggregate_parts(labels, count, radius):
+    """Group (1..groups) of every component label, joining components within 2 * radius cells; returns (groups, n).
+
+    Components are joined when their masks grown by `radius` cells touch,
+    the grid counterpart of AggregatePolygons with a distance of twice the
+    radius. groups[0] is 0.
+    """
+    grownLabels, n = label_components(dilate(labels > 0, radius), connectivity=8)
+    groups = np.zeros(count + 1, dtype=np.int64)
+    inside = labels > 0
+    groups[labels[inside]] = grownLabels[inside]
+    return groups, n
+
+
+def extract_units(inside, flags, exclude, cell_acres, sliver_size, connectivity=4):
+    """Unit labels (0 for none) of the cells in the project area free of every exclusion bit in `exclude`.
+
+    Units of `sliver_size` acres or less are dropped. Returns (labels, count).
+    """
+    candidates = inside & ((flags & np.uint16(exclude)) == 0)
+    labels, count = label_components(candidates, connectivity)
+    return drop_small(labels, count, float(sliver_size) / cell_acres)
+
+
+def area_report(units, reference, cell_acres):
+    """Acres of agreement between raster units and a reference (e.g. the vector units burned on the same grid)"""
+    units = np.asarray(units) > 0
+    reference = np.asarray(reference) > 0
+    both = np.count_nonzero(units & reference)
+    return {"raster": np.count_nonzero(units) * cell_acres,
+            "reference": np.count_nonzero(reference) * cell_acres,
+            "both": both * cell_acres,
+            "raster_only": np.count_nonzero(units & ~reference) * cell_acres,
+            "reference_only": np.count_nonzero(reference & ~units) * cell_acres}
@@ -0,0 +1,292 @@
+"""
+Tool:               <Run cache>
+Source Name:        <runcache>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts to reuse the outputs of a stage whose inputs and parameters are unchanged.>
+Description:        <A stage is keyed by a SHA-1 hash of its name, its parameters and a fingerprint of every input dataset:
+                     the modification time of its files, feature count, extent and schema (field names, types and
+                     lengths), or cell size and band count for rasters. For a file geodatabase dataset the modification
+                     time is that of the table files behind it, found by name in the geodatabase's system catalog, or of
+                     the geodatabase folder when the catalog can't be read. in_memory datasets have no files, so their
+                     modification time is replaced by a hash of their rows (attributes and geometry) or cell values.
+                     Stage outputs are copied to <cache folder>/<key>. A restored or freshly written output is recorded
+                     in lineage.json under the key and name that produced it, so as long as it is unchanged the next
+                     stage fingerprints it by that identity rather than by its new modification time, and a chain of
+                     stages keeps hitting the cache after a restore. The least recently used entries are deleted once
+                     the cache grows past its size limit.>
+"""
+import glob
+import hashlib
+import json
+import os.path
+import shutil
+import struct
+import time
+
+import arcpy
+
+# Bumped when a change to the tools makes old cache entries invalid
+VERSION = 2
+MAX_BYTES = 10 * 1024 ** 3
+MANIFEST = "manifest.json"
+LINEAGE = "lineage.json"
+# Outputs that are plain files rather than datasets
+FILE_TYPES = (".npz", ".npy", ".json")
+# Rows of an in_memory raster hashed at a time
+HASH_ROWS = 1024
+
+
+def _is_file(path):
+    return os.path.splitext(path)[1].lower() in FILE_TYPES
+
+
+def _exists(path):
+    return os.path.isfile(path) if _is_file(path) else arcpy.Exists(path)
+
+
+def _in_memory(dataset):
+    return os.path.dirname(dataset).lower() in ("in_memory", "memory")
+
+
+def _geodatabase(path):
+    """The file geodatabase folder holding a dataset (possibly in a feature dataset), else None"""
+    folder = os.path.dirname(path)
+    while folder and folder != os.path.dirname(folder):
+        if folder.lower().endswith(".gdb"):
+            return folder if os.path.isdir(folder) else None
+        folder = os.path.dirname(folder)
+    return None
+
+
+def _varuint(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _table_ids(gdb, names):
+    """IDs of the tables of a file geodatabase called one of `names`, read from its system catalog.
+
+    The catalog is table a00000001, whose rows hold the table names; row N is
+    stored in the files aN.*. Its offsets file (.gdbtablx) has a 16 byte header
+    whose last int is the size of each row offset, and a row is its byte size
+    followed by its values, the name as a UTF-8 string prefixed by its length.
+    """
+    names = [(_varuint(len(name)) + name).lower() for name in (name.encode("utf-8") for name in names)]
+    ids = []
+    with open(os.path.join(gdb, "a00000001.gdbtablx"), "rb") as f:
+        offsets = f.read()
+    with open(os.path.join(gdb, "a00000001.gdbtable"), "rb") as f:
+        rows = f.read()
+    rowCount, offsetSize = struct.unpack("<2i", offsets[8:16])
+    for i in range(rowCount):
+        start = 16 + i * offsetSize
+        offset = struct.unpack("<q", offsets[start:start + offsetSize].ljust(8, b"\0"))[0]
+        if offset:
+            size = struct.unpack("<i", rows[offset:offset + 4])[0]
+            row = rows[offset + 4:offset + 4 + size].lower()
+            if any(name in row for name in names):
+                ids.append(i + 1)
+    return ids
+
+
+def _gdb_modified(gdb, name):
+    """Latest modification time of the table files of a file geodatabase dataset, or of the geodatabase folder"""
+    # Raster datasets keep their bands, blocks and statistics in fras_* tables
+    names = [name] + ["fras_" + kind + "_" + name for kind in ("aux", "bnd", "blk", "ras")]
+    try:
+        prefixes = tuple("a%08x." % tableId for tableId in _table_ids(gdb, names))
+    except (IOError, OSError, struct.error):
+        prefixes = ()
+    times = [os.path.getmtime(os.path.join(gdb, other)) for other in os.listdir(gdb) if other.lower().startswith(prefixes)] if prefixes else []
+    return max(times or [os.path.getmtime(gdb)])
+
+
+def _modified(path):
+    """Latest modification time of a dataset's files; None for datasets without files, such as in_memory ones"""
+    if os.path.isdir(path) and not path.lower().endswith(".gdb"):
+        return max([os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)] or [os.path.getmtime(path)])
+    gdb = _geodatabase(path)
+    if gdb:
+        return _gdb_modified(gdb, os.path.basename(path))
+    if not os.path.isfile(path):
+        return None
+    folder, name = os.path.split(path)
+    stem = "".join("[" + c + "]" if c in "*?[" else c for c in os.path.splitext(name)[0])
+    # Shapefiles and rasters keep their attributes and statistics in sidecar files
+    return max(os.path.getmtime(other) for other in glob.glob(os.path.join(folder, stem + ".*")) + [path])
+
+
+def _content_hash(dataset, description):
+    """SHA-1 of the rows (attributes and geometry) or cell values of an in_memory dataset, which has no modification time"""
+    digest = hashlib.sha1()
+    if hasattr(description, "meanCellWidth"):
+        raster = arcpy.Raster(dataset)
+        for r0 in range(0, raster.height, HASH_ROWS):
+            r1 = min(r0 + HASH_ROWS, raster.height)
+            corner = arcpy.Point(raster.extent.XMin, raster.extent.YMax - r1 * raster.meanCellHeight)
+            digest.update(arcpy.RasterToNumPyArray(raster, corner, raster.width, r1 - r0).tobytes())
+        return digest.hexdigest()
+    fields = [f.name for f in description.fields if f.type not in ("OID", "Geometry", "Raster", "Blob")]
+    shape = ["SHAPE@WKB"] if hasattr(description, "shapeType") else []
+    with arcpy.da.SearchCursor(dataset, fields + shape) as cursor:
+        for row in cursor:
+            digest.update(json.dumps(row[:len(fields)], default = str).encode("utf-8"))
+            if shape:
+                digest.update(bytes(row[-1] or b""))
+    return digest.hexdigest()
+
+
+def raw_fingerprint(dataset):
+    """JSON-serializable list describing a dataset: path, modification time (or content hash), count, extent and schema"""
+    if _is_file(dataset):
+        path = os.path.normcase(os.path.abspath(dataset))
+        return [path, os.path.getmtime(path), "File", os.path.getsize(path)]
+    description = arcpy.Describe(dataset)
+    path = os.path.normcase(os.path.abspath(description.catalogPath))
+    modified = _modified(path)
+    if modified is None and _in_memory(description.catalogPath) and (hasattr(description, "meanCellWidth") or hasattr(description, "fields")):
+        modified = _content_hash(dataset, description)
+    fingerprint = [path, modified, description.dataType]
+    if hasattr(description, "extent"):
+        extent = description.extent
+        fingerprint.append([extent.XMin, extent.YMin, extent.XMax, extent.YMax])
+    if hasattr(description, "meanCellWidth"):
+        fingerprint += [description.meanCellWidth, description.meanCellHeight, description.bandCount]
+    elif hasattr(description, "fields"):
+        fingerprint.append(int(arcpy.GetCount_management(dataset)[0]))
+        fingerprint.append([[f.name, f.type, f.length] for f in description.fields])
+    return fingerprint
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names)
+
+
+class RunCache(object):
+    """Stage outputs kept in a local folder, keyed by the hash of the stage's inputs and parameters"""
+
+    def __init__(self, folder, maxBytes=MAX_BYTES):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        lineagePath = os.path.join(folder, LINEAGE)
+        self.lineage = {}
+        if os.path.exists(lineagePath):
+            with open(lineagePath) as f:
+                self.lineage = json.load(f)
+
+    def fingerprint(self, dataset):
+        """The identity of a dataset written by a cached stage and unchanged since, else its raw fingerprint"""
+        if not dataset or not _exists(dataset):
+            return ""
+        raw = raw_fingerprint(dataset)
+        known = self.lineage.get(raw[0])
+        if known and known[0] == raw:
+            return known[1]
+        return raw
+
+    def key(self, stage, inputs, parameters):
+        """Hash of the stage name, the fingerprints of the input datasets and the (JSON-serializable) parameters"""
+        content = [VERSION, stage, [self.fingerprint(dataset) for dataset in inputs], parameters]
+        return hashlib.sha1(json.dumps(content, sort_keys = True, default = str).encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.folder, key)
+
+    def _cached_path(self, key, output):
+        """Where an output is kept in a cache entry: a geodatabase for geodatabase datasets, else the entry folder"""
+        name = os.path.basename(output)
+        if os.path.dirname(output).lower().endswith(".gdb") or _in_memory(output):
+            return os.path.join(self._entry(key), "cache.gdb", name)
+        return os.path.join(self._entry(key), name)
+
+    def _record(self, key, outputs):
+        for output in outputs:
+            raw = raw_fingerprint(output)
+            self.lineage[raw[0]] = [raw, key + ":" + os.path.basename(output)]
+        with open(os.path.join(self.folder, LINEAGE), "w") as f:
+            json.dump(self.lineage, f)
+
+    def restore(self, key, outputs):
+        """Copy the cached outputs of `key` to their paths and return the restored paths; None when the cache has no entry.
+
+        Outputs missing from the entry were not written by the run that
+        stored it, e.g. layers without a source, and are not restored.
+        """
+        manifestPath = os.path.join(self._entry(key), MANIFEST)
+        if not os.path.exists(manifestPath):
+            return None
+        with open(manifestPath) as f:
+            cached = set(json.load(f)["outputs"])
+        outputs = [output for output in outputs if os.path.basename(output) in cached]
+        if len(outputs) != len(cached):
+            return None
+        for output in outputs:
+            _copy(self._cached_path(key, output), output)
+        os.utime(manifestPath, None)
+        self._record(key, outputs)
+        return outputs
+
+    def store(self, key, outputs):
+        """Copy the existing `outputs` into the entry of `key`, then trim the cache to its size limit"""
+        outputs = [output for output in outputs if _exists(output)]
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.makedirs(entry)
+        for output in outputs:
+            cachedPath = self._cached_path(key, output)
+            if os.path.basename(os.path.dirname(cachedPath)) == "cache.gdb" and not arcpy.Exists(os.path.dirname(cachedPath)):
+                arcpy.CreateFileGDB_management(entry, "cache.gdb")
+            _copy(output, cachedPath)
+        # The manifest is written last, so an interrupted store is never restored
+        with open(os.path.join(entry, MANIFEST), "w") as f:
+            json.dump({"outputs": [os.path.basename(output) for output in outputs], "created": time.time()}, f)
+        self._record(key, outputs)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is within maxBytes"""
+        entries = []
+        for name in os.listdir(self.folder):
+            manifestPath = os.path.join(self.folder, name, MANIFEST)
+            if os.path.exists(manifestPath):
+                entries.append((os.path.getmtime(manifestPath), _size(os.path.join(self.folder, name)), name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        # The newest entry is kept even when it alone is over the limit
+        for _, size, name in entries[:-1]:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors = True)
+            total -= size
+
+
+def _copy(source, destination):
+    """Copy a dataset, or a plain file such as a NumPy archive"""
+    if _is_file(source):
+        shutil.copy2(source, destination)
+        return
+    if arcpy.Exists(destination):
+        arcpy.Delete_management(destination)
+    # The copy tools convert between shapefiles, rasters files and geodatabases where Copy cannot
+    dataType = arcpy.Describe(source).dataType
+    if dataType in ("FeatureClass", "ShapeFile"):
+        arcpy.CopyFeatures_management(source, destination)
+    elif dataType in ("RasterDataset", "RasterBand"):
+        arcpy.CopyRaster_management(source, destination)
+    else:
+        arcpy.Copy_management(source, destination)
+
+
+def open_cache(cacheFolder):
+    """RunCache for a tool's cache folder parameter; None when it is blank"""
+    return RunCache(cacheFolder) if cacheFolder else None
@@ -0,0 +1,163 @@
+"""
+Tool:               <Spatial index and point in polygon engine>
+Source Name:        <spatialindex>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by the tool scripts. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Uniform grid index over polygon bounding boxes and vectorized point in polygon tests, so points can
+                     be assigned to polygons in one pass instead of one SelectLayerByLocation per polygon.
+                     A polygon is a list of rings, each an (n, 2) array of x, y vertices. Rings are combined with the
+                     even-odd rule, which covers multipart polygons and holes without needing ring orientation.>
+"""
+from __future__ import division
+
+import numpy as np
+
+
+def polygon_bounds(polygons):
+    """(n, 4) array of xmin, ymin, xmax, ymax for a list of polygons"""
+    bounds = np.full((len(polygons), 4), np.nan)
+    for i, rings in enumerate(polygons):
+        if rings:
+            vertices = np.concatenate(rings)
+            bounds[i, :2] = vertices.min(axis=0)
+            bounds[i, 2:] = vertices.max(axis=0)
+    return bounds
+
+
+def _expand(counts):
+    """Position of every element within its group, for groups of the given sizes"""
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if ends.size else 0) - np.repeat(ends - counts, counts)
+
+
+class GridIndex(object):
+    """Uniform grid of bounding boxes for fast candidate lookups.
+
+    Each box is registered in every grid cell it overlaps; the cell to box
+    table is kept as CSR style offsets and items arrays. The default cell
+    size is the median box width or height, which keeps both the number of
+    boxes per cell and the number of cells per box small.
+    """
+
+    def __init__(self, bounds, cell_size=None):
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.bounds = bounds
+        # Boxes of empty geometries are NaN and are left out of the grid, keeping the indexes of the others
+        valid = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        boxes = bounds[valid]
+        if cell_size is None:
+            sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            cell_size = np.median(sizes) if sizes.size else 1.0
+            if cell_size <= 0:
+                cell_size = 1.0
+        self.cell_size = float(cell_size)
+        self.origin = boxes[:, :2].min(axis=0) if boxes.size else np.zeros(2)
+        ix0, iy0 = self._cell(boxes[:, 0], boxes[:, 1])
+        ix1, iy1 = self._cell(boxes[:, 2], boxes[:, 3])
+        self.shape = (int(iy1.max()) + 1 if iy1.size else 1, int(ix1.max()) + 1 if ix1.size else 1)
+
+        # Register every box in each of the cells it covers
+        widths = ix1 - ix0 + 1
+        counts = widths * (iy1 - iy0 + 1)
+        items = np.repeat(valid, counts)
+        local = _expand(counts)
+        cx = np.repeat(ix0, counts) + local % np.repeat(widths, counts)
+        cy = np.repeat(iy0, counts) + local // np.repeat(widths, counts)
+        cells = cy * self.shape[1] + cx
+        order = np.argsort(cells, kind="stable")
+        self.items = items[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=self.shape[0] * self.shape[1]))])
+
+    def _cell(self, x, y):
+        ix = np.floor((np.asarray(x) - self.origin[0]) / self.cell_size).astype(np.int64)
+        iy = np.floor((np.asarray(y) - self.origin[1]) / self.cell_size).astype(np.int64)
+        return ix, iy
+
+    def query_points(self, x, y):
+        """Candidate (point, box) index pairs for every box containing a point"""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        ix, iy = self._cell(x, y)
+        ongrid = np.flatnonzero((ix >= 0) & (iy >= 0) & (ix < self.shape[1]) & (iy < self.shape[0]))
+        cells = iy[ongrid] * self.shape[1] + ix[ongrid]
+        counts = self.offsets[cells + 1] - self.offsets[cells]
+        points = np.repeat(ongrid, counts)
+        boxes = self.items[np.repeat(self.offsets[cells], counts) + _expand(counts)]
+        b = self.bounds[boxes]
+        px, py = x[points], y[points]
+        inside = (px >= b[:, 0]) & (px <= b[:, 2]) & (py >= b[:, 1]) & (py <= b[:, 3])
+        return points[inside], boxes[inside]
+
+    def query_boxes(self, bounds):
+        """Candidate (query, box) index pairs for every indexed box overlapping a query box, each pair once"""
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        if not len(self.bounds):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        ix0, iy0 = self._cell(bounds[:, 0], bounds[:, 1])
+        ix1, iy1 = self._cell(bounds[:, 2], bounds[:, 3])
+        valid = ~np.isnan(bounds).any(axis=1) & (ix1 >= 0) & (iy1 >= 0) & (ix0 < self.shape[1]) & (iy0 < self.shape[0])
+        queries = np.flatnonzero(valid)
+        ix0, iy0 = np.maximum(ix0[valid], 0), np.maximum(iy0[valid], 0)
+        ix1, iy1 = np.minimum(ix1[valid], self.shape[1] - 1), np.minimum(iy1[valid], self.shape[0] - 1)
+
+        # Every grid cell covered by each query box, then every box registered in those cells
+        widths = ix1 - ix0 + 1
+        counts = widths * (iy1 - iy0 + 1)
+        local = _expand(counts)
+        cx = np.repeat(ix0, counts) + local % np.repeat(widths, counts)
+        cy = np.repeat(iy0, counts) + local // np.repeat(widths, counts)
+        cells = cy * self.shape[1] + cx
+        counts = self.offsets[cells + 1] - self.offsets[cells]
+        found = np.repeat(np.repeat(queries, widths * (iy1 - iy0 + 1)), counts)
+        boxes = self.items[np.repeat(self.offsets[cells], counts) + _expand(counts)]
+        q, b = bounds[found], self.bounds[boxes]
+        overlap = (q[:, 0] <= b[:, 2]) & (q[:, 2] >= b[:, 0]) & (q[:, 1] <= b[:, 3]) & (q[:, 3] >= b[:, 1])
+        pairs = np.unique(found[overlap] * len(self.bounds) + boxes[overlap])
+        return pairs // len(self.bounds), pairs % len(self.bounds)
+
+
+def points_in_rings(x, y, rings, chunk=2000000):
+    """Boolean array of the points inside a polygon, by even-odd ray crossing.
+
+    Points are tested against all edges at once, in chunks of about
+    `chunk` edge-point pairs to bound memory.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    inside = np.zeros(x.size, dtype=bool)
+    if not rings or not x.size:
+        return inside
+    starts = np.concatenate([ring for ring in rings])
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    xa, ya, xb, yb = starts[:, 0:1], starts[:, 1:2], ends[:, 0:1], ends[:, 1:2]
+    step = max(1, chunk // len(starts))
+    for i in range(0, x.size, step):
+        px, py = x[i:i + step], y[i:i + step]
+        spans = (ya > py) != (yb > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing = px < (xb - xa) * (py - ya) / (yb - ya) + xa
+        inside[i:i + step] = np.logical_and(spans, crossing).sum(axis=0) % 2 == 1
+    return inside
+
+
+def assign_points(x, y, polygons, index=None):
+    """Index of the polygon containing each point, or -1 when none does.
+
+    Builds (or reuses) a GridIndex over the polygon bounding boxes, then runs
+    exact point in polygon tests only on the candidates from the index.
+    Points in overlapping polygons go to the lowest polygon index.
+    """
+    if index is None:
+        index = GridIndex(polygon_bounds(polygons))
+    points, boxes = index.query_points(x, y)
+    order = np.argsort(boxes, kind="stable")
+    points, boxes = points[order], boxes[order]
+    assignment = np.full(np.size(x), len(polygons), dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, boxes[1:] != boxes[:-1]]) if boxes.size else np.zeros(0, dtype=np.int64)
+    for start, stop in zip(starts, np.append(starts[1:], boxes.size)):
+        candidates = points[start:stop]
+        hits = candidates[points_in_rings(np.take(x, candidates), np.take(y, candidates), polygons[boxes[start]])]
+        np.minimum.at(assignment, hits, boxes[start])
+    assignment[assignment == len(polygons)] = -1
+    return assignment
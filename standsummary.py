@@ -0,0 +1,215 @@
+"""
+Tool:               <Stand summary kernels>
+Source Name:        <standsummary>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 3_LidarSummary. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Vectorized per stand tree height statistics. Trees are given as a stand index per tree (-1 for
+                     trees outside every stand) and a height per tree; results are arrays with one value per stand,
+                     NaN where a stand has no trees.
+                     In raster zone mode the stand index of a tree is read from a grid of stand indices burned once
+                     onto the CHM grid and cached on disk, so no vector point in polygon test is needed.
+                     HeightIndex keeps the tree heights of every stand sorted, so counts and TPA for any height range
+                     are answered by binary search without rerunning the tool.>
+"""
+from __future__ import division
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from rasterize import rasterize_polygons
+from treetops import cell_indices
+
+ZONE_PREFIX = "LidarSummaryZones_"
+HEIGHT_INDEX = "LidarSummaryHeights.npz"
+
+
+def _sorted_groups(groups, values):
+    """Trees sorted by (stand, height), dropping unassigned trees and missing heights"""
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=np.float64)
+    keep = (groups >= 0) & ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+    order = np.lexsort((values, groups))
+    return groups[order], values[order]
+
+
+def group_stats(groups, values, ngroups, percentiles=()):
+    """Count, min, max, mean, median and percentiles of `values` for every group at once.
+
+    One sort orders the values within groups, segment bounds come from a
+    bincount, and every statistic is then read from the sorted values.
+    Percentiles use linear interpolation, so the median of an even count is
+    the mean of the middle two values. Returns a dict of arrays of length
+    `ngroups`; percentile q is stored under "p" + str(q).
+    """
+    groups, values = _sorted_groups(groups, values)
+    counts = np.bincount(groups, minlength=ngroups)[:ngroups]
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    has = counts > 0
+    stats = {"count": counts}
+    for name in ("min", "max", "mean", "median"):
+        stats[name] = np.full(ngroups, np.nan)
+    stats["min"][has] = values[starts[has]]
+    stats["max"][has] = values[ends[has] - 1]
+    stats["mean"][has] = np.bincount(groups, weights=values, minlength=ngroups)[:ngroups][has] / counts[has]
+
+    def percentile(q):
+        result = np.full(ngroups, np.nan)
+        position = starts[has] + (counts[has] - 1) * (q / 100.0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, ends[has] - 1)
+        result[has] = values[low] + (values[high] - values[low]) * (position - low)
+        return result
+
+    stats["median"] = percentile(50)
+    for q in percentiles:
+        stats["p" + str(q)] = percentile(float(q))
+    return stats
+
+
+def parse_height_classes(text):
+    """Parse height classes written as "name min [max]; name min [max]; ..." into (name, min, max) tuples.
+
+    Bounds are inclusive; a missing max leaves the class open ended (None).
+    """
+    classes = []
+    for item in text.split(";"):
+        words = item.split()
+        if not words:
+            continue
+        if len(words) not in (2, 3):
+            raise ValueError("Height classes are written as 'name min [max]', got '" + item.strip() + "'")
+        classes.append((words[0], float(words[1]), float(words[2]) if len(words) == 3 else None))
+    return classes
+
+
+def class_counts(groups, values, ngroups, classes):
+    """Count of trees in every (group, height class) pair, in a single pass over the trees.
+
+    `classes` is a list of (name, min, max) tuples with inclusive bounds and
+    max None for open ended classes; classes may overlap. Every class bound
+    becomes a ">= threshold" test, trees are binned once against the sorted
+    thresholds, and a suffix sum over the bins gives the count at or above
+    each threshold, so a class count is the difference of two columns.
+    Returns an (ngroups, nclasses) integer array.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=np.float64)
+    keep = (groups >= 0) & ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+    lows = np.array([c[1] for c in classes], dtype=np.float64)
+    # h <= max is the same as not (h >= the next float above max)
+    highs = np.array([np.inf if c[2] is None else np.nextafter(c[2], np.inf) for c in classes], dtype=np.float64)
+    thresholds = np.unique(np.concatenate([lows, highs]))
+    bins = np.searchsorted(thresholds, values, side="right")
+    nbins = thresholds.size + 1
+    histogram = np.bincount(groups * nbins + bins, minlength=ngroups * nbins)[:ngroups * nbins].reshape(ngroups, nbins)
+    at_least = np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1]
+    return at_least[:, np.searchsorted(thresholds, lows) + 1] - at_least[:, np.searchsorted(thresholds, highs) + 1]
+
+
+def zone_key(polygons, shape, geotransform):
+    """Hash of the stand geometry and CHM grid a zone raster was burned from"""
+    digest = hashlib.md5()
+    digest.update(repr((len(polygons), tuple(shape), tuple(float(v) for v in geotransform))).encode("utf-8"))
+    for rings in polygons:
+        digest.update(repr(len(rings)).encode("utf-8"))
+        for ring in rings:
+            digest.update(np.ascontiguousarray(ring, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def cached_zones(folder, polygons, shape, geotransform):
+    """Grid of stand indices (-1 outside stands) on the CHM grid, memory mapped from a cache file.
+
+    The zones are burned only when no cache file matches the stand geometry
+    and grid, so reruns with new height thresholds skip rasterization.
+    Stale zone files in `folder` are removed.
+    """
+    key = zone_key(polygons, shape, geotransform)
+    path = os.path.join(folder, ZONE_PREFIX + key + ".npy")
+    if not os.path.exists(path):
+        for stale in glob.glob(os.path.join(folder, ZONE_PREFIX + "*.npy")):
+            os.remove(stale)
+        partial = path + ".partial"
+        zones = np.lib.format.open_memmap(partial, mode="w+", dtype=np.int32, shape=tuple(shape))
+        rasterize_polygons(polygons, np.arange(len(polygons)), shape, geotransform, out=zones)
+        zones.flush()
+        del zones
+        os.rename(partial, path)
+    return np.load(path, mmap_mode="r")
+
+
+def zone_of_points(zones, x, y, geotransform):
+    """Stand index of the zone cell under each point, -1 off the grid or outside stands"""
+    rows, cols = cell_indices(x, y, geotransform)
+    ongrid = (rows >= 0) & (cols >= 0) & (rows < zones.shape[0]) & (cols < zones.shape[1])
+    result = np.full(rows.size, -1, dtype=np.int64)
+    result[ongrid] = zones[rows[ongrid], cols[ongrid]]
+    return result
+
+
+class HeightIndex(object):
+    """Tree heights sorted within each stand, for threshold queries.
+
+    Heights are stored as one float32 array with CSR style offsets, so the
+    trees of stand i are heights[offsets[i]:offsets[i + 1]]. Alongside are
+    the SETTING_ID and acres of every stand. Queries run one vectorized
+    binary search per stand, O(stands * log n), and use the same inclusive
+    bounds as class_counts (compared at float32 precision).
+
+        index = HeightIndex.load(os.path.join(outFolder, HEIGHT_INDEX))
+        tpa = index.tpa(4.5, 20)
+    """
+
+    def __init__(self, offsets, heights, setting_ids, acres):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.float32)
+        self.setting_ids = np.asarray(setting_ids)
+        self.acres = np.asarray(acres, dtype=np.float64)
+
+    @classmethod
+    def build(cls, groups, values, setting_ids, acres):
+        """Index trees given as a stand index per tree (-1 for none) and a height per tree"""
+        groups, values = _sorted_groups(groups, values)
+        counts = np.bincount(groups, minlength=len(acres))[:len(acres)]
+        return cls(np.concatenate([[0], np.cumsum(counts)]), values, setting_ids, acres)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["offsets"], data["heights"], data["setting_ids"], data["acres"])
+
+    def save(self, path):
+        np.savez(path, offsets=self.offsets, heights=self.heights, setting_ids=self.setting_ids, acres=self.acres)
+
+    def _below(self, threshold, right):
+        """Position in every stand's heights of the first height >= threshold (> threshold when right)"""
+        threshold = np.float32(threshold)
+        low, high = self.offsets[:-1].copy(), self.offsets[1:].copy()
+        while True:
+            active = low < high
+            if not active.any():
+                return low
+            middle = (low + high) // 2
+            value = self.heights[np.minimum(middle, self.heights.size - 1)]
+            before = (value <= threshold) if right else (value < threshold)
+            low = np.where(active & before, middle + 1, low)
+            high = np.where(active & ~before, middle, high)
+
+    def count(self, low, high=None):
+        """Number of trees in every stand with low <= height <= high; high None is open ended"""
+        ends = self.offsets[1:] if high is None else self._below(high, True)
+        return ends - self._below(low, False)
+
+    def tpa(self, low, high=None):
+        """Trees per acre in every stand with low <= height <= high; NaN for stands without area"""
+        result = np.full(self.acres.size, np.nan)
+        has = self.acres > 0
+        result[has] = self.count(low, high)[has] / self.acres[has]
+        return result
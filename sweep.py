@@ -0,0 +1,107 @@
+"""
+Tool:               <Unit parameter sweep>
+Source Name:        <sweep>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 7_UnitSweep. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Evaluates unit outcomes for every combination of regenTPA, ctTPA, sliverSize and harvestAge on one
+                     set of grids built once per project: the project area, the bit flags of the exclusion layers that do
+                     not depend on the parameters, the latest regen harvest year of every cell and the lidar summary stand
+                     of every cell with the stand's Regen_TPA and CT_TPA. A combination then only needs mask operations,
+                     a connected component labelling and a sliver drop per unit type, as in the raster engine
+                     (rasterunits.py). Units within 5 m are joined by growing the unit cells, or with standSplit counted
+                     per stand they touch. The grids are saved as .npy files that worker processes memory map.>
+"""
+from __future__ import division
+
+import itertools
+import json
+import os.path
+
+import numpy as np
+
+import rasterunits
+
+GRIDS = ["inside", "flags", "harvest_year", "tpa_zone", "stand_zone", "regen_tpa", "ct_tpa"]
+SETTINGS = "sweep.json"
+
+
+def save_grids(folder, grids, settings):
+    """Write every array in `grids` (keyed like GRIDS) and the JSON-serializable settings to `folder`"""
+    for name in GRIDS:
+        np.save(os.path.join(folder, name + ".npy"), grids[name])
+    with open(os.path.join(folder, SETTINGS), "w") as f:
+        json.dump(settings, f)
+
+
+def load_grids(folder):
+    """(grids, settings) saved by save_grids, with the arrays memory mapped"""
+    grids = dict((name, np.load(os.path.join(folder, name + ".npy"), mmap_mode="r")) for name in GRIDS)
+    with open(os.path.join(folder, SETTINGS)) as f:
+        return grids, json.load(f)
+
+
+def parse_values(text, default=""):
+    """Floats of a space or comma separated list; the default value when it is blank"""
+    values = [float(v) for v in str(text).replace(",", " ").split()]
+    return values or [float(default)]
+
+
+def combinations(regen_tpas, ct_tpas, sliver_sizes, harvest_ages):
+    """Every (regenTPA, ctTPA, sliverSize, harvestAge) combination"""
+    return list(itertools.product(regen_tpas, ct_tpas, sliver_sizes, harvest_ages))
+
+
+def _stand_lookup(tpa, threshold):
+    """Per stand True where TPA is under the threshold, with a last False entry for cells outside every stand (-1)"""
+    return np.append(np.asarray(tpa) < threshold, False)
+
+
+def unit_summary(free, sliver_cells, radius, stand_zone=None):
+    """(kept cells, units, cells) of the units left in `free` after dropping parts of `sliver_cells` or fewer.
+
+    Parts within 2 * radius cells form one unit; with `stand_zone` the
+    units are instead counted per stand they touch, cells outside every
+    stand counting as one more, like Identity with the stands.
+    """
+    labels, count = rasterunits.label_components(free)
+    labels, count = rasterunits.drop_small(labels, count, sliver_cells)
+    kept = labels > 0
+    if stand_zone is not None:
+        units = np.unique(stand_zone[kept]).size
+    else:
+        units = rasterunits.aggregate_parts(labels, count, radius)[1]
+    return kept, units, int(np.count_nonzero(kept))
+
+
+def evaluate(grids, settings, combination):
+    """[(unit type, units, acres)] for Regen and CT units under one parameter combination"""
+    regen_tpa, ct_tpa, sliver_size, harvest_age = combination
+    sliver_cells = float(sliver_size) / settings["cell_acres"]
+    stand_zone = grids["stand_zone"] if settings["stand_split"] else None
+    inside, flags = grids["inside"], grids["flags"]
+
+    # Regen harvests within harvestAge years and stands with too few regen-sized trees exclude regen units
+    recent = grids["harvest_year"] >= settings["year"] - harvest_age
+    few_regen = _stand_lookup(grids["regen_tpa"], regen_tpa)[grids["tpa_zone"]]
+    free = inside & ((flags & np.uint16(settings["regen_mask"])) == 0) & ~recent & ~few_regen
+    regen_kept, regen_units, regen_cells = unit_summary(free, sliver_cells, settings["radius"], stand_zone)
+
+    # The regen units exclude CT units
+    few_ct = _stand_lookup(grids["ct_tpa"], ct_tpa)[grids["tpa_zone"]]
+    free = inside & ((flags & np.uint16(settings["ct_mask"])) == 0) & ~few_ct & ~regen_kept
+    _, ct_units, ct_cells = unit_summary(free, sliver_cells, settings["radius"], stand_zone)
+    return [("Regen", regen_units, regen_cells * settings["cell_acres"]), ("CT", ct_units, ct_cells * settings["cell_acres"])]
+
+
+def _sweep_task(task):
+    """Rows (combination + (unit type, units, acres)) of a chunk of combinations, on the grids saved in a folder"""
+    folder, chunk = task
+    grids, settings = load_grids(folder)
+    return [tuple(combination) + row for combination in chunk for row in evaluate(grids, settings, combination)]
+
+
+def sweep_chunks(folder, combinations, chunks):
+    """Tasks for _sweep_task splitting the combinations into about `chunks` parts"""
+    size = max(1, int(np.ceil(len(combinations) / max(chunks, 1))))
+    return [(folder, combinations[i:i + size]) for i in range(0, len(combinations), size)]
@@ -0,0 +1,5 @@
+"""The NumPy modules are imported from the repository root, as the tool scripts import them."""
+import os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
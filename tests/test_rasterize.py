@@ -0,0 +1,45 @@
+"""Polygon burning against a brute-force point in polygon test of every cell centre."""
+import numpy as np
+
+import rasterize
+
+
+def _inside(x, y, rings):
+    """Even-odd test of one point against every edge"""
+    inside = False
+    for ring in rings:
+        for i in range(len(ring)):
+            (xa, ya), (xb, yb) = ring[i], ring[(i + 1) % len(ring)]
+            if (ya > y) != (yb > y) and x < xa + (y - ya) * (xb - xa) / (yb - ya):
+                inside = not inside
+    return inside
+
+
+def _star(rng, center, n):
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = rng.uniform(2, 12, n)
+    return np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)])
+
+
+def test_rasterize_polygons_matches_point_in_polygon():
+    rng = np.random.RandomState(4)
+    geotransform = (-2.0, 0.75, 0.0, 40.0, 0.0, -0.75)
+    shape = (56, 60)
+    polygons = [[_star(rng, rng.uniform(5, 35, 2), rng.randint(3, 25))] for _ in range(5)]
+    # A ring with a hole, and one with vertices on cell centre lines
+    polygons.append([np.array([[0.0, 0.0], [20.0, 0.0], [20.0, 20.0], [0.0, 20.0]]),
+                     np.array([[5.0, 5.0], [15.0, 5.0], [15.0, 15.0], [5.0, 15.0]])])
+    polygons.append([np.round(_star(rng, (25.0, 25.0), 12) * 4) / 4 + 0.375])
+    burned = rasterize.rasterize_polygons(polygons, np.arange(len(polygons)), shape, geotransform)
+
+    expected = np.full(shape, -1)
+    x0, dx, _, y0, _, dy = geotransform
+    for r in range(shape[0]):
+        for c in range(shape[1]):
+            x, y = x0 + (c + 0.5) * dx, y0 + (r + 0.5) * dy
+            # The first polygon containing the cell centre wins
+            for value, rings in enumerate(polygons):
+                if _inside(x, y, rings):
+                    expected[r, c] = value
+                    break
+    assert np.array_equal(burned, expected)
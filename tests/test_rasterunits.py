@@ -0,0 +1,39 @@
+"""Connected component labelling against a flood fill."""
+import numpy as np
+
+import rasterunits
+
+
+def _flood_fill_labels(mask, connectivity):
+    steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    if connectivity == 8:
+        steps += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+    labels = np.zeros(mask.shape, dtype = np.int64)
+    count = 0
+    for r in range(mask.shape[0]):
+        for c in range(mask.shape[1]):
+            if not mask[r, c] or labels[r, c]:
+                continue
+            count += 1
+            labels[r, c] = count
+            stack = [(r, c)]
+            while stack:
+                y, x = stack.pop()
+                for dy, dx in steps:
+                    ny, nx = y + dy, x + dx
+                    if 0 <= ny < mask.shape[0] and 0 <= nx < mask.shape[1] and mask[ny, nx] and not labels[ny, nx]:
+                        labels[ny, nx] = count
+                        stack.append((ny, nx))
+    return labels, count
+
+
+def test_label_components_matches_flood_fill():
+    rng = np.random.RandomState(3)
+    for density in (0.3, 0.55, 0.7):
+        mask = rng.uniform(size = (45, 60)) < density
+        for connectivity in (4, 8):
+            labels, count = rasterunits.label_components(mask, connectivity)
+            expected, expectedCount = _flood_fill_labels(mask, connectivity)
+            # Both number components in row-major order of their first cell
+            assert count == expectedCount
+            assert np.array_equal(labels, expected)
@@ -0,0 +1,44 @@
+"""Point to polygon assignment against a brute-force test of every point and polygon."""
+import numpy as np
+
+import spatialindex
+
+
+def _inside(x, y, rings):
+    """Even-odd test of one point against every edge"""
+    inside = False
+    for ring in rings:
+        for i in range(len(ring)):
+            (xa, ya), (xb, yb) = ring[i], ring[(i + 1) % len(ring)]
+            if (ya > y) != (yb > y) and x < xa + (y - ya) * (xb - xa) / (yb - ya):
+                inside = not inside
+    return inside
+
+
+def _star(rng, center, n):
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = rng.uniform(1, 6, n)
+    return np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)])
+
+
+def test_assign_points_matches_brute_force():
+    rng = np.random.RandomState(8)
+    polygons = [[_star(rng, rng.uniform(0, 40, 2), rng.randint(3, 15))] for _ in range(30)]
+    # Overlapping polygons and a polygon with a hole
+    polygons.append([np.array([[10.0, 10.0], [30.0, 10.0], [30.0, 30.0], [10.0, 30.0]]),
+                     np.array([[15.0, 15.0], [25.0, 15.0], [25.0, 25.0], [15.0, 25.0]])])
+    x, y = rng.uniform(-5, 45, 3000), rng.uniform(-5, 45, 3000)
+    expected = np.array([next((i for i, rings in enumerate(polygons) if _inside(px, py, rings)), -1) for px, py in zip(x, y)])
+    assert np.array_equal(spatialindex.assign_points(x, y, polygons), expected)
+    # A coarse grid puts many boxes in each cell and gives the same answer
+    index = spatialindex.GridIndex(spatialindex.polygon_bounds(polygons), cell_size = 25.0)
+    assert np.array_equal(spatialindex.assign_points(x, y, polygons, index), expected)
+
+
+def test_empty_polygons_get_no_points():
+    x, y = np.array([0.5, 5.0]), np.array([0.5, 5.0])
+    assert np.array_equal(spatialindex.assign_points(x, y, [[], []]), [-1, -1])
+    square = [np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]])]
+    assert np.array_equal(spatialindex.assign_points(x, y, [[], square]), [1, -1])
+    index = spatialindex.GridIndex(np.full((3, 4), np.nan))
+    assert index.query_boxes([[0.0, 0.0, 1.0, 1.0]])[0].size == 0
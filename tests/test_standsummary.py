@@ -0,0 +1,54 @@
+"""Per-stand statistics and counts against NumPy on each group."""
+import numpy as np
+
+import standsummary
+
+
+def _trees(seed, ngroups, n=5000):
+    rng = np.random.RandomState(seed)
+    # The last groups get no trees
+    return rng.randint(0, ngroups - 3, n), rng.uniform(0, 150, n)
+
+
+def test_group_stats_median_matches_numpy():
+    ngroups = 40
+    groups, values = _trees(2, ngroups)
+    stats = standsummary.group_stats(groups, values, ngroups, percentiles = (25, 90))
+    for g in range(ngroups):
+        inside = values[groups == g]
+        if not inside.size:
+            assert stats["count"][g] == 0 and np.isnan(stats["median"][g])
+            continue
+        assert stats["count"][g] == inside.size
+        assert np.isclose(stats["median"][g], np.median(inside))
+        assert np.isclose(stats["p25"][g], np.percentile(inside, 25))
+        assert np.isclose(stats["min"][g], inside.min()) and np.isclose(stats["max"][g], inside.max())
+        assert np.isclose(stats["mean"][g], inside.mean())
+
+
+def test_class_counts_match_naive_counts():
+    ngroups = 25
+    groups, values = _trees(9, ngroups)
+    values = np.round(values)
+    # Overlapping, open ended and exactly hit bounds, and trees outside any stand
+    groups[:50] = -1
+    classes = standsummary.parse_height_classes("Pole 10 30; Large 100; Mid 30 100; Exact 42 42")
+    counts = standsummary.class_counts(groups, values, ngroups, classes)
+    for g in range(ngroups):
+        inside = values[groups == g]
+        for k, (name, low, high) in enumerate(classes):
+            assert counts[g, k] == ((inside >= low) & ((inside <= high) if high is not None else True)).sum()
+
+
+def test_height_index_count_matches_naive_counts():
+    ngroups = 30
+    groups, values = _trees(11, ngroups)
+    values = np.round(values, 1)
+    groups[:20] = -1
+    index = standsummary.HeightIndex.build(groups, values, np.arange(ngroups), np.full(ngroups, 2.0))
+    heights = values.astype(np.float32)
+    for low, high in ((4.5, 20.0), (0.0, None), (42.3, 42.3), (200.0, None)):
+        expected = [((heights[groups == g] >= np.float32(low)) &
+                     ((heights[groups == g] <= np.float32(high)) if high is not None else True)).sum() for g in range(ngroups)]
+        assert np.array_equal(index.count(low, high), expected)
+        assert np.allclose(index.tpa(low, high), np.array(expected) / 2.0)
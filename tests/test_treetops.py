@@ -0,0 +1,104 @@
+"""Tree top detection and crown segmentation against naive versions and whole-raster runs."""
+import numpy as np
+
+import treetops
+
+GEOTRANSFORM = (500000.0, 1.0, 0.0, 4200000.0, 0.0, -1.0)
+
+
+def _chm(shape, seed=0):
+    rng = np.random.RandomState(seed)
+    chm = rng.uniform(0, 30, shape).astype(np.float32)
+    chm[rng.uniform(size = shape) < 0.05] = np.nan
+    return chm
+
+
+def _naive_max(chm, r, c, size):
+    """Maximum of the window of `size` cells around (r, c), ignoring NaN and the cells beyond the edges"""
+    half = size // 2
+    window = chm[max(r - half, 0):r + half + 1, max(c - half, 0):c + half + 1]
+    return np.nan if np.isnan(window).all() else np.nanmax(window)
+
+
+def test_focal_max_matches_naive_window():
+    chm = _chm((23, 31), seed = 1)
+    chm[:4, :4] = np.nan
+    for size in (1, 3, 5, 7):
+        expected = np.array([[_naive_max(chm, r, c, size) for c in range(chm.shape[1])] for r in range(chm.shape[0])],
+                            dtype = np.float32)
+        assert np.array_equal(treetops.focal_max(chm, size), expected, equal_nan = True)
+
+
+def test_tiled_tree_ids_match_untiled():
+    chm = _chm((157, 203))
+    whole = treetops.detect_tree_tops(chm, GEOTRANSFORM, 6.0)
+    for tile_size in (32, 50, 1000):
+        tiled = treetops.detect_tree_tops_tiled(chm, GEOTRANSFORM, 6.0, tile_size = tile_size)
+        assert np.array_equal(tiled.tree_id, whole.tree_id)
+        assert np.array_equal(tiled.x, whole.x)
+        assert np.array_equal(tiled.y, whole.y)
+        assert np.array_equal(tiled.height, whole.height)
+
+
+def test_fused_preparation_matches_separate_passes():
+    chm = _chm((70, 45), seed = 5)
+    for smooth_window in (3, 5):
+        expected = treetops.prepare_chm(chm, True, True, smooth_window)
+        expected[~(expected >= 12.0)] = np.nan
+        for block_rows in (1, 2, 3, 16, 256):
+            fused = treetops.prepare_chm_fused(chm.copy(), 12.0, True, True, smooth_window, block_rows = block_rows)
+            assert np.allclose(fused, expected, equal_nan = True)
+    # The input array itself can take the result
+    buffer = chm.copy()
+    treetops.prepare_chm_fused(buffer, 12.0, out = buffer, block_rows = 16)
+    expected = treetops.prepare_chm(chm)
+    expected[~(expected >= 12.0)] = np.nan
+    assert np.allclose(buffer, expected, equal_nan = True)
+
+
+def test_variable_window_matches_naive_window():
+    chm = _chm((40, 52), seed = 6)
+    window = treetops.VariableWindow(treetops.CrownWidth(1.0, 0.25), 1.0, min_window = 3, max_window = 9)
+    sizes = window.sizes(chm)
+    expected = np.zeros(chm.shape, dtype = bool)
+    for r in range(chm.shape[0]):
+        for c in range(chm.shape[1]):
+            expected[r, c] = chm[r, c] >= 6.0 and chm[r, c] == _naive_max(chm, r, c, sizes[r, c])
+    assert len(np.unique(sizes)) > 1
+    assert np.array_equal(treetops.local_maxima(chm, 6.0, window), expected)
+
+
+def test_tiled_crown_labels_match_whole_raster():
+    chm = treetops.prepare_chm(_chm((90, 110), seed = 7), True, False)
+    trees = treetops.find_tree_tops(chm, GEOTRANSFORM, 4.0)
+    whole = treetops.segment_crowns(chm, trees, GEOTRANSFORM, 4.0, 6)
+    for tile_size in (25, 40):
+        labels = np.zeros(chm.shape, dtype = np.int32)
+        tiled = treetops.segment_crowns_tiled(chm, trees, GEOTRANSFORM, 4.0, 6, tile_size = tile_size, out = labels)
+        assert np.array_equal(labels, whole.labels)
+        assert np.allclose(tiled.area, whole.area)
+        assert np.allclose(tiled.height, whole.height, equal_nan = True)
+    # Every labelled cell is reachable from its own tree top within the radius
+    rows, cols = treetops.cell_indices(trees.x, trees.y, GEOTRANSFORM)
+    labelled = np.nonzero(whole.labels)
+    seed = whole.labels[labelled] - 1
+    assert ((labelled[0] - rows[seed]) ** 2 + (labelled[1] - cols[seed]) ** 2 <= 36).all()
+
+
+def test_crown_metrics_follow_tree_ids():
+    chm = treetops.prepare_chm(_chm((60, 70), seed = 8), True, False)
+    trees = treetops.find_tree_tops(chm, GEOTRANSFORM, 4.0)
+    whole = treetops.segment_crowns(chm, trees, GEOTRANSFORM, 4.0, 5)
+    # TreeIds that are neither 1..n nor in array order label the same crowns
+    renumbered = trees._replace(tree_id = np.random.RandomState(9).permutation(trees.tree_id.size).astype(np.int32) + 1000)
+    crowns = treetops.segment_crowns(chm, renumbered, GEOTRANSFORM, 4.0, 5)
+    tiled = treetops.segment_crowns_tiled(chm, renumbered, GEOTRANSFORM, 4.0, 5, tile_size = 30)
+    for result in (crowns, tiled):
+        assert np.allclose(result.area, whole.area)
+        assert np.allclose(result.height, whole.height, equal_nan = True)
+    try:
+        treetops.segment_crowns_tiled(chm, trees, GEOTRANSFORM, 4.0, None)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Tiled segmentation without a radius should fail")
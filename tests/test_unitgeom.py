@@ -0,0 +1,64 @@
+"""Union-find grouping and sliver aggregation against a graph search."""
+import numpy as np
+
+import unitgeom
+
+
+def _components(n, a, b):
+    """Group of every element by depth first search, numbered in order of first element"""
+    neighbours = [[] for _ in range(n)]
+    for i, j in zip(a, b):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    labels = [-1] * n
+    count = 0
+    for start in range(n):
+        if labels[start] >= 0:
+            continue
+        labels[start] = count
+        stack = [start]
+        while stack:
+            for j in neighbours[stack.pop()]:
+                if labels[j] < 0:
+                    labels[j] = count
+                    stack.append(j)
+        count += 1
+    return np.array(labels)
+
+
+def _square(x, y, size):
+    return [np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]])]
+
+
+def test_union_find_matches_graph_search():
+    rng = np.random.RandomState(15)
+    for n, pairs in ((1, 0), (50, 0), (200, 150), (200, 400)):
+        a, b = rng.randint(0, n, pairs), rng.randint(0, n, pairs)
+        assert np.array_equal(unitgeom.union_find(n, a, b), _components(n, a, b))
+
+
+def test_aggregate_matches_box_distance_groups():
+    rng = np.random.RandomState(16)
+    corners, sizes = rng.uniform(0, 200, (60, 2)), rng.uniform(1, 12, 60)
+    # Keep the squares from overlapping, as candidate units never do
+    keep = [i for i in range(60) if all(np.abs(corners[i] - corners[j]).max() > max(sizes[i], sizes[j]) for j in range(i))]
+    corners, sizes = corners[keep], sizes[keep]
+    polygons = [_square(x, y, s) for (x, y), s in zip(corners, sizes)]
+    areas = unitgeom.polygon_areas(polygons)
+    assert np.allclose(areas, sizes ** 2)
+
+    # Squares are within the distance when the gaps between their boxes along both axes are
+    a, b = [], []
+    for i in range(len(polygons)):
+        for j in range(i + 1, len(polygons)):
+            gap = np.maximum(np.abs(corners[i] - corners[j]) - np.where(corners[i] < corners[j], sizes[i], sizes[j]), 0)
+            if np.hypot(*gap) <= 5.0:
+                a.append(i)
+                b.append(j)
+    groups = _components(len(polygons), a, b)
+    totals = np.bincount(groups, weights = areas)
+    result = unitgeom.aggregate(polygons, areas, 5.0, 40.0)
+    kept = totals[groups] > 40.0
+    assert (result[~kept] == -1).all()
+    # The kept groups are the same partition of the squares
+    assert np.array_equal(result[kept][:, None] == result[kept][None, :], groups[kept][:, None] == groups[kept][None, :])
@@ -0,0 +1,519 @@
+"""
+Tool:               <Lidar tree top detection engine>
+Source Name:        <treetops>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 2_TreeTopPoints. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <NumPy implementation of the fixed window local maximum tree top detector used by 2_TreeTopPoints.
+                     Reproduces the arcpy.sa chain FocalStatistics (Mean 3x3) -> * 3.281 -> SetNull (VALUE < min)
+                     -> FocalStatistics (Maximum 5x5) -> EqualTo -> SetNull -> RasterToPoint in a single pass,
+                     using separable sliding window filters instead of full intermediate rasters.
+                     Geotransforms use the GDAL convention:
+                         (x origin, cell width, row rotation, y origin, column rotation, -cell height)
+                     where the origin is the upper left corner of the upper left cell.>
+"""
+from __future__ import division
+
+from collections import namedtuple
+
+import heapq
+
+import numpy as np
+
+from parallel import parallel_imap
+
+FEET_PER_METER = 3.281
+
+TreeTops = namedtuple("TreeTops", ["x", "y", "height", "tree_id"])
+Crowns = namedtuple("Crowns", ["labels", "area", "height"])
+
+
+def _window(a, start, length, axis):
+    """Return a view of `length` cells of `a` along `axis`, starting at `start`"""
+    index = [slice(None)] * a.ndim
+    index[axis] = slice(start, start + length)
+    return a[tuple(index)]
+
+
+def _pad(a, half, axis, fill):
+    """Pad both ends of `a` along `axis` with `half` cells of `fill`"""
+    width = [(0, 0)] * a.ndim
+    width[axis] = (half, half)
+    return np.pad(a, width, mode="constant", constant_values=fill)
+
+
+def _check_size(size):
+    if size < 1 or size % 2 == 0:
+        raise ValueError("Window size must be a positive odd number of cells, got " + str(size))
+
+
+def sliding_max(a, size, axis):
+    """Centred sliding window maximum of `size` cells along one axis.
+
+    Cells beyond the array edge are ignored, as are -inf cells. Runs in
+    O(log size) vectorized passes by doubling the window width.
+    """
+    _check_size(size)
+    n = a.shape[axis]
+    m = _pad(a, size // 2, axis, -np.inf)
+    width = 1
+    while width * 2 <= size:
+        length = m.shape[axis] - width
+        m = np.maximum(_window(m, 0, length, axis), _window(m, width, length, axis))
+        width *= 2
+    # m[i] now holds the maximum of `width` cells, so two overlapping reads cover the window
+    return np.maximum(_window(m, 0, n, axis), _window(m, size - width, n, axis))
+
+
+def sliding_sum(a, size, axis):
+    """Centred sliding window sum of `size` cells along one axis (edges padded with zero)"""
+    _check_size(size)
+    n = a.shape[axis]
+    p = _pad(a, size // 2, axis, 0)
+    out = _window(p, 0, n, axis).copy()
+    for k in range(1, size):
+        out += _window(p, k, n, axis)
+    return out
+
+
+def focal_max(chm, size):
+    """Square focal maximum, ignoring NoData (NaN). Equivalent to FocalStatistics MAXIMUM with ignore_nodata = DATA."""
+    a = np.where(np.isnan(chm), -np.inf, chm)
+    m = sliding_max(sliding_max(a, size, 0), size, 1)
+    m[np.isneginf(m)] = np.nan
+    return m
+
+
+def focal_mean(chm, size):
+    """Square focal mean, ignoring NoData (NaN). Equivalent to FocalStatistics MEAN with ignore_nodata = DATA.
+
+    As in ArcGIS, a NoData cell receives the mean of any valid neighbors.
+    """
+    valid = ~np.isnan(chm)
+    total = sliding_sum(sliding_sum(np.where(valid, chm, 0).astype(np.float64), size, 0), size, 1)
+    count = sliding_sum(sliding_sum(valid.astype(np.int32), size, 0), size, 1)
+    mean = np.full(chm.shape, np.nan, dtype=np.float32)
+    np.divide(total, count, out=mean, where=count > 0, casting="unsafe")
+    return mean
+
+
+def prepare_chm(chm, smooth=True, to_feet=True, smooth_window=3):
+    """Smooth and convert a canopy height model, returning a float32 array with NaN as NoData"""
+    chm = np.asarray(chm, dtype=np.float32)
+    if smooth:
+        chm = focal_mean(chm, smooth_window)
+    if to_feet:
+        chm = chm * np.float32(FEET_PER_METER)
+    return chm
+
+
+def prepare_chm_fused(chm, min_height, smooth=True, to_feet=True, smooth_window=3, out=None, block_rows=256):
+    """Smooth, convert and apply the minimum height to a canopy height model in one streaming pass.
+
+    Works through `chm` in blocks of `block_rows` rows, so temporaries are
+    block sized and each cell is read and written once. Results go into
+    `out` (a float32 array, allocated when None), which may be `chm` itself
+    to reuse a single buffer. Cells below `min_height` become NaN, so unlike
+    prepare_chm the result is already masked for local_maxima.
+    """
+    nrows = chm.shape[0]
+    if out is None:
+        out = np.empty(chm.shape, dtype=np.float32)
+    half = smooth_window // 2 if smooth else 0
+    # The rows carried into the next block come from this block alone, so a block must span the smoothing halo
+    block_rows = max(block_rows, smooth_window)
+    carry = chm[0:0]
+    for r0 in range(0, nrows, block_rows):
+        r1 = min(r0 + block_rows, nrows)
+        # Rows above the block may already be overwritten when out is chm, so they are carried over
+        raw = np.concatenate([carry, chm[r0:min(r1 + half, nrows)]]).astype(np.float32, copy=False)
+        top = carry.shape[0]
+        carry = raw[top + r1 - r0 - min(half, r1 - r0):top + r1 - r0].copy()
+        block = focal_mean(raw, smooth_window)[top:top + r1 - r0] if smooth else raw[top:top + r1 - r0]
+        dest = out[r0:r1]
+        if to_feet:
+            np.multiply(block, np.float32(FEET_PER_METER), out=dest)
+        else:
+            dest[...] = block
+        dest[~(dest >= min_height)] = np.nan
+    return out
+
+
+def cell_centers(rows, cols, geotransform):
+    """Map coordinates of the centres of the given cells"""
+    x0, dx, rx, y0, ry, dy = geotransform
+    x = x0 + (cols + 0.5) * dx + (rows + 0.5) * rx
+    y = y0 + (cols + 0.5) * ry + (rows + 0.5) * dy
+    return x, y
+
+
+def cell_indices(x, y, geotransform):
+    """Row and column of the cells containing the given map coordinates (north-up grids only)"""
+    x0, dx, _, y0, _, dy = geotransform
+    rows = np.floor((np.asarray(y) - y0) / dy).astype(np.int64)
+    cols = np.floor((np.asarray(x) - x0) / dx).astype(np.int64)
+    return rows, cols
+
+
+class CrownWidth(object):
+    """Polynomial crown width model: width = c0 + c1 * height + c2 * height ** 2 + ...
+
+    Heights are in CHM units and widths in map units, e.g. a linear model
+    CrownWidth(1.0, 0.1) gives a 7 m crown for a 60 ft tree.
+    """
+
+    def __init__(self, *coefficients):
+        if not coefficients:
+            raise ValueError("A crown width model needs at least one coefficient")
+        self.coefficients = tuple(float(c) for c in coefficients)
+
+    def __call__(self, height):
+        width = np.zeros_like(height, dtype=np.float64)
+        for c in reversed(self.coefficients):
+            width = width * height + c
+        return width
+
+
+class VariableWindow(object):
+    """Height-adaptive local maximum window.
+
+    Each cell is searched with an odd, square window as close as possible to
+    the crown width predicted for its height, clamped to
+    [min_window, max_window] cells. Pass one as the `window` of any detector
+    in place of a fixed size.
+    """
+
+    def __init__(self, crown_width, cell_size, min_window=3, max_window=21):
+        _check_size(min_window)
+        _check_size(max_window)
+        self.crown_width = crown_width
+        self.cell_size = float(cell_size)
+        if max_window > 255:
+            raise ValueError("Windows are limited to 255 cells")
+        self.min_window = min_window
+        self.max_window = max_window
+
+    def sizes(self, chm):
+        """Window size in cells for every cell of `chm`"""
+        cells = self.crown_width(np.nan_to_num(chm)) / self.cell_size
+        sizes = 2 * np.floor(cells / 2.0).astype(np.int32) + 1
+        return np.clip(sizes, self.min_window, self.max_window)
+
+
+def _half_window(window):
+    """Cells the local maximum window reaches beyond its centre"""
+    return (window.max_window if isinstance(window, VariableWindow) else window) // 2
+
+
+def _variable_maxima(chm, window):
+    """Cells equal to the maximum of their own height-dependent window.
+
+    Max filters are built once per distinct window size, each from the
+    previous, smaller one (a (b - a + 1) wide max of an a wide max is a b
+    wide max). Cells are bucketed by window size with one radix sort, so
+    every cell is compared once, against the filter for its own size.
+    """
+    valid = ~np.isnan(chm).ravel()
+    sizes = window.sizes(chm).ravel().astype(np.uint8)
+    cells = np.flatnonzero(valid)
+    cells = cells[np.argsort(sizes[cells], kind="stable")]
+    distinct, starts = np.unique(sizes[cells], return_index=True)
+    flat = chm.ravel()
+    tops = np.zeros(flat.size, dtype=bool)
+    current, current_size = np.where(np.isnan(chm), -np.inf, chm), 1
+    for size, start, stop in zip(distinct, starts, np.append(starts[1:], cells.size)):
+        for axis in (0, 1):
+            current = sliding_max(current, int(size) - current_size + 1, axis)
+        current_size = int(size)
+        bucket = cells[start:stop]
+        tops[bucket] = flat[bucket] == current.ravel()[bucket]
+    return tops.reshape(chm.shape)
+
+
+def local_maxima(chm, min_height, window=5):
+    """Boolean array of tree top cells.
+
+    A cell is a tree top when it is at least `min_height` and equals the
+    maximum of the `window` x `window` neighborhood of cells that are also
+    at least `min_height`. Cells tied for the maximum are all kept, as with
+    EqualTo in the arcpy tool. `window` is either a fixed size in cells or
+    a VariableWindow. Pass None for `min_height` when `chm` is already
+    masked (see prepare_chm_fused).
+    """
+    if min_height is not None:
+        chm = np.where(chm >= min_height, chm, np.nan)
+    if isinstance(window, VariableWindow):
+        return _variable_maxima(chm, window)
+    return ~np.isnan(chm) & (focal_max(chm, window) == chm)
+
+
+def find_tree_tops(chm, geotransform, min_height, window=5):
+    """Tree tops in an already prepared canopy height model.
+
+    Returns a TreeTops tuple of arrays. TreeIds start at 1 and follow the
+    row-major scan order used for pointid by RasterToPoint.
+    """
+    rows, cols = np.nonzero(local_maxima(chm, min_height, window))
+    x, y = cell_centers(rows, cols, geotransform)
+    return TreeTops(x, y, chm[rows, cols], np.arange(1, rows.size + 1, dtype=np.int32))
+
+
+def detect_tree_tops(chm, geotransform, min_height, smooth=True, to_feet=True, window=5, fused=False):
+    """Smooth and convert `chm`, then detect tree tops of at least `min_height` (in output units).
+
+    With `fused`, preprocessing uses prepare_chm_fused and overwrites `chm`
+    when it is already a float32 array.
+    """
+    if fused:
+        chm = np.asarray(chm, dtype=np.float32)
+        return find_tree_tops(prepare_chm_fused(chm, min_height, smooth, to_feet, out=chm), geotransform, None, window)
+    return find_tree_tops(prepare_chm(chm, smooth, to_feet), geotransform, min_height, window)
+
+
+def tile_windows(shape, tile_size, halo):
+    """Split an array of `shape` into square tiles.
+
+    Yields (core, read) pairs of (row start, row end, column start, column end)
+    windows. Cores tile the array without overlap; each read window is its core
+    grown by `halo` cells and clipped to the array.
+    """
+    nrows, ncols = shape
+    for r0 in range(0, nrows, tile_size):
+        for c0 in range(0, ncols, tile_size):
+            r1 = min(r0 + tile_size, nrows)
+            c1 = min(c0 + tile_size, ncols)
+            core = (r0, r1, c0, c1)
+            read = (max(r0 - halo, 0), min(r1 + halo, nrows), max(c0 - halo, 0), min(c1 + halo, ncols))
+            yield core, read
+
+
+def detect_tile(source, core, read, min_height, smooth=True, to_feet=True, window=5, smooth_window=3, fused=False):
+    """Detect tree tops in one tile of `source`.
+
+    Reads the `read` window, which must include a halo of at least
+    half a window (plus smooth_window // 2 when smoothing) around `core`,
+    and keeps only the tree tops inside `core`. Returns global row and
+    column indices, heights and the prepared canopy heights of the core
+    (masked to `min_height` when `fused`).
+    """
+    if fused:
+        block = np.array(source[read[0]:read[1], read[2]:read[3]], dtype=np.float32)
+        block = prepare_chm_fused(block, min_height, smooth, to_feet, smooth_window, out=block)
+        min_height = None
+    else:
+        block = prepare_chm(source[read[0]:read[1], read[2]:read[3]], smooth, to_feet, smooth_window)
+    top, left = core[0] - read[0], core[2] - read[2]
+    block_core = (slice(top, top + core[1] - core[0]), slice(left, left + core[3] - core[2]))
+    rows, cols = np.nonzero(local_maxima(block, min_height, window)[block_core])
+    chm_core = block[block_core]
+    return rows + core[0], cols + core[2], chm_core[rows, cols], chm_core
+
+
+class MemmapSource(object):
+    """Picklable, read-only memory map of a raw or .npy canopy height model file.
+
+    Unlike np.memmap, which pickles its whole contents, only the file
+    description is sent to worker processes and each worker maps the file
+    itself.
+    """
+
+    def __init__(self, filename, shape, dtype=np.float32, offset=0):
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self._map = None
+
+    def __getitem__(self, key):
+        if self._map is None:
+            self._map = np.memmap(self.filename, self.dtype, "r", self.offset, self.shape)
+        return self._map[key]
+
+    def __getstate__(self):
+        return (self.filename, self.shape, self.dtype.str, self.offset)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def _picklable_source(source):
+    if isinstance(source, np.memmap) and source.filename:
+        return MemmapSource(source.filename, source.shape, source.dtype, source.offset)
+    return source
+
+
+def _detect_tile_task(task):
+    """Worker entry point: detect one tile, dropping the core heights unless they are wanted"""
+    source, core, read, options, keep_core = task
+    rows, cols, heights, chm_core = detect_tile(source, core, read, **options)
+    return core, (rows, cols, heights), chm_core if keep_core else None
+
+
+def merge_tiles(results, geotransform):
+    """Combine per tile (rows, cols, heights) into one TreeTops tuple.
+
+    Tree tops are put back into global row-major scan order before TreeIds
+    are assigned, so ids do not depend on the tile size, tile order or
+    number of workers.
+    """
+    if not results:
+        empty = np.zeros(0)
+        return TreeTops(empty, empty, empty.astype(np.float32), empty.astype(np.int32))
+    rows = np.concatenate([r[0] for r in results])
+    cols = np.concatenate([r[1] for r in results])
+    heights = np.concatenate([r[2] for r in results])
+    order = np.lexsort((cols, rows))
+    rows, cols, heights = rows[order], cols[order], heights[order]
+    x, y = cell_centers(rows, cols, geotransform)
+    return TreeTops(x, y, heights, np.arange(1, rows.size + 1, dtype=np.int32))
+
+
+def detect_tree_tops_tiled(source, geotransform, min_height, smooth=True, to_feet=True, window=5,
+                           tile_size=2048, out=None, smooth_window=3, workers=1, fused=False):
+    """Tiled version of detect_tree_tops for canopy height models larger than memory.
+
+    `source` is any 2-D array-like with a shape and slicing, such as a
+    np.memmap, an array opened with np.load(..., mmap_mode="r") or a
+    chmraster.RasterBlockReader. Only one tile plus its halo is held in
+    memory per worker. With more than one worker, tiles are detected on a
+    process pool and each worker reads its own tile window, so the source
+    must be picklable without its data (memory maps are wrapped in a
+    MemmapSource). When `out` is given, the prepared canopy heights are
+    written into it tile by tile. `fused` selects prepare_chm_fused for
+    preprocessing each tile.
+    """
+    halo = _half_window(window) + (smooth_window // 2 if smooth else 0)
+    options = {"min_height": min_height, "smooth": smooth, "to_feet": to_feet, "window": window, "smooth_window": smooth_window,
+               "fused": fused}
+    if workers != 1:
+        source = _picklable_source(source)
+    tasks = [(source, core, read, options, out is not None) for core, read in tile_windows(source.shape, tile_size, halo)]
+    results = []
+    for core, tops, chm_core in parallel_imap(_detect_tile_task, tasks, workers):
+        results.append(tops)
+        if out is not None:
+            out[core[0]:core[1], core[2]:core[3]] = chm_core
+    return merge_tiles(results, geotransform)
+
+
+def _flood(chm, seed_rows, seed_cols, seed_ids, min_height, max_radius=None, offset=(0, 0), total_cols=None):
+    """Marker controlled watershed of the inverted canopy height model.
+
+    Seeds are flooded downhill with a heap, always growing from the highest
+    cell on the frontier, over cells of at least `min_height`, and no
+    further than `max_radius` cells from their seed. Heap ties are broken by
+    the global cell index (`offset` and `total_cols` place `chm` in the full
+    grid), so tiles reproduce the labels of a whole-raster run. Runs in
+    O(N log N) for N labelled cells. The grids stay NumPy arrays indexed cell
+    by cell, so a whole raster costs a few bytes per cell rather than Python
+    lists of it. Returns int32 labels, 0 outside crowns.
+    """
+    nrows, ncols = chm.shape
+    total_cols = total_cols or ncols
+    row_offset, col_offset = offset
+    # A one cell border of NoData removes bounds checks; cells are indexed in the padded grid
+    width = ncols + 2
+    padded = np.pad(np.asarray(chm, dtype=np.float32), 1, mode="constant", constant_values=np.nan)
+    heights = padded.ravel()
+    eligible = (padded >= min_height).ravel()
+    labels = np.zeros(heights.size, dtype=np.int32)
+    seeds = {}
+    heap = []
+    for r, c, label in zip(seed_rows.tolist(), seed_cols.tolist(), seed_ids.tolist()):
+        k = (r + 1) * width + c + 1
+        if eligible[k]:
+            labels[k] = label
+            seeds[label] = (r, c)
+            heap.append((-float(heights[k]), (r + row_offset) * total_cols + c + col_offset, k))
+    heapq.heapify(heap)
+    reach = max_radius * max_radius if max_radius else None
+    steps = [dr * width + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+    heappop, heappush = heapq.heappop, heapq.heappush
+    while heap:
+        k = heappop(heap)[2]
+        label = int(labels[k])
+        for n in [k + step for step in steps]:
+            if labels[n] or not eligible[n]:
+                continue
+            rr, cc = divmod(n, width)
+            rr, cc = rr - 1, cc - 1
+            if reach is not None:
+                sr, sc = seeds[label]
+                if (rr - sr) ** 2 + (cc - sc) ** 2 > reach:
+                    continue
+            labels[n] = label
+            heappush(heap, (-float(heights[n]), (rr + row_offset) * total_cols + cc + col_offset, n))
+    return labels.reshape(nrows + 2, width)[1:-1, 1:-1]
+
+
+def _crown_metrics(labels, chm, tree_ids, area, height, cell_area):
+    """Accumulate crown area and maximum height of labelled cells into `area` and `height`, aligned with `tree_ids`"""
+    labelled = labels > 0
+    # Labels are TreeIds, which need not be 1..n in order, so they are looked up among the sorted ids
+    order = np.argsort(tree_ids, kind="stable")
+    index = order[np.searchsorted(tree_ids, labels[labelled], sorter=order)]
+    area += np.bincount(index, minlength=tree_ids.size) * cell_area
+    np.fmax.at(height, index, chm[labelled])
+
+
+def segment_crowns(chm, trees, geotransform, min_height, max_radius=None):
+    """Crown segmentation of a prepared canopy height model, seeded by detected tree tops.
+
+    Returns a Crowns tuple: a label raster holding the TreeId of the crown
+    each cell belongs to (0 outside crowns), and crown area (map units
+    squared) and maximum height per tree, aligned with `trees`.
+    `max_radius` limits crowns to that many cells from their tree top.
+    """
+    rows, cols = cell_indices(trees.x, trees.y, geotransform)
+    labels = _flood(chm, rows, cols, trees.tree_id, min_height, max_radius)
+    ntrees = trees.tree_id.size
+    area = np.zeros(ntrees)
+    height = np.full(ntrees, np.nan, dtype=np.float32)
+    _crown_metrics(labels, chm, trees.tree_id, area, height, abs(geotransform[1] * geotransform[5]))
+    return Crowns(labels, area, height)
+
+
+def _segment_tile_task(task):
+    """Worker entry point: flood one tile and return the labels of its core"""
+    source, core, read, rows, cols, ids, min_height, max_radius, total_cols = task
+    block = np.asarray(source[read[0]:read[1], read[2]:read[3]], dtype=np.float32)
+    labels = _flood(block, rows - read[0], cols - read[2], ids, min_height, max_radius, (read[0], read[2]), total_cols)
+    top, left = core[0] - read[0], core[2] - read[2]
+    block_core = (slice(top, top + core[1] - core[0]), slice(left, left + core[3] - core[2]))
+    return core, labels[block_core], block[block_core]
+
+
+def segment_crowns_tiled(source, trees, geotransform, min_height, max_radius, tile_size=2048, out=None, workers=1):
+    """Tiled version of segment_crowns for canopy height models larger than memory.
+
+    `source` is the prepared canopy height model as any sliceable array-like
+    (see detect_tree_tops_tiled). Each tile is flooded with a halo of
+    2 * `max_radius` + 1 cells, which holds every tree top and crown that can
+    reach its core, so labels match a whole-raster run. Crown labels are
+    written into `out` tile by tile when it is given; the returned Crowns
+    tuple then has labels set to None. Unbounded crowns could reach any
+    tile, so `max_radius` is required.
+    """
+    if not max_radius:
+        raise ValueError("Tiled crown segmentation needs a maximum crown radius of at least one cell, got " + str(max_radius))
+    rows, cols = cell_indices(trees.x, trees.y, geotransform)
+    order = np.lexsort((cols, rows))
+    rows, cols, ids = rows[order], cols[order], trees.tree_id[order]
+    if workers != 1:
+        source = _picklable_source(source)
+    tasks = []
+    for core, read in tile_windows(source.shape, tile_size, 2 * max_radius + 1):
+        # Seeds are sorted by row, so each tile takes one slice and filters its columns
+        first, last = np.searchsorted(rows, [read[0], read[1]])
+        inside = (cols[first:last] >= read[2]) & (cols[first:last] < read[3])
+        tasks.append((source, core, read, rows[first:last][inside], cols[first:last][inside], ids[first:last][inside],
+                      min_height, max_radius, source.shape[1]))
+    ntrees = trees.tree_id.size
+    area = np.zeros(ntrees)
+    height = np.full(ntrees, np.nan, dtype=np.float32)
+    cell_area = abs(geotransform[1] * geotransform[5])
+    for core, labels, chm in parallel_imap(_segment_tile_task, tasks, workers):
+        _crown_metrics(labels, chm, trees.tree_id, area, height, cell_area)
+        if out is not None:
+            out[core[0]:core[1], core[2]:core[3]] = labels
+    return Crowns(None, area, height)
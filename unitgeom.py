@@ -0,0 +1,138 @@
+"""
+Tool:               <Unit geometry kernels>
+Source Name:        <unitgeom>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by units.py and rasterunits.py. Works on NumPy arrays only, so it can be run and tested without arcpy.>
+Description:        <Polygon areas by a vectorized shoelace formula over all rings at once, near polygon pairs from the
+                     grid index in spatialindex.py with an exact boundary distance test, and a vectorized union-find
+                     that merges near polygons into groups. Together they replace the AddGeometryAttributes, select and
+                     AggregatePolygons round trips of the sliver step. Polygons are lists of rings as in spatialindex.py;
+                     for the singlepart polygons used here the first ring is the outer ring and the others are holes.>
+"""
+from __future__ import division
+
+import numpy as np
+
+from spatialindex import GridIndex, _expand, polygon_bounds
+
+
+def union_find(n, a, b):
+    """Group labels 0..k-1 of n elements joined by the pairs (a[i], b[i]), numbered in order of first element.
+
+    Roots are hooked under the smaller of each joined pair and the forest
+    is flattened by pointer jumping, all as whole array operations.
+    """
+    parent = np.arange(n)
+    a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+    while a.size:
+        ra, rb = parent[a], parent[b]
+        joined = ra != rb
+        if not joined.any():
+            break
+        np.minimum.at(parent, np.maximum(ra, rb)[joined], np.minimum(ra, rb)[joined])
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def polygon_areas(polygons):
+    """Area of every polygon: the outer (first) ring less its holes.
+
+    Vertices are shifted to their ring's first vertex before the shoelace
+    sums so projected coordinates in the millions keep their precision.
+    """
+    rings = [(i, j, ring) for i, polygon in enumerate(polygons) for j, ring in enumerate(polygon)]
+    areas = np.zeros(len(polygons))
+    if not rings:
+        return areas
+    sizes = np.array([len(ring) for _, _, ring in rings])
+    vertices = np.concatenate([ring for _, _, ring in rings])
+    ringIds = np.repeat(np.arange(len(rings)), sizes)
+    starts = np.cumsum(sizes) - sizes
+    local = vertices - vertices[starts][ringIds]
+    following = np.arange(len(vertices)) + 1
+    following[np.cumsum(sizes) - 1] = starts
+    cross = local[:, 0] * local[following, 1] - local[following, 0] * local[:, 1]
+    ringAreas = np.abs(0.5 * np.bincount(ringIds, weights=cross, minlength=len(rings)))
+    outer = np.array([j == 0 for _, j, _ in rings])
+    owners = np.array([i for i, _, _ in rings])
+    return np.bincount(owners, weights=np.where(outer, ringAreas, -ringAreas), minlength=len(polygons))
+
+
+def _edges(rings):
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    return starts, ends
+
+
+def _vertices_near_edges(points, starts, ends, distance, chunk=1000000):
+    """True when any point lies within `distance` of any edge"""
+    if not len(points) or not len(starts):
+        return False
+    direction = ends - starts
+    length2 = (direction ** 2).sum(axis=1)
+    length2[length2 == 0] = 1.0
+    step = max(1, chunk // len(starts))
+    for i in range(0, len(points), step):
+        offset = points[i:i + step, None, :] - starts[None, :, :]
+        t = np.clip((offset * direction[None, :, :]).sum(axis=2) / length2, 0.0, 1.0)
+        nearest = offset - t[:, :, None] * direction[None, :, :]
+        if ((nearest ** 2).sum(axis=2) <= distance * distance).any():
+            return True
+    return False
+
+
+def _within_box(points, box, distance):
+    return points[(points[:, 0] >= box[0] - distance) & (points[:, 0] <= box[2] + distance) &
+                  (points[:, 1] >= box[1] - distance) & (points[:, 1] <= box[3] + distance)]
+
+
+def _edges_within_box(starts, ends, box, distance):
+    keep = ((np.maximum(starts[:, 0], ends[:, 0]) >= box[0] - distance) & (np.minimum(starts[:, 0], ends[:, 0]) <= box[2] + distance) &
+            (np.maximum(starts[:, 1], ends[:, 1]) >= box[1] - distance) & (np.minimum(starts[:, 1], ends[:, 1]) <= box[3] + distance))
+    return starts[keep], ends[keep]
+
+
+def polygons_within(a, b, distance):
+    """True when the boundaries of two non-overlapping polygons come within `distance` of each other.
+
+    The closest points of two segments that do not cross always include a
+    segment end, so testing the vertices of each polygon against the edges
+    of the other is exact. Only vertices and edges near the other polygon's
+    bounding box are tested.
+    """
+    boxA, boxB = polygon_bounds([a, b])
+    startsA, endsA = _edges(a)
+    startsB, endsB = _edges(b)
+    if _vertices_near_edges(_within_box(startsA, boxB, distance), *_edges_within_box(startsB, endsB, boxA, distance), distance=distance):
+        return True
+    return _vertices_near_edges(_within_box(startsB, boxA, distance), *_edges_within_box(startsA, endsA, boxB, distance), distance=distance)
+
+
+def near_pairs(polygons, distance, bounds=None):
+    """Pairs (a, b), a < b, of polygons whose boundaries come within `distance` of each other"""
+    if bounds is None:
+        bounds = polygon_bounds(polygons)
+    grown = bounds + np.array([-1, -1, 1, 1]) * (distance / 2.0)
+    a, b = GridIndex(grown).query_boxes(grown)
+    keep = a < b
+    a, b = a[keep], b[keep]
+    near = np.array([polygons_within(polygons[i], polygons[j], distance) for i, j in zip(a, b)], dtype=bool)
+    return a[near], b[near]
+
+
+def aggregate(polygons, areas, distance, min_area):
+    """Group label of every polygon after joining polygons within `distance`; -1 for groups of `min_area` or less.
+
+    Groups are numbered 0..k-1 in order of their first polygon.
+    """
+    a, b = near_pairs(polygons, distance)
+    groups = union_find(len(polygons), a, b)
+    keep = np.bincount(groups, weights=areas) > min_area
+    renumber = np.full(keep.size, -1, dtype=np.int64)
+    renumber[keep] = np.arange(keep.sum())
+    return renumber[groups]
@@ -0,0 +1,379 @@
+"""
+Tool:               <Harvest unit building>
+Source Name:        <units>
+Version:            <v1.0, ArcGIS Pro 2.8 and ArcMap 10.7>
+Author:             <Anthony Martinez>
+Usage:              <Imported by 4_UnitIdentification and 5_RefineUnits.>
+Description:        <Steps shared by the unit tools. finish_units removes slivers from singlepart candidate units and
+                     combines them by adjacency or splits them by FSVeg stand, either with ArcGIS tools or in process
+                     from coordinate arrays (unitgeom.py).
+                     The overlay engine splits the project area once by every exclusion layer (planar_overlay) and
+                     tags each face with a Mask of the layers covering it, bit i for layer i. The candidate units of a
+                     unit type are then the faces whose Mask shares no bit with the layers excluding that type, so the
+                     geometric overlay runs once per run instead of an Erase per unit type.
+                     The raster engine burns the project area and exclusion layers onto a grid instead (rasterunits.py)
+                     and only turns the units left after sliver removal back into polygons. raster_validation reports
+                     the area differences against units from the Erase engine.>
+"""
+import collections
+import os.path
+import uuid
+
+import arcpy
+import numpy
+
+import exclusions
+import featureio
+import parallel
+import rasterize
+import rasterunits
+import spatialindex
+import unitgeom
+
+# Project area cells (inside), exclusion bit flags and the grid they are burned on
+FlagGrid = collections.namedtuple("FlagGrid", ["inside", "flags", "geotransform", "spatial_reference", "cell_acres"])
+# Stands read by a pool worker for the split_by_stands call with the given token: {token: {OID: (SETTING_ID, polygon)}}
+_workerStands = {}
+
+
+def _fid_fields(fc):
+    """FID_<input> fields written by Union, in input order"""
+    return [f.name for f in arcpy.ListFields(fc) if f.name.upper().startswith("FID_")]
+
+
+def _keep_only(fc, keep):
+    """Delete every non-required field except `keep` with a single DeleteField call"""
+    fields_to_delete = [f.name for f in arcpy.ListFields(fc) if not f.required and f.name not in keep]
+    if fields_to_delete:
+        arcpy.DeleteField_management(fc, fields_to_delete)
+
+
+def planar_overlay(projectArea, layers, out):
+    """Split projectArea by all `layers` in one Union and store the covering layers of each face as a bit Mask.
+
+    Faces outside the project area are dropped. Returns `out`, a polygon
+    feature class with a LONG Mask field (so at most 31 layers).
+    """
+    if len(layers) > 31:
+        raise ValueError("The overlay engine supports at most 31 exclusion layers")
+    arcpy.AddMessage("Overlaying the project area with " + str(len(layers)) + " exclusion layers...")
+    arcpy.analysis.Union(in_features = [projectArea] + list(layers), out_feature_class = out, join_attributes = "ONLY_FID")
+    fids = _fid_fields(out)
+    arcpy.management.AddField(in_table = out, field_name = "Mask", field_type = "LONG")
+    with arcpy.da.UpdateCursor(out, fids + ["Mask"]) as cursor:
+        for row in cursor:
+            if row[0] == -1:
+                cursor.deleteRow()
+                continue
+            row[-1] = sum(1 << i for i, fid in enumerate(row[1:-1]) if fid != -1)
+            cursor.updateRow(row)
+    _keep_only(out, ["Mask"])
+    return out
+
+
+def add_overlay_layer(faces, layer, bit, out):
+    """Split the faces of an overlay by one more layer, setting `bit` in the Mask of the faces it covers"""
+    arcpy.analysis.Union(in_features = [faces, layer], out_feature_class = out, join_attributes = "ALL")
+    fids = _fid_fields(out)
+    with arcpy.da.UpdateCursor(out, [fids[0], fids[1], "Mask"]) as cursor:
+        for row in cursor:
+            if row[0] == -1:
+                cursor.deleteRow()
+                continue
+            if row[1] != -1:
+                row[2] |= 1 << bit
+                cursor.updateRow(row)
+    _keep_only(out, ["Mask"])
+    return out
+
+
+def overlay_candidates(faces, exclude, out):
+    """Singlepart candidate units: the dissolved faces whose Mask has none of the bits in `exclude`"""
+    masks = set(row[0] for row in arcpy.da.SearchCursor(faces, ["Mask"]))
+    keep = sorted(mask for mask in masks if not mask & exclude)
+    where = "Mask IN (" + ", ".join(str(mask) for mask in keep) + ")" if keep else "1 = 0"
+    arcpy.MakeFeatureLayer_management(faces, "faces", where)
+    arcpy.management.Dissolve(in_features = "faces", out_feature_class = out, multi_part = "SINGLE_PART")
+    arcpy.Delete_management("faces")
+    return out
+
+
+def finish_units(split, sliverSize, standSplit, clipVegPoly, outIdentity, sliverEngine="", workers=""):
+    """Drop slivers from singlepart candidate units and combine them by adjacency or split them by stand.
+
+    sliverEngine "NumPy" runs the sliver, adjacency and stand split steps in
+    process (_numpy_slivers), splitting by stand on up to `workers`
+    processes; the default uses ArcGIS tools as before.
+    Returns `outIdentity`, with an Acres field (and SETTING_ID when split by stand).
+    """
+    if sliverEngine.lower() == 'numpy':
+        return _numpy_slivers(split, sliverSize, standSplit, clipVegPoly, outIdentity, workers)
+    _arcgis_slivers(split, sliverSize, standSplit, clipVegPoly, outIdentity)
+
+    ## Delete unnecessary fields
+    _keep_only(outIdentity, ["SETTING_ID"] if standSplit.lower() == 'true' else [])
+
+    ## Add Acres field
+    arcpy.AddGeometryAttributes_management(Input_Features = outIdentity, Geometry_Properties = "AREA", Area_Unit = "ACRES")
+    arcpy.management.AlterField(in_table = outIdentity, field = "POLY_AREA", new_field_name = "Acres")
+    return outIdentity
+
+
+def _arcgis_slivers(split, sliverSize, standSplit, clipVegPoly, outIdentity):
+    ## Remove all < 2 acre slivers (or as specified)
+    ## (This method ensures that slivers adjacent to larger units are preserved)
+    sliverQuery = " POLY_AREA > " + str(sliverSize) + " "
+    arcpy.AddGeometryAttributes_management(Input_Features = split, Geometry_Properties = "AREA", Area_Unit = "ACRES")
+    arcpy.MakeFeatureLayer_management(split, "units")
+    arcpy.SelectLayerByAttribute_management("units", "NEW_SELECTION", sliverQuery)
+
+    ## Combine/split polygons by adjacency or by stand
+    if standSplit.lower() == 'true':
+        ### Combine all into one multipart polygon
+        arcpy.management.Dissolve(in_features = "units", out_feature_class = r'in_memory\Acre')
+
+        ### Split by FSVeg stands
+        arcpy.analysis.Identity(in_features = r'in_memory\Acre', identity_features = clipVegPoly, out_feature_class = outIdentity)
+    else:
+        ### Combine adjecent units
+        arcpy.cartography.AggregatePolygons("units", outIdentity, "5 Meters")
+    arcpy.Delete_management("units")
+
+
+def _create_units(out, spatialReference, fields=()):
+    """Empty unit feature class with `fields` (name, type, length) and an Acres field"""
+    if arcpy.Exists(out):
+        arcpy.Delete_management(out)
+    arcpy.CreateFeatureclass_management(os.path.dirname(out), os.path.basename(out), "POLYGON", spatial_reference = spatialReference)
+    for name, fieldType, length in fields:
+        arcpy.management.AddField(in_table = out, field_name = name, field_type = fieldType, field_length = length)
+    arcpy.management.AddField(in_table = out, field_name = "Acres", field_type = "DOUBLE")
+    return out
+
+
+def _write_groups(shapes, groups, acres, spatialReference, out):
+    """One multipart polygon per group of shapes (group -1 is dropped), with the summed acres"""
+    _create_units(out, spatialReference)
+    order = numpy.argsort(groups, kind = "stable")
+    bounds = numpy.searchsorted(groups[order], numpy.arange(groups.max() + 2 if groups.size else 1))
+    with arcpy.da.InsertCursor(out, ["SHAPE@", "Acres"]) as cursor:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parts = arcpy.Array([part for i in order[start:stop] for part in shapes[i]])
+            cursor.insertRow([arcpy.Polygon(parts, spatialReference), float(acres[order[start:stop]].sum())])
+
+
+def _read_stands(source, spatialReference):
+    """OID -> (SETTING_ID, polygon) of the stands in `source`, in the spatial reference given as a string"""
+    reference = arcpy.SpatialReference()
+    reference.loadFromString(spatialReference)
+    with arcpy.da.SearchCursor(source, ["OID@", "SETTING_ID", "SHAPE@"], spatial_reference = reference) as rows:
+        return dict((row[0], (row[1], row[2])) for row in rows if row[2] is not None)
+
+
+def _split_unit(stands, task):
+    """Pieces of one unit part in each stand it touches, and the piece outside every stand (SETTING_ID None).
+
+    The unit comes as Esri JSON and its stands as object IDs in `stands`.
+    Returns a list of (unit, SETTING_ID, geometry JSON, area) records.
+    """
+    unit, unitJson, standIds, call = task
+    shape = arcpy.AsShape(unitJson, True)
+    remainder = shape
+    records = []
+    for standId in standIds:
+        settingId, stand = stands[standId]
+        piece = shape.intersect(stand, 4)
+        if piece.area > 0:
+            records.append((unit, settingId, piece.JSON, piece.area))
+            remainder = remainder.difference(stand)
+    if remainder.area > 0:
+        records.append((unit, None, remainder.JSON, remainder.area))
+    return records
+
+
+def _split_unit_task(task):
+    """Worker entry point of _split_unit; the worker reads the stands once for the call whose token the task carries"""
+    token, source, spatialReference = task[3]
+    if token not in _workerStands:
+        _workerStands.clear()
+        _workerStands[token] = _read_stands(source, spatialReference)
+    return _split_unit(_workerStands[token], task)
+
+
+def split_by_stands(shapes, clipVegPoly, spatialReference, outIdentity, workers=""):
+    """Split unit parts by FSVeg stands without dissolving them first, like Identity with the stands.
+
+    A grid index over the stand extents pairs each unit part with only the
+    stands it touches; each part and the object IDs of its stands are
+    intersected on a worker pool and the (SETTING_ID, geometry, acres)
+    records are streamed into `outIdentity` as they arrive. Work grows with
+    the number of touching pairs rather than with the size of one dissolved
+    polygon. The stands are read again for every call, and each worker reads
+    them once per call, identified by a token, so no call uses the stands of
+    an earlier one.
+    """
+    standField = [f for f in arcpy.ListFields(clipVegPoly) if f.name == "SETTING_ID"][0]
+    fieldType = featureio.FIELD_TYPES.get(standField.type, "TEXT")
+    # Workers read the stands from the data path, so this process reads them the same way
+    source = arcpy.Describe(clipVegPoly).catalogPath
+    if parallel.worker_count(workers) > 1 and source.lower().split("\\")[0] in ("in_memory", "memory"):
+        source = arcpy.CopyFeatures_management(source, arcpy.CreateScratchName("stands", "", "FeatureClass", arcpy.env.scratchGDB))[0]
+    reference = spatialReference.exportToString()
+    stands = _read_stands(source, reference)
+    standIds = numpy.array(sorted(stands))
+    units, standIndex = spatialindex.GridIndex(featureio.extent_bounds([stands[i][1] for i in standIds])).query_boxes(featureio.extent_bounds(shapes))
+    bounds = numpy.searchsorted(units, numpy.arange(len(shapes) + 1))
+    call = (uuid.uuid4().hex, source, reference)
+    tasks = ((i, shapes[i].JSON, standIds[standIndex[bounds[i]:bounds[i + 1]]].tolist(), call) for i in range(len(shapes)))
+    acresPerArea = spatialReference.metersPerUnit ** 2 / rasterunits.ACRE_SQ_METERS
+
+    _create_units(outIdentity, spatialReference, [("SETTING_ID", fieldType, standField.length)])
+    arcpy.AddMessage("Splitting " + str(len(shapes)) + " units by stand (" + str(len(units)) + " touching pairs)...")
+    with arcpy.da.InsertCursor(outIdentity, ["SHAPE@", "SETTING_ID", "Acres"]) as cursor:
+        # In this process the stands just read are used directly
+        if parallel.worker_count(workers) <= 1:
+            results = (_split_unit(stands, task) for task in tasks)
+        else:
+            results = parallel.parallel_imap(_split_unit_task, tasks, workers)
+        for records in results:
+            for unit, settingId, geometry, area in records:
+                cursor.insertRow([arcpy.AsShape(geometry, True), settingId, area * acresPerArea])
+    # parallel_imap runs a single task in this process, which then holds the stands like a worker
+    _workerStands.clear()
+    return outIdentity
+
+
+def _numpy_slivers(split, sliverSize, standSplit, clipVegPoly, outIdentity, workers=""):
+    """Sliver removal and 5 m aggregation from coordinate arrays (unitgeom.py), with no intermediate layers.
+
+    Parts within 5 m of each other are grouped and groups of sliverSize acres
+    or less are dropped, so slivers next to larger units are kept. Unlike
+    AggregatePolygons the gaps between grouped parts are not filled; a unit
+    is the multipart polygon of its parts. With standSplit the parts over
+    sliverSize acres are kept and split by stand (split_by_stands).
+    """
+    spatialReference = arcpy.Describe(split).spatialReference
+    shapes = [row[0] for row in arcpy.da.SearchCursor(split, ["SHAPE@"]) if row[0] is not None]
+    polygons = [featureio.geometry_rings(shape) for shape in shapes]
+    acres = unitgeom.polygon_areas(polygons) * spatialReference.metersPerUnit ** 2 / rasterunits.ACRE_SQ_METERS
+    if standSplit.lower() == 'true':
+        ### Split the units over the sliver size by FSVeg stands
+        keep = numpy.flatnonzero(acres > float(sliverSize))
+        return split_by_stands([shapes[i] for i in keep], clipVegPoly, spatialReference, outIdentity, workers)
+    ### Combine units within 5 meters and drop small groups
+    groups = unitgeom.aggregate(polygons, acres, 5.0 / spatialReference.metersPerUnit, float(sliverSize))
+    _write_groups(shapes, groups, acres, spatialReference, outIdentity)
+    return outIdentity
+
+
+def flag_grid(projectArea, layers, cellSize):
+    """Burn the project area and each exclusion layer (bit i for layers[i]) onto a grid of cellSize map units"""
+    spatialReference = arcpy.Describe(projectArea).spatialReference
+    cellSize = float(cellSize)
+    arcpy.AddMessage("Burning " + str(len(layers)) + " exclusion layers onto a " + str(cellSize) + " unit grid...")
+    projectPolygons = featureio.read_polygons(projectArea)[0]
+    bounds = spatialindex.polygon_bounds(projectPolygons)
+    shape, geotransform = rasterunits.grid_for((numpy.nanmin(bounds[:, 0]), numpy.nanmin(bounds[:, 1]),
+                                                numpy.nanmax(bounds[:, 2]), numpy.nanmax(bounds[:, 3])), cellSize)
+    inside = rasterunits.burn_mask(projectPolygons, shape, geotransform)
+    layers = [featureio.read_polygons(layer, spatialReference = spatialReference)[0] for layer in layers]
+    flags = rasterunits.burn_flags(layers, shape, geotransform)
+    cellAcres = (cellSize * spatialReference.metersPerUnit) ** 2 / rasterunits.ACRE_SQ_METERS
+    return FlagGrid(inside, flags, geotransform, spatialReference, cellAcres)
+
+
+def _year(value):
+    """A fiscal year held as a number or as text; 0 when it is missing or not a number"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def sweep_grids(projectArea, layers, clipHarvest, clipLidarSummary, clipVegPoly, cellSize):
+    """The flag grid of `layers` and the grids sweep.py needs for the parameters it varies.
+
+    harvest_year holds the latest FY_COMPLETED of the regen harvests (the
+    ACTIVITY_CODE LIKE '41%' rule) over each cell, 0 for none. tpa_zone and
+    stand_zone hold the index of the lidar summary stand and FSVeg stand of
+    each cell (-1 for none), with the Regen_TPA and CT_TPA of every lidar
+    summary stand (NaN for nulls). Returns (grids, FlagGrid).
+    """
+    grid = flag_grid(projectArea, layers, cellSize)
+    shape = grid.inside.shape
+    grids = {"inside": grid.inside, "flags": grid.flags, "harvest_year": numpy.zeros(shape, dtype = numpy.int32)}
+    if arcpy.Exists(clipHarvest):
+        polygons, values = featureio.read_polygons(clipHarvest, ["ACTIVITY_CODE", "FY_COMPLETED"], spatialReference = grid.spatial_reference)
+        years = numpy.array([_year(year) if exclusions._compare(code, "LIKE", "41%") else 0
+                             for code, year in zip(values["ACTIVITY_CODE"], values["FY_COMPLETED"])], dtype = numpy.int32)
+        # Latest first, so it wins where harvests overlap
+        order = numpy.argsort(-years, kind = "stable")
+        grids["harvest_year"] = rasterize.rasterize_polygons([polygons[i] for i in order], years[order], shape, grid.geotransform, fill = 0)
+
+    grids["tpa_zone"] = numpy.full(shape, -1, dtype = numpy.int32)
+    grids["regen_tpa"] = grids["ct_tpa"] = numpy.zeros(0)
+    if arcpy.Exists(clipLidarSummary):
+        polygons, values = featureio.read_polygons(clipLidarSummary, ["Regen_TPA", "CT_TPA"], spatialReference = grid.spatial_reference)
+        grids["tpa_zone"] = rasterize.rasterize_polygons(polygons, numpy.arange(len(polygons)), shape, grid.geotransform)
+        grids["regen_tpa"] = numpy.array([numpy.nan if v is None else v for v in values["Regen_TPA"]], dtype = numpy.float64)
+        grids["ct_tpa"] = numpy.array([numpy.nan if v is None else v for v in values["CT_TPA"]], dtype = numpy.float64)
+
+    grids["stand_zone"] = numpy.full(shape, -1, dtype = numpy.int32)
+    if arcpy.Exists(clipVegPoly):
+        polygons = featureio.read_polygons(clipVegPoly, spatialReference = grid.spatial_reference)[0]
+        grids["stand_zone"] = rasterize.rasterize_polygons(polygons, numpy.arange(len(polygons)), shape, grid.geotransform)
+    return grids, grid
+
+
+def add_grid_layer(grid, layer, bit):
+    """Burn one more layer into `bit` of the flag grid"""
+    polygons = featureio.read_polygons(layer, spatialReference = grid.spatial_reference)[0]
+    rasterunits.burn_flags([polygons], grid.inside.shape, grid.geotransform, flags = grid.flags, first_bit = bit)
+
+
+def grid_polygons(labels, grid, out):
+    """Polygons of the labelled cells (0 is none) with a gridcode field holding the label"""
+    if not labels.any():
+        arcpy.CreateFeatureclass_management(os.path.dirname(out), os.path.basename(out), "POLYGON", spatial_reference = grid.spatial_reference)
+        return out
+    x0, dx, _, y0, _, dy = grid.geotransform
+    lowerLeft = arcpy.Point(x0, y0 + labels.shape[0] * dy)
+    scratch = arcpy.CreateScratchName("units", ".tif", "RasterDataset", arcpy.env.scratchFolder)
+    arcpy.management.CopyRaster(arcpy.NumPyArrayToRaster(labels, lowerLeft, dx, -dy, 0), scratch)
+    arcpy.management.DefineProjection(scratch, grid.spatial_reference)
+    arcpy.conversion.RasterToPolygon(scratch, out, "NO_SIMPLIFY", "Value")
+    arcpy.Delete_management(scratch)
+    return out
+
+
+def grid_candidates(grid, exclude, sliverSize, out):
+    """Singlepart candidate units over the sliver size from the cells free of the exclusion bits in `exclude`"""
+    labels, count = rasterunits.extract_units(grid.inside, grid.flags, exclude, grid.cell_acres, sliverSize)
+    arcpy.AddMessage("Found " + str(count) + " candidate units on the grid")
+    return grid_polygons(labels, grid, out)
+
+
+def _total_acres(fc):
+    return sum(row[0] or 0 for row in arcpy.da.SearchCursor(fc, ["Acres"]))
+
+
+def _burn(fc, grid):
+    polygons = featureio.read_polygons(fc, spatialReference = grid.spatial_reference)[0]
+    return rasterunits.burn_mask(polygons, grid.inside.shape, grid.geotransform)
+
+
+def raster_validation(grid, rasterUnits, vectorUnits, unitType):
+    """Report the area differences between raster engine units and vector engine units.
+
+    Total acres are exact polygon areas; the overlap figures compare both
+    unit sets burned onto the engine's grid.
+    """
+    report = rasterunits.area_report(_burn(rasterUnits, grid), _burn(vectorUnits, grid), grid.cell_acres)
+    report["raster_acres"], report["vector_acres"] = _total_acres(rasterUnits), _total_acres(vectorUnits)
+    difference = report["raster_acres"] - report["vector_acres"]
+    arcpy.AddMessage(unitType + " units, raster vs vector engine:")
+    arcpy.AddMessage("    Acres: " + str(round(report["raster_acres"], 2)) + " vs " + str(round(report["vector_acres"], 2)) +
+                     (" (" + str(round(100.0 * difference / report["vector_acres"], 2)) + "%)" if report["vector_acres"] else ""))
+    arcpy.AddMessage("    Acres in both: " + str(round(report["both"], 2)) + ", raster only: " + str(round(report["raster_only"], 2)) +
+                     ", vector only: " + str(round(report["reference_only"], 2)))
+    return report